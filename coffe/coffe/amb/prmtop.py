@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+"""Reading and editing Amber topology (prmtop) files"""
+
+from __future__ import absolute_import, division, print_function
+
+import re
+
+import numpy as np
+
+
+class AmberPrmtop(object):
+    """An Amber topology file.
+
+    The file is kept as a list of sections (one per %FLAG), so that
+    sections that are changed via :meth:`~set` are reformatted and all
+    others are written back as they were.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename (str): The prmtop file.
+        """
+        self.filename = filename
+        self._header = []
+        self._flags = []
+        self._sections = {}
+        with open(filename, "r") as f:
+            flag = None
+            for line in f:
+                if line.startswith("%FLAG"):
+                    flag = line.split()[1]
+                    self._flags.append(flag)
+                    self._sections[flag] = {"format": None, "lines": []}
+                elif flag is None:
+                    self._header.append(line)
+                elif line.startswith("%FORMAT"):
+                    self._sections[flag]["format"] = line.rstrip("\n")
+                else:
+                    self._sections[flag]["lines"].append(line.rstrip("\n"))
+
+    def __contains__(self, flag):
+        return flag in self._sections
+
+    def get(self, flag):
+        """Parse a section.
+
+        Args:
+            flag (str): The flag, e.g. "LENNARD_JONES_ACOEF".
+
+        Returns:
+            list: The values (int, float, or str, depending on the format).
+        """
+        n, kind, width = _parse_format(self._sections[flag]["format"])
+        values = []
+        for line in self._sections[flag]["lines"]:
+            for i in range(0, len(line), width):
+                item = line[i:i + width]
+                if kind == "a":
+                    values.append(item.strip())
+                elif item.strip():
+                    values.append(int(item) if kind == "I" else float(item))
+        return values
+
+    def set(self, flag, values):
+        """Replace the values of a section.
+
+        Args:
+            flag (str): The flag, e.g. "LENNARD_JONES_ACOEF".
+            values (list): The new values, formatted like the old ones.
+        """
+        fmt = self._sections[flag]["format"]
+        n, kind, width = _parse_format(fmt)
+        decimals = re.search(r"E\d+\.(\d+)", fmt)
+        items = []
+        for v in values:
+            if kind == "a":
+                items.append("{:<{w}s}".format(v, w=width))
+            elif kind == "I":
+                items.append("{:>{w}d}".format(int(v), w=width))
+            else:
+                items.append("{:>{w}.{d}E}".format(float(v), w=width,
+                                                   d=int(decimals.group(1))))
+        self._sections[flag]["lines"] = ["".join(items[i:i + n])
+                                         for i in range(0, len(items), n)]
+
+    def write(self, filename):
+        """Write the topology to a file."""
+        with open(filename, "w") as f:
+            f.writelines(self._header)
+            for flag in self._flags:
+                f.write("%FLAG {:<74s}\n".format(flag))
+                f.write("{}\n".format(self._sections[flag]["format"]))
+                for line in self._sections[flag]["lines"]:
+                    f.write(line + "\n")
+
+    @property
+    def n_types(self):
+        """int: Number of Lennard-Jones atom types."""
+        return self.get("POINTERS")[1]
+
+    def lj_type_parameters(self):
+        """The Lennard-Jones parameters of the atom types, as recovered from
+        the diagonal of the coefficient tables.
+
+        Returns:
+            dict: Amber atom type names and pairs (rmin/2 in Angstrom,
+            epsilon in kcal/mol).
+        """
+        acoef = np.array(self.get("LENNARD_JONES_ACOEF"))
+        bcoef = np.array(self.get("LENNARD_JONES_BCOEF"))
+        index = self._pair_index()
+        names = self.get("AMBER_ATOM_TYPE")
+        type_index = self.get("ATOM_TYPE_INDEX")
+        params = {}
+        for name, i in zip(names, type_index):
+            a, b = acoef[index[i - 1, i - 1]], bcoef[index[i - 1, i - 1]]
+            if a == 0 or b == 0:
+                params[name] = (0.0, 0.0)
+            else:
+                params[name] = ((2 * a / b)**(1.0 / 6.0) / 2, b * b / (4 * a))
+        return params
+
+    def lj_type_names(self):
+        """The Amber atom type names of each Lennard-Jones type index.
+        tleap merges atom types with identical Lennard-Jones parameters into
+        one type index.
+
+        Returns:
+            list of list of str: The names per (0-based) type index.
+        """
+        names = [[] for i in range(self.n_types)]
+        for name, i in zip(self.get("AMBER_ATOM_TYPE"),
+                           self.get("ATOM_TYPE_INDEX")):
+            if name not in names[i - 1]:
+                names[i - 1].append(name)
+        return names
+
+    def set_lj_parameters(self, params):
+        """Change the Lennard-Jones parameters of atom types.
+
+        The coefficients of all pairs that involve a changed type are
+        recomputed with Lorentz-Berthelot combination rules. Pairs of
+        unchanged types keep their coefficients.
+
+        Args:
+            params (dict): Amber atom type names and pairs (rmin/2 in
+                Angstrom, epsilon in kcal/mol).
+
+        Raises:
+            ValueError: If a changed type shares its type index with other
+                types (see :func:`~lj_parameters_by_index`).
+        """
+        acoef = np.array(self.get("LENNARD_JONES_ACOEF"))
+        bcoef = np.array(self.get("LENNARD_JONES_BCOEF"))
+        index = self._pair_index()
+        old = self.lj_type_parameters()
+        type_names = self.lj_type_names()
+        changed = lj_parameters_by_index(type_names, params)
+        types = [i for i, names in enumerate(type_names) if names]
+        for i in types:
+            for j in types:
+                if i > j or (i not in changed and j not in changed):
+                    continue
+                ri, ei = changed.get(i, old[type_names[i][0]])
+                rj, ej = changed.get(j, old[type_names[j][0]])
+                rmin, eps = ri + rj, np.sqrt(ei * ej)
+                acoef[index[i, j]] = eps * rmin**12
+                bcoef[index[i, j]] = 2 * eps * rmin**6
+        self.set("LENNARD_JONES_ACOEF", acoef)
+        self.set("LENNARD_JONES_BCOEF", bcoef)
+
+    def nonbonded_pairs(self, atoms=None):
+        """The atom pairs that interact through the nonbonded terms.
+
+        Excluded pairs (bonded through bonds, angles, or dihedrals) are left
+        out, except for the 1-4 pairs of dihedrals, whose Lennard-Jones
+        interaction is scaled by 1/SCNB.
+
+        Args:
+            atoms (list): Restrict the pairs to these atoms (0-based
+                indices). Default: all atoms.
+
+        Returns:
+            A triple (i, j, scale) of np.arrays with 0-based atom indices
+            i < j and the scaling factors of the Lennard-Jones energies.
+        """
+        n_atoms = self.get("POINTERS")[0]
+        atoms = np.arange(n_atoms) if atoms is None else np.unique(atoms)
+        i, j = np.triu_indices(len(atoms), k=1)
+        i, j = atoms[i], atoms[j]
+        keys = i * n_atoms + j
+        scale = np.where(np.isin(keys, self._excluded_keys()), 0.0, 1.0)
+        keys14, scale14 = self._keys_14()
+        found = np.searchsorted(keys, keys14)
+        valid = found < len(keys)
+        valid[valid] = keys[found[valid]] == keys14[valid]
+        scale[found[valid]] = scale14[valid]
+        interacting = scale > 0
+        return i[interacting], j[interacting], scale[interacting]
+
+    def _excluded_keys(self):
+        """np.array: The excluded pairs (i, j) as keys i*n_atoms + j."""
+        n_atoms = self.get("POINTERS")[0]
+        counts = self.get("NUMBER_EXCLUDED_ATOMS")
+        owner = np.repeat(np.arange(n_atoms), counts)
+        partner = np.array(self.get("EXCLUDED_ATOMS_LIST")) - 1
+        # atoms without exclusions have a single entry 0
+        owner, partner = owner[partner >= 0], partner[partner >= 0]
+        return (np.minimum(owner, partner) * n_atoms +
+                np.maximum(owner, partner))
+
+    def _keys_14(self):
+        """The 1-4 pairs as keys i*n_atoms + j and their scaling factors."""
+        n_atoms = self.get("POINTERS")[0]
+        dihedrals = np.array(self.get("DIHEDRALS_INC_HYDROGEN") +
+                             self.get("DIHEDRALS_WITHOUT_HYDROGEN"),
+                             dtype=int).reshape(-1, 5)
+        # a negative third index marks dihedrals whose 1-4 pair is not
+        # computed (duplicates), a negative fourth index marks impropers
+        dihedrals = dihedrals[(dihedrals[:, 2] >= 0) & (dihedrals[:, 3] >= 0)]
+        first = np.abs(dihedrals[:, 0]) // 3
+        last = np.abs(dihedrals[:, 3]) // 3
+        if "SCNB_SCALE_FACTOR" in self:
+            scnb = np.array(self.get("SCNB_SCALE_FACTOR"))[dihedrals[:, 4] - 1]
+        else:
+            scnb = np.full(len(dihedrals), 2.0)
+        keys = np.minimum(first, last) * n_atoms + np.maximum(first, last)
+        keys, unique = np.unique(keys, return_index=True)
+        return keys, 1.0 / scnb[unique]
+
+    def _pair_index(self):
+        """np.array: Indices of the type pairs in the coefficient tables."""
+        n = self.n_types
+        index = np.array(self.get("NONBONDED_PARM_INDEX")).reshape(n, n)
+        return index - 1
+
+
+def lj_parameters_by_index(type_names, params):
+    """Assign the Lennard-Jones parameters of atom types to type indices.
+
+    A type index that covers several atom types (see
+    :meth:`AmberPrmtop.lj_type_names`) can only be changed as a whole:
+    all of its types have to be changed, and to the same parameters.
+
+    Args:
+        type_names (list of list of str): The names per type index.
+        params (dict): Amber atom type names and pairs (rmin/2 in Angstrom,
+            epsilon in kcal/mol). Both can be arrays.
+
+    Returns:
+        dict: The parameters of the (0-based) type indices that are changed.
+
+    Raises:
+        ValueError: If an index covers a changed and an unchanged type, or
+            two types that are changed to different parameters.
+    """
+    by_index = {}
+    for i, names in enumerate(type_names):
+        changed = [name for name in names if name in params]
+        if not changed:
+            continue
+        unchanged = [name for name in names if name not in params]
+        if unchanged:
+            raise ValueError(
+                "Atom types {} share a Lennard-Jones type index with {}, because they "
+                "had the same parameters when the topology was built. They cannot "
+                "be changed separately.".format(changed, unchanged))
+        for name in changed[1:]:
+            if not all(np.array_equal(a, b) for a, b in zip(params[name], params[changed[0]])):
+                raise ValueError(
+                    "Atom types {} share a Lennard-Jones type index, but are changed to "
+                    "different parameters.".format(changed))
+        by_index[i] = params[changed[0]]
+    return by_index
+
+
+def read_amber_coordinates(filename):
+    """Read the coordinates from an Amber coordinate or restart file.
+
+    Both the ASCII format (written by tleap) and the NetCDF format
+    (written by sander) are supported.
+
+    Args:
+        filename (str): The inpcrd or restart file.
+
+    Returns:
+        np.array: The coordinates in Angstrom, shape (n_atoms, 3).
+    """
+    with open(filename, "rb") as f:
+        netcdf = f.read(3) == b"CDF"
+    if netcdf:
+        from scipy.io import netcdf_file
+        with netcdf_file(filename, "r", mmap=False) as f:
+            return np.array(f.variables["coordinates"].data, dtype=float)
+    with open(filename, "r") as f:
+        lines = f.readlines()
+    n_atoms = int(lines[1].split()[0])
+    values = []
+    for line in lines[2:]:
+        line = line.rstrip("\n")
+        values.extend(float(line[k:k + 12]) for k in range(0, len(line), 12)
+                      if line[k:k + 12].strip())
+        if len(values) >= 3 * n_atoms:
+            break
+    return np.array(values[:3 * n_atoms]).reshape(n_atoms, 3)
+
+
+def _parse_format(fmt):
+    """Parse a fortran format like %FORMAT(5E16.8).
+
+    Returns:
+        A triple (items per line, kind ("a", "I", or "E"), width).
+    """
+    match = re.match(r"%FORMAT\((\d+)([aIE])(\d+)", fmt)
+    assert match is not None, "Unsupported format {}".format(fmt)
+    return int(match.group(1)), match.group(2), int(match.group(3))
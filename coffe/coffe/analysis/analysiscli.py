@@ -7,13 +7,12 @@ from __future__ import absolute_import, division, print_function
 import ast
 import click
 import os
-import pandas as pd
 
-from coffe.analysis import relative_energies
-from coffe.analysis import rmsd
-from coffe.analysis import pdb_reader
 from coffe.core import filesys
 
+# the analysis modules depend on pandas and pytraj; they are imported by the
+# commands, so that loading this module (e.g. for --help) stays cheap
+
 
 @click.command()
 @click.option('--inputfile', '-i',
@@ -35,6 +34,7 @@ def relative_energy_csv(inputfile, convert, outfilename):
         convert (str): [no] conversion from Hartree to kcal/mol
         outfilename (str): [Energies_rel.csv] output file
     """
+    from coffe.analysis import relative_energies
     relative_energies.relative_energies_csv(inputfile, convert, outfilename)
 
 
@@ -59,6 +59,7 @@ def rmsd_pdb_csv(inputfiles, outputfile, work_dir):
         'directory/molecule-2.pdb']" -o test.csv
     """
     # ast.literal_eval is used to parse the input string to a list
+    from coffe.analysis import rmsd
     rmsd.rmsd_individual_csv(ast.literal_eval(inputfiles), outputfile, work_dir)
 
 
@@ -82,6 +83,8 @@ def compute_distance(inputpdb, name, atoms):
         "--atoms/-a must be a string of two atomnames, e.g. C1,C5"
     click.echo("Computing {} ({}) distance from {}\n"
                .format(atomlist_cleaned, name, ', '.join(inputpdb)))
+    import pandas as pd
+    from coffe.analysis import pdb_reader
     distances = pd.DataFrame([])
     for pdbfile in inputpdb:
         distances = distances.append(
@@ -113,6 +116,8 @@ def compute_angle(inputpdb, name, atoms):
         "--atoms/-a must be a string of three atomnames, e.g. C1,C5,C8"
     click.echo("Computing {} ({}) angle from {}\n"
                .format(atomlist_cleaned, name, ', '.join(inputpdb)))
+    import pandas as pd
+    from coffe.analysis import pdb_reader
     angles = pd.DataFrame([])
     for pdbfile in inputpdb:
         angles = angles.append(
@@ -146,6 +151,8 @@ def compute_dihedral(inputpdb, name, atoms):
         "--atoms/-a must be a string of four atomnames, e.g. C1,C5,C8,C11"
     click.echo("Computing {} ({}) dihedral from {}\n"
                .format(atomlist_cleaned, name, ', '.join(inputpdb)))
+    import pandas as pd
+    from coffe.analysis import pdb_reader
     dihedrals = pd.DataFrame([])
     for pdbfile in inputpdb:
         dihedrals = dihedrals.append(
@@ -183,6 +190,8 @@ def compute_conformation(inputpdb, confdef, confout, work_dir):
 
     click.echo("Computing conformation from {}\n"
                .format(', '.join(pdb for pdb in inputpdb)))
+    import pandas as pd
+    from coffe.analysis import pdb_reader
     conformations = pd.DataFrame([])
     for pdbfile in inputpdb:
         conformations = conformations.append(
@@ -4,22 +4,44 @@
 
 from __future__ import absolute_import, division, print_function
 
+import importlib
+import sys
+
 import coffe
 import click
-import sys
-import pandas
 
 from coffe.core import globconf
 from coffe.core.globconf import CONFIG
-from coffe.analysis import analysiscli
-from coffe.gmx import gmxcli
-from coffe.quantum import quantumcli
-from coffe.misc import misccli
-from coffe.core import corecli
 from coffe.core import saver, thirdparty, coffedir
 from coffe.core.graffiti import *
 
 
+class LazyGroup(click.Group):
+    """A group of commands that are imported on first use.
+
+    The commands are given as a dictionary :code:`lazy_subcommands`
+    {command name: "module:attribute"}, so that commands that run on
+    compute nodes (e.g. :code:`coffe core update-cluster-status`) do not
+    import the modules (and dependencies like pandas, pytraj, or
+    matplotlib) of all other commands.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_subcommands = kwargs.pop("lazy_subcommands", {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        commands = super(LazyGroup, self).list_commands(ctx)
+        return sorted(commands + list(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            module_name, attribute = self.lazy_subcommands[cmd_name].split(":")
+            module = importlib.import_module(module_name)
+            return getattr(module, attribute)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+
 # ================================
 #       Root Commands
 # ================================
@@ -44,6 +66,10 @@ def main(verbosity, color, args=None):
     # calculate color
     if color != -1:
         set_global_use_color(color)
+    # status updates of cluster jobs should start fast and keep the job's
+    # output clean
+    if click.get_current_context().invoked_subcommand == "core":
+        return
     # Welcome message
     echo("\nCOFFE -- Comprehensive Optimization Force Field Environment", DARKGOLDENROD, BOLD, UNDERLINE)
     echo("Version: {}; git sha: {}".format(coffe.__version__, thirdparty.get_git_sha()), LIGHTGRAY, indent=4)
@@ -83,6 +109,7 @@ def config(defaults):
     coffe will always prefer the special setting (subdirectory)
     over more general settings (parent directory/home directory).
     """
+    import pandas
     pandas.options.display.max_colwidth = 999
     pandas.options.display.width = 180
     df = CONFIG.get_sources(omit_defaults=not defaults)
@@ -134,24 +161,28 @@ def programs():
 #   - defined in analysis/analysiscli.py -
 # ================================
 
-@main.group()
+@main.group(cls=LazyGroup, lazy_subcommands={
+    "relative-energy-csv": "coffe.analysis.analysiscli:relative_energy_csv",
+    "rmsd-pdb-csv": "coffe.analysis.analysiscli:rmsd_pdb_csv",
+    "compute-distance": "coffe.analysis.analysiscli:compute_distance",
+    "compute-angle": "coffe.analysis.analysiscli:compute_angle",
+    "compute-dihedral": "coffe.analysis.analysiscli:compute_dihedral",
+    "compute-conformation": "coffe.analysis.analysiscli:compute_conformation",
+})
 def analysis():
     """General analysis interface"""
     click.echo("General analysis interface.")
 
-analysis.add_command(analysiscli.relative_energy_csv)
-analysis.add_command(analysiscli.rmsd_pdb_csv)
-analysis.add_command(analysiscli.compute_distance)
-analysis.add_command(analysiscli.compute_angle)
-analysis.add_command(analysiscli.compute_dihedral)
-analysis.add_command(analysiscli.compute_conformation)
 
 # ================================
 #       GROMACS COMMANDS
 #    - defined in gmx/gmxcli.py -
 # ================================
 
-@main.group()
+@main.group(cls=LazyGroup, lazy_subcommands={
+    "mkbox": "coffe.gmx.gmxcli:mkbox",
+    "density-fit": "coffe.gmx.gmxcli:density_fit",
+})
 def gmx():
     """Gromacs interface"""
     try:
@@ -163,53 +194,51 @@ def gmx():
     click.echo("Gromacs version: {}".format(thirdparty.gmx_version()))
 
 
-gmx.add_command(gmxcli.mkbox)
-gmx.add_command(gmxcli.density_fit)
-
 
 # ================================
 #       QUANTUM COMMANDS
 # - defined in quantum/gmxcli.py -
 # ================================
 
-@main.group()
+@main.group(cls=LazyGroup, lazy_subcommands={
+    "create-qm-opt": "coffe.quantum.quantumcli:create_qm_opt",
+    "get-qm-energies": "coffe.quantum.quantumcli:get_qm_energies",
+    "log2pdb": "coffe.quantum.quantumcli:log2pdb",
+    "log2xyz": "coffe.quantum.quantumcli:log2xyz",
+})
 def quantum():
     """Quantum interface to psi4 and GAMESS"""
     click.echo("Psi4 and Gamess interface.")
 
 
-quantum.add_command(quantumcli.create_qm_opt)
-quantum.add_command(quantumcli.get_qm_energies)
-quantum.add_command(quantumcli.log2pdb)
-quantum.add_command(quantumcli.log2xyz)
-
 # ================================
 #       MISC COMMANDS
 #   - defined in misc/misccli.py -
 # ================================
 
 
-@main.group()
+@main.group(cls=LazyGroup, lazy_subcommands={
+    "create-torsion-conformations":
+        "coffe.misc.misccli:create_torsion_conformations",
+})
 def misc():
     """Misc interface"""
     click.echo("Misc interface.")
 
 
-misc.add_command(misccli.create_torsion_conformations)
-
 # ================================
 #       Core COMMANDS
 #   - defined in analysis/corecli.py -
 # ================================
 
 
-@main.group()
+@main.group(cls=LazyGroup, lazy_subcommands={
+    "update-cluster-status": "coffe.core.corecli:update_cluster_status",
+    "pilot-worker": "coffe.core.corecli:pilot_worker",
+})
 def core():
     """Core interface"""
-    click.echo("Core interface.")
-
 
-core.add_command(corecli.update_cluster_status)
 
 # ================================
 #       Main Function
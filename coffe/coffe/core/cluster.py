@@ -11,21 +11,18 @@ Note:
 from __future__ import absolute_import, division, print_function
 
 import os
+import getpass
 import random
 import subprocess
 import re
 import multiprocessing
+import threading
 import time
 
 
+from coffe.core.globconf import CONFIG
 from coffe.core import saver, decorators, filesys, thirdparty, cmdchain, coffedir, shell
-
-
-class ClusterError(Exception):
-    """
-    A custom error class for cluster submission
-    """
-    pass
+from coffe.core.status import ClusterError, Status
 
 
 class ClusterJobAlreadyCompletedError(ClusterError):
@@ -43,72 +40,11 @@ JOBNAME_OPTION = {"slurm": " --job-name", "torque": " -N",
                   None: " jobname"} # the blanks are important
 OPTION_DELIMIT = {"slurm": "=", "torque": " ", None: ": "}
 OPTION_PREFIX = {"slurm": "#SBATCH", "torque": "#PBS", None: "#"}
-
-
-class Status(type):
-    """
-    Status of a cluster job.
-    """
-    not_written = "not_written"  #: Script has not been written, yet.
-    not_submitted = "not_submitted"  #: Script written, not submitted.
-    queueing = "queueing"  #: Job has been submitted and is in the queue.
-    running = "running"  #: Job is currently running on the cluster.
-    completed = "completed"  #: Job has terminated successfully.
-    error = "error"  #: Job terminated, but did not complete.
-
-    @classmethod
-    def is_written(cls, status):
-        return not status == cls.not_written
-
-    @classmethod
-    def is_submitted(cls, status):
-        return status not in [cls.not_written, cls.not_submitted]
-
-    @classmethod
-    def read(cls, file):
-        """Read from file.
-
-        Returns:
-            A pair (status, job_id)
-
-             - str: status
-             - int: job_id (None if not yet queueing)
-        """
-        assert os.path.isfile(file)
-        with open(file,"r") as f:
-            content = f.read().strip().split()
-            if len(content) == 1:
-                status = content[0]
-                assert status in [cls.not_written, cls.not_submitted]
-                return status, None
-            elif len(content) == 2:
-                status, job_id = content
-                job_id = int(job_id)
-                assert status in [cls.queueing, cls.running,
-                                  cls.completed, cls.error]
-                return status, job_id
-            else:
-                raise ClusterError("Status file had bad format")
-
-    @classmethod
-    def write(cls, file, status, job_id=None):
-        """Write to file."""
-        if status == Status.queueing:
-            assert job_id is not None
-            with open(file, "w") as f:
-                f.write("{} {}".format(status, int(job_id)))
-        elif status in [Status.running,
-                        Status.completed,
-                        Status.error]:
-            assert job_id is None
-            previous, job_id = cls.read(file)
-            with open(file, "w") as f:
-                f.write("{} {}".format(status, job_id))
-        else:
-            assert status in [Status.not_written, Status.not_submitted]
-            assert job_id is None
-            with open(file, "w") as f:
-                f.write("{}".format(status))
+ARRAY_OPTION = {"slurm": " --array", "torque": " -t", None: " array"}
+ARRAY_TASK_ID = {"slurm": "SLURM_ARRAY_TASK_ID", "torque": "PBS_ARRAYID",
+                 None: "1"}  # local tasks get their index as an argument
+PINOFFSET_VARIABLE = "COFFE_PINOFFSET"  #: First core of a scheduled local job.
+NTOMP_VARIABLE = "COFFE_NTOMP"  #: Number of cores of a scheduled local job.
 
 
 class ClusterJob(coffedir.CoffeWorkDir):
@@ -140,12 +76,16 @@ class ClusterJob(coffedir.CoffeWorkDir):
     If the previous job has a pre-submission or error status, the
     present job is set up as a fresh, clean instance with status
     :attr:`~Status.not_written`.
+
+    Local jobs that declare the number of cores they need are run by the
+    shared :func:`~local_scheduler`, which starts only as many jobs as
+    there are free cores.
     """
 
     @coffedir.log_exceptions
     @decorators.args_from_configfile
     def __init__(self, queueing=None, batch_template=None,
-                 job_name=None, work_dir=None):
+                 job_name=None, work_dir=None, n_cores=None):
         """
         Args:
             queueing (str): Specifies the queueing system
@@ -154,6 +94,10 @@ class ClusterJob(coffedir.CoffeWorkDir):
                 containing header, module loads, ....
                 Commands are appended to this script.
             work_dir(str): The coffe working directory.
+            n_cores(int): Number of cores of a local job (queueing=None).
+                Defaults to the local_job_cores from the global
+                configuration. If 0, the job is started immediately
+                without reserving cores.
 
         Raises:
             ClusterError: If batch template script does not suit the queueing system.
@@ -170,6 +114,9 @@ class ClusterJob(coffedir.CoffeWorkDir):
         else:
             self._job_name = job_name
         self.queueing = queueing
+        if n_cores is None:
+            n_cores = int(CONFIG.local_job_cores)
+        self.n_cores = int(n_cores)
         self.commands = []
         if batch_template is not None:
             self.batch_template = filesys.make_abspath(batch_template, work_dir)
@@ -267,6 +214,10 @@ class ClusterJob(coffedir.CoffeWorkDir):
                 #raise ClusterError("Job {} crashed -- started but did not"
                 #                   "complete. "
                 #                   "Work_dir: {}".format(job_id, self.work_dir))
+        # ---- started, but the running status was not written (yet) ----
+        if read_status == Status.queueing and self.queueing is not None:
+            if queue_snapshot(self.queueing).state(job_id) == "RUNNING":
+                return Status.running
         return read_status
 
     @status.setter
@@ -310,7 +261,8 @@ class ClusterJob(coffedir.CoffeWorkDir):
 
     @property
     def local_process(self):
-        """instance of :class:`~multiprocessing.Process`,
+        """instance of :class:`~multiprocessing.Process`
+        (or :class:`~ScheduledProcess`, if the job reserves cores),
         only defined if queueing is :code:`None`
         """
         assert self.queueing is None
@@ -329,47 +281,54 @@ class ClusterJob(coffedir.CoffeWorkDir):
         if self.is_written:
             raise ClusterError("ClusterJobs are not reusable. "
                                "Script is already written.")
-        jobname_option = "{}{}{}{}\n".format(OPTION_PREFIX[self.queueing],
-                                             JOBNAME_OPTION[self.queueing],
-                                             OPTION_DELIMIT[self.queueing],
-                                             self.job_name
-                                             )
-        commands = ["## COMMANDS: ##" + os.linesep*2,
-                    "err=0",
-                    "trap 'err=1' ERR",
-                    "cd {}".format(self.work_dir),
-                    "coffe core update-cluster-status {} {};".format(
-                                            Status.running, self.status_file),
-                    ""
-                   ] + self.commands + ["", "",
-                                        'if [ "$err" -eq 0 ]; then',
-                                        "coffe core update-cluster-status {} {};".format(
-                                            Status.completed, self.status_file),
-                                        'fi',
-                                        "test $err = 0"
-                                        ]
         with open(self.script, "w") as batch:
-            # copy template and replace jobname
-            is_jobname_written = False
-            if self.batch_template is not None:
-                with open(self.batch_template, "r") as template:
-                    for line in template:
-                        if ((self.job_name is not None) and
-                                (JOBNAME_OPTION[self.queueing] in line) and
-                                (OPTION_PREFIX[self.queueing] in line)):
-                            batch.write(jobname_option)
-                            is_jobname_written = True
-                            continue
-                        batch.write(line)
-            if not is_jobname_written:
-                batch.write(jobname_option)
+            self._write_header(batch)
             # write commands
             if self.commands:
-                for line in commands:
+                for line in ["## COMMANDS: ##" + os.linesep*2] + \
+                        self._command_lines():
                     batch.write(line + os.linesep)
         self.status = Status.not_submitted
         return self.script
 
+    def _write_header(self, batch):
+        """Copy the batch template to the open script and set the jobname."""
+        jobname_option = "{}{}{}{}\n".format(OPTION_PREFIX[self.queueing],
+                                             JOBNAME_OPTION[self.queueing],
+                                             OPTION_DELIMIT[self.queueing],
+                                             self.job_name
+                                             )
+        # copy template and replace jobname
+        is_jobname_written = False
+        if self.batch_template is not None:
+            with open(self.batch_template, "r") as template:
+                for line in template:
+                    if ((self.job_name is not None) and
+                            (JOBNAME_OPTION[self.queueing] in line) and
+                            (OPTION_PREFIX[self.queueing] in line)):
+                        batch.write(jobname_option)
+                        is_jobname_written = True
+                        continue
+                    batch.write(line)
+        if not is_jobname_written:
+            batch.write(jobname_option)
+
+    def _command_lines(self):
+        """list of str: The commands of the job, embedded in status updates."""
+        return ["err=0",
+                "trap 'err=1' ERR",
+                "cd {}".format(self.work_dir),
+                "coffe core update-cluster-status {} {};".format(
+                                        Status.running, self.status_file),
+                ""
+               ] + self.commands + ["", "",
+                                    'if [ "$err" -eq 0 ]; then',
+                                    "coffe core update-cluster-status {} {};".format(
+                                        Status.completed, self.status_file),
+                                    'fi',
+                                    "test $err = 0"
+                                    ]
+
     @coffedir.log_exceptions
     def __add__(self, command):
         """Add a command to the cluster job.
@@ -436,9 +395,13 @@ class ClusterJob(coffedir.CoffeWorkDir):
             random_id = random.randint(1, 1000000)
             self.status = random_id
             # setting status to int means (status = queueing, job_id = int)
-            self._local_process = multiprocessing.Process(
-                target=self.call_cmd, args=(sub_cmd,))
-            self.local_process.start()
+            if self.n_cores > 0:
+                self._local_process = local_scheduler().submit(
+                    self.call_cmd, (sub_cmd,), self.n_cores)
+            else:
+                self._local_process = multiprocessing.Process(
+                    target=self.call_cmd, args=(sub_cmd,))
+                self.local_process.start()
         else:                      # ==== cluster execution ====
             try:
                 self.call_cmd(sub_cmd)
@@ -455,6 +418,8 @@ class ClusterJob(coffedir.CoffeWorkDir):
             assert len(id) == 1
             self.status = id[0]
             # setting status to int means (status = queueing, job_id = int)
+            # make sure that the new job is seen by the next status query
+            queue_snapshot(self.queueing).invalidate()
         self.logger.info("Job ID: {}".format(self.job_id))
         return self.job_id
 
@@ -477,6 +442,23 @@ class ClusterJob(coffedir.CoffeWorkDir):
             self.call_cmd(cmd)
         self.status = Status.error
 
+    def wait(self, timeout=None):
+        """Block until the job has terminated.
+
+        Instead of polling the status of each job in its own loop, all
+        waiting jobs are tracked by the shared :data:`~JOB_WATCHER`.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds
+                (default: :code:`None`, wait forever).
+
+        Returns:
+            str: The status, :attr:`~Status.completed` or :attr:`~Status.error`
+            (or an active status, if the timeout expired).
+        """
+        JOB_WATCHER.watch(self).wait(timeout)
+        return self.status
+
     def _is_active(self, job_id):
         """Check if job is active.
 
@@ -492,30 +474,785 @@ class ClusterJob(coffedir.CoffeWorkDir):
             except:
                 return False
         else:
-            # call and pipe to grep
-            cmd = STATUS_COMMAND[self.queueing]
-            p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
-            cmdline = p.communicate()[0]
-            grep = subprocess.Popen(("grep {}".format(job_id)).split(),
-                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                    stdin=subprocess.PIPE)
-            cmdline = grep.communicate(cmdline)[0]
-            # Sometimes, squeue fails for some reason: in this case return
-            # True to prevent the script from crashing
-            if p.returncode != 0:
-                return True
-            if cmdline.strip():  # non-empty string
-                return True
+            return queue_snapshot(self.queueing).is_active(job_id)
+
+
+class ArrayTask(ClusterJob):
+    """A task of a :class:`~ClusterJobArray`.
+
+    Tasks are set up like any other :class:`~ClusterJob` (commands are
+    added via +=) and have their own status file, but they are submitted
+    by the array. The job id in the status file is the id of the array.
+    """
+
+    def __init__(self, array, index, job_name=None, work_dir=None):
+        """
+        Args:
+            array (:class:`~ClusterJobArray`): The array.
+            index (int): The array index of this task.
+            job_name (str): The job name.
+            work_dir (str): The coffe working directory.
+        """
+        self.array = array
+        self.index = index
+        super(ArrayTask, self).__init__(array.queueing, array.batch_template,
+                                        job_name=job_name, work_dir=work_dir,
+                                        n_cores=array.n_cores)
+
+    @property
+    def task_id(self):
+        """str: The id of the task in the queueing system (read-only).
+        :code:`None`, if the array has not been submitted, yet."""
+        if self.job_id is None:
+            return None
+        return "{}_{}".format(self.job_id, self.index)
+
+    def submit(self):
+        raise ClusterError("Array tasks are submitted by their ClusterJobArray.")
+
+    @coffedir.log_exceptions
+    def kill(self):
+        """
+        Kill this task (and leave the other tasks of the array running).
+
+        Raises:
+            ShellError: If the kill command failed.
+        """
+        if self.status not in [Status.running, Status.queueing]:
+            return
+
+        if self.queueing is None:
+            self.local_process.terminate()
+            time.sleep(0.5)  # give some time to terminate
+        else:
+            if self.queueing == "slurm":
+                task = self.task_id
             else:
-                return False
+                task = "{}[{}]".format(self.job_id, self.index)
+            cmd = "{} {}".format(DELETE_COMMAND[self.queueing], task)
+            self.call_cmd(cmd)
+        self.status = Status.error
+
+    def _is_active(self, job_id):
+        if self.queueing is None:
+            return super(ArrayTask, self)._is_active(job_id)
+        snapshot = queue_snapshot(self.queueing)
+        if snapshot.jobs is None:
+            return True
+        task_id = "{}_{}".format(job_id, self.index)
+        # qstat without -t only lists the array as a whole
+        return (snapshot.state(task_id) is not None or
+                "{}_".format(job_id) in snapshot.jobs)
+
+
+class ClusterJobArray(ClusterJob):
+    """Many cluster jobs that are submitted at once as a job array.
+
+    Each task has its own working directory, commands and status file, like
+    a :class:`~ClusterJob`. All tasks are written into one batch script
+    that selects the commands by the array index, so that the whole batch
+    takes one call to "sbatch --array" (or "qsub -t") and one entry in the
+    queue. If queueing is :code:`None`, the tasks are run locally in
+    separate processes.
+
+    Example:
+        .. code-block:: python
+
+            array = ClusterJobArray("slurm", "batch.sh", max_parallel=10)
+            for i in range(100):
+                task = array.add_task("eval{}".format(i))
+                task += "gmx mdrun -deffnm md"
+            array.submit()
+            array.wait()
+    """
+
+    @coffedir.log_exceptions
+    @decorators.args_from_configfile
+    def __init__(self, queueing=None, batch_template=None,
+                 job_name=None, work_dir=None, max_parallel=None,
+                 n_cores=None):
+        """
+        Args:
+            queueing (str): Specifies the queueing system
+                (default=None, "torque", or "slurm")
+            batch_template(str): A template batch script,
+                containing header, module loads, ....
+            job_name(str): The name of the array job.
+            work_dir(str): The coffe working directory of the array script.
+            max_parallel(int): Maximum number of tasks that run
+                simultaneously (default: :code:`None`, no limit).
+            n_cores(int): Number of cores of each local task
+                (see :class:`~ClusterJob`).
+        """
+        self.tasks = []
+        self.max_parallel = max_parallel
+        super(ClusterJobArray, self).__init__(queueing, batch_template,
+                                              job_name=job_name,
+                                              work_dir=work_dir,
+                                              n_cores=n_cores)
+
+    def add_task(self, work_dir, job_name=None):
+        """Add a task to the array.
+
+        Args:
+            work_dir(str): The working directory of the task (relative
+                paths are interpreted from the working directory of the array).
+            job_name(str): The job name of the task.
+
+        Returns:
+            :class:`~ArrayTask`: The task. Commands are added via +=.
+
+        Raises:
+            ClusterError: If the array script is already written.
+        """
+        if self.is_written:
+            raise ClusterError("ClusterJobArrays are not reusable. "
+                               "Script is already written.")
+        work_dir = os.path.join(self.work_dir, work_dir)
+        task = ArrayTask(self, len(self.tasks), job_name=job_name,
+                         work_dir=work_dir)
+        self.tasks.append(task)
+        return task
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __getitem__(self, index):
+        return self.tasks[index]
+
+    def __add__(self, command):
+        raise ClusterError("Commands are added to the tasks of a "
+                           "ClusterJobArray, not to the array itself.")
+
+    @property
+    def status(self):
+        """
+        str: The status of the array, as derived from the task status files.
+
+        The array is running, if any task is running; it is queueing, if
+        any task is queueing and no task is running. Once all tasks have
+        terminated, the array is completed, if all tasks have completed,
+        and has an error otherwise.
+
+        Setting the status sets the status of all tasks (see
+        :attr:`ClusterJob.status`).
+        """
+        if not self.tasks:
+            return Status.not_written
+        states = [task.status for task in self.tasks]
+        for status in [Status.not_written, Status.not_submitted,
+                       Status.running, Status.queueing, Status.error]:
+            if status in states:
+                return status
+        return Status.completed
+
+    @status.setter
+    def status(self, value):
+        for task in self.tasks:
+            task.status = value
+
+    @property
+    def job_id(self):
+        """int: The job id of the array, as read from the task status files.
+        Returns :code:`None` if the array has not been submitted, yet."""
+        if not self.tasks:
+            return None
+        return self.tasks[0].job_id
+
+    @coffedir.log_exceptions
+    def write_script(self):
+        """Write the submission script for all tasks.
+
+        Returns:
+            str: The filename of the submission script.
+        """
+        if not self.tasks:
+            raise ClusterError("Cannot write an empty ClusterJobArray.")
+        array_range = "0-{}".format(len(self.tasks) - 1)
+        if self.max_parallel is not None:
+            array_range += "%{}".format(int(self.max_parallel))
+        with open(self.script, "w") as batch:
+            self._write_header(batch)
+            batch.write("{}{}{}{}\n".format(OPTION_PREFIX[self.queueing],
+                                            ARRAY_OPTION[self.queueing],
+                                            OPTION_DELIMIT[self.queueing],
+                                            array_range))
+            batch.write("## COMMANDS: ##" + os.linesep*2)
+            batch.write("case ${} in".format(ARRAY_TASK_ID[self.queueing])
+                        + os.linesep)
+            for task in self.tasks:
+                batch.write("{})".format(task.index) + os.linesep)
+                for line in task._command_lines():
+                    batch.write("    " + line + os.linesep)
+                batch.write("    ;;" + os.linesep)
+            batch.write("esac" + os.linesep)
+        self.status = Status.not_submitted
+        return self.script
+
+    @coffedir.log_exceptions
+    def submit(self):
+        """Submit all tasks as one array job.
+
+        Returns:
+            int: job_id of the array
+
+        Raises:
+            ClusterJobAlreadyQueueingError: If any task is already in queue.
+            ClusterJobAlreadyCompletedError: If any task is already completed.
+            ClusterError: If the submission command failed.
+        """
+        self.logger.info("Submit job array (jobname: {}, {} tasks)".format(
+            self.job_name, len(self.tasks)))
+        for task in self.tasks:
+            if task.status == Status.completed:
+                raise ClusterJobAlreadyCompletedError(
+                    "Task {} is already completed. Aborting to prevent loss "
+                    "of data.".format(task.job_name))
+            elif task.status in [Status.queueing, Status.running]:
+                raise ClusterJobAlreadyQueueingError(
+                    "Task {} is already queueing. Aborting to prevent race "
+                    "conditions.".format(task.job_name))
+        if self.status == Status.not_written:
+            self.write_script()
+
+        sub_cmd = "{} {}".format(SUBMIT_COMMAND[self.queueing], self.script)
+        self.logger.info("submit command: {}".format(sub_cmd))
+        if self.queueing is None:  # ==== local execution ====
+            self.status = random.randint(1, 1000000)
+            if self.max_parallel is None:
+                slots = multiprocessing.Semaphore(len(self.tasks))
+            else:
+                slots = multiprocessing.Semaphore(int(self.max_parallel))
+            for task in self.tasks:
+                args = (self, "{} {}".format(sub_cmd, task.index), slots)
+                if self.n_cores > 0:
+                    task._local_process = local_scheduler().submit(
+                        _run_local_task, args, self.n_cores)
+                else:
+                    task._local_process = multiprocessing.Process(
+                        target=_run_local_task, args=args)
+                    task._local_process.start()
+        else:                      # ==== cluster execution ====
+            # tasks can start before the submit command has returned
+            self.status = 0
+            try:
+                self.call_cmd(sub_cmd)
+            except shell.ShellError:
+                with open(self.last_outfile) as f:
+                    cmdline = f.read()
+                self.status = Status.not_submitted
+                raise ClusterError("Submission failed: {}".format(cmdline))
+
+            with open(self.last_outfile) as f:
+                cmdline = f.read()
+            # extract jobid (torque writes array ids as 1234[].server)
+            id = [int(s) for s in re.split(
+                r' |\.|\[\]', cmdline.strip()) if s.isdigit()]
+            assert len(id) == 1
+            for task in self.tasks:
+                # keep the status of tasks that have started already
+                status, _ = Status.read(task.status_file)
+                with open(task.status_file, "w") as f:
+                    f.write("{} {}".format(status, id[0]))
+            queue_snapshot(self.queueing).invalidate()
+        self.logger.info("Job ID: {}".format(self.job_id))
+        return self.job_id
+
+    @coffedir.log_exceptions
+    def kill(self):
+        """
+        Kill all tasks of the array.
+
+        Raises:
+            ShellError: If the kill command failed.
+        """
+        if self.queueing is None:
+            for task in self.tasks:
+                task.kill()
+            return
+        if self.status not in [Status.running, Status.queueing]:
+            return
+        cmd = "{} {}".format(DELETE_COMMAND[self.queueing], self.job_id)
+        self.call_cmd(cmd)
+        for task in self.tasks:
+            if task.status in [Status.running, Status.queueing]:
+                task.status = Status.error
+
+    def wait(self, timeout=None):
+        """Block until all tasks have terminated.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds
+                (default: :code:`None`, wait forever).
+
+        Returns:
+            str: The status of the array.
+        """
+        events = [JOB_WATCHER.watch(task) for task in self.tasks]
+        start = time.time()
+        for event in events:
+            if timeout is None:
+                event.wait()
+            elif not event.wait(max(0.0, timeout - (time.time() - start))):
+                break
+        return self.status
+
+
+def _run_local_task(array, sub_cmd, slots):
+    """Run one task of a local :class:`~ClusterJobArray`,
+    as soon as one of the slots is free."""
+    with slots:
+        array.call_cmd(sub_cmd)
+
+
+class LocalScheduler(object):
+    """Runs local jobs on a fixed number of cores.
+
+    Each job reserves a contiguous range of cores. Jobs are started in the
+    order of submission, as soon as enough cores are free; the others wait.
+    A started job finds its cores in the environment variables
+    :data:`~PINOFFSET_VARIABLE` (the first core) and :data:`~NTOMP_VARIABLE`
+    (the number of cores), which are used to pin gmx mdrun
+    (see :func:`coffe.gmx.util.mdrun_command`). OMP_NUM_THREADS is set, too.
+
+    All local jobs of a process share one scheduler (see
+    :func:`~local_scheduler`). A background thread starts waiting jobs and
+    releases the cores of terminated ones.
+    """
+
+    def __init__(self, n_cores=None, interval=0.1):
+        """
+        Args:
+            n_cores (int): Number of cores. Defaults to the local_cores from
+                the global configuration (0: all cores of the machine).
+            interval (float): Interval (in seconds) to check for terminated jobs.
+        """
+        if n_cores is None:
+            n_cores = int(CONFIG.local_cores)
+        if n_cores < 1:
+            n_cores = multiprocessing.cpu_count()
+        self.n_cores = n_cores
+        self.interval = interval
+        self._free = [True] * n_cores
+        self._pending = []
+        self._running = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, target, args, n_cores):
+        """Run a function in a new process, as soon as enough cores are free.
+
+        Args:
+            target (:obj:`function`): The function.
+            args (tuple): Its arguments.
+            n_cores (int): Number of cores (at most all cores of the scheduler).
+
+        Returns:
+            :class:`~ScheduledProcess`
+        """
+        process = ScheduledProcess(self, target, args,
+                                   max(1, min(int(n_cores), self.n_cores)))
+        with self._lock:
+            self._pending.append(process)
+            self._dispatch()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return process
+
+    @property
+    def free_cores(self):
+        """int: Number of cores that are not reserved."""
+        with self._lock:
+            return sum(self._free)
+
+    def cancel(self, process):
+        """Remove a waiting process.
+
+        Returns:
+            bool: Whether the process was still waiting.
+        """
+        with self._lock:
+            if process in self._pending:
+                self._pending.remove(process)
+                return True
+            return False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._dispatch()
+                if not self._pending and not self._running:
+                    self._thread = None
+                    return
+            time.sleep(self.interval)
+
+    def _dispatch(self):
+        """Release the cores of terminated jobs and start waiting ones
+        (requires the lock)."""
+        for process in list(self._running):
+            if not process.process.is_alive():
+                process.process.join()
+                self._running.remove(process)
+                for core in range(process.offset,
+                                  process.offset + process.n_cores):
+                    self._free[core] = True
+        while self._pending:
+            offset = self._find_cores(self._pending[0].n_cores)
+            if offset is None:
+                break
+            process = self._pending.pop(0)
+            for core in range(offset, offset + process.n_cores):
+                self._free[core] = False
+            process._start(offset)
+            self._running.append(process)
+
+    def _find_cores(self, n_cores):
+        """int: The first core of a free range of n_cores cores (or None)."""
+        count = 0
+        for core, free in enumerate(self._free):
+            count = count + 1 if free else 0
+            if count == n_cores:
+                return core - n_cores + 1
+        return None
+
+
+class ScheduledProcess(object):
+    """A process that is started by a :class:`~LocalScheduler`.
+
+    Provides the methods of :class:`multiprocessing.Process` that are used
+    for local jobs. A process that waits for cores is alive.
+    """
+
+    def __init__(self, scheduler, target, args, n_cores):
+        self.scheduler = scheduler
+        self.target = target
+        self.args = args
+        self.n_cores = n_cores
+        self.offset = None
+        self.process = None
+        self._started = threading.Event()
+        self._cancelled = False
+
+    def _start(self, offset):
+        self.offset = offset
+        self.process = multiprocessing.Process(
+            target=_run_on_cores,
+            args=(offset, self.n_cores, self.target, self.args))
+        self.process.start()
+        self._started.set()
+
+    def is_alive(self):
+        """bool: Whether the process is waiting or running."""
+        if self._cancelled:
+            return False
+        if self.process is None:
+            return True
+        return self.process.is_alive()
+
+    def join(self, timeout=None):
+        """Block until the process has started and terminated."""
+        start = time.time()
+        while not self._cancelled and not self._started.wait(0.1):
+            if timeout is not None and time.time() - start > timeout:
+                return
+        if self.process is not None:
+            if timeout is not None:
+                timeout = max(0.0, timeout - (time.time() - start))
+            self.process.join(timeout)
+
+    def terminate(self):
+        """Remove the process from the scheduler, or terminate it."""
+        if self.scheduler.cancel(self):
+            self._cancelled = True
+        elif self.process is not None:
+            self.process.terminate()
+
+
+def _run_on_cores(offset, n_cores, target, args):
+    """Announce the reserved cores to the job and run it."""
+    os.environ[PINOFFSET_VARIABLE] = str(offset)
+    os.environ[NTOMP_VARIABLE] = str(n_cores)
+    os.environ["OMP_NUM_THREADS"] = str(n_cores)
+    target(*args)
+
+
+_SCHEDULER = []
+_SCHEDULER_LOCK = threading.Lock()
+
+
+def local_scheduler():
+    """The scheduler of local jobs that is shared within this process.
+
+    Returns:
+        :class:`~LocalScheduler`
+    """
+    with _SCHEDULER_LOCK:
+        if not _SCHEDULER:
+            _SCHEDULER.append(LocalScheduler())
+        return _SCHEDULER[0]
+
+
+class QueueSnapshot(object):
+    """A cached listing of the current user's jobs in a queueing system.
+
+    Instead of calling "squeue" or "qstat" for every status query of
+    every job, the listing is retrieved once and reused until it is older
+    than the time to live. All jobs of a process share one snapshot per
+    queueing system (see :func:`~queue_snapshot`).
+
+    The states are given in slurm notation, e.g. "PENDING" or "RUNNING".
+    Torque's state letters are translated accordingly.
+    """
+
+    TORQUE_STATES = {"Q": "PENDING", "H": "PENDING", "W": "PENDING",
+                     "T": "PENDING", "R": "RUNNING", "E": "COMPLETING",
+                     "S": "SUSPENDED", "C": "COMPLETED"}
+
+    def __init__(self, queueing, ttl=None):
+        """
+        Args:
+            queueing (str): The queueing system, "slurm" or "torque".
+            ttl (float): Time to live of a snapshot in seconds. Defaults to
+                the queue_status_ttl from the global configuration.
+        """
+        assert queueing in ["slurm", "torque"]
+        if ttl is None:
+            ttl = float(CONFIG.queue_status_ttl)
+        self.queueing = queueing
+        self.ttl = ttl
+        self._jobs = None
+        self._timestamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def jobs(self):
+        """dict: Job ids (str) and their states. :code:`None`,
+        if the queueing system could not be asked."""
+        with self._lock:
+            if (self._timestamp is None or
+                    time.time() - self._timestamp > self.ttl):
+                self._jobs = self._query()
+                self._timestamp = time.time()
+            return self._jobs
+
+    def invalidate(self):
+        """Make the next lookup ask the queueing system again."""
+        with self._lock:
+            self._timestamp = None
+
+    def state(self, job_id):
+        """The state of a job.
+
+        Args:
+            job_id (int or str): The job id.
+
+        Returns:
+            str: The state, e.g. "PENDING" or "RUNNING". :code:`None`, if the
+            job is not listed or the queueing system could not be asked.
+        """
+        jobs = self.jobs
+        if jobs is None:
+            return None
+        job_id = str(job_id)
+        if job_id in jobs:
+            return jobs[job_id]
+        # a job array is running, if any of its tasks is running
+        states = [jobs[k] for k in jobs if k.startswith(job_id + "_")]
+        if "RUNNING" in states:
+            return "RUNNING"
+        elif states:
+            return states[0]
+        return None
+
+    def is_active(self, job_id):
+        """bool: Whether the job is listed. If the queueing system could not
+        be asked, the job is considered to be active."""
+        if self.jobs is None:
+            return True
+        return self.state(job_id) is not None
+
+    def _query(self):
+        user = getpass.getuser()
+        if self.queueing == "slurm":
+            cmd = [STATUS_COMMAND[self.queueing], "-h", "-o", "%i %T",
+                   "-u", user]
+        else:
+            cmd = [STATUS_COMMAND[self.queueing], "-u", user]
+        try:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            out = p.communicate()[0].decode("latin-1")
+        except OSError:
+            return None
+        # Sometimes, squeue fails for some reason: in this case
+        # jobs are considered to be active to prevent the script from crashing
+        if p.returncode != 0:
+            return None
+        if self.queueing == "slurm":
+            return parse_squeue(out)
+        else:
+            return parse_qstat(out)
+
+
+def parse_squeue(out):
+    """Parse the output of "squeue -h -o '%i %T'".
+
+    Returns:
+        dict: Job ids (str) and states (str).
+    """
+    jobs = {}
+    for line in out.splitlines():
+        words = line.split()
+        if len(words) == 2:
+            for job_id in _expand_array_range(words[0]):
+                jobs[job_id] = words[1]
+    return jobs
+
+
+def _expand_array_range(job_id):
+    """Expand the pending tasks of a slurm array, e.g. 1234_[4-6%2],
+    into the task ids 1234_4, 1234_5, 1234_6."""
+    match = re.match(r"^(\d+)_\[([\d,\-]+)(%\d+)?\]$", job_id)
+    if match is None:
+        return [job_id]
+    job_ids = []
+    for part in match.group(2).split(","):
+        if "-" in part:
+            first, last = part.split("-")
+        else:
+            first, last = part, part
+        job_ids += ["{}_{}".format(match.group(1), i)
+                    for i in range(int(first), int(last) + 1)]
+    return job_ids
+
+
+def parse_qstat(out):
+    """Parse the output of "qstat -u <user>".
+
+    Returns:
+        dict: Job ids (str) and states (str, in slurm notation).
+    """
+    jobs = {}
+    for line in out.splitlines():
+        words = line.split()
+        if len(words) < 2 or not words[0][0].isdigit():
+            continue
+        # the id has the format 1234.server, arrays 1234[5].server
+        job_id = words[0].split(".")[0].replace("[", "_").replace("]", "")
+        jobs[job_id] = QueueSnapshot.TORQUE_STATES.get(words[-2], words[-2])
+    return jobs
+
+
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def queue_snapshot(queueing):
+    """The snapshot of a queueing system that is shared within this process.
+
+    Args:
+        queueing (str): The queueing system, "slurm" or "torque".
+
+    Returns:
+        :class:`~QueueSnapshot`
+    """
+    with _SNAPSHOTS_LOCK:
+        if queueing not in _SNAPSHOTS:
+            _SNAPSHOTS[queueing] = QueueSnapshot(queueing)
+        return _SNAPSHOTS[queueing]
+
+
+class JobWatcher(object):
+    """Tracks the completion of many cluster jobs in one background thread.
+
+    Each polling interval, the watcher reads the status files of all watched
+    jobs and looks up the active ones in the shared
+    :func:`~queue_snapshot`, so that each queueing system is asked at most
+    once. Jobs that have terminated or that have
+    disappeared from the queue wake up the threads that wait for them.
+    """
+
+    def __init__(self, interval=None):
+        """
+        Args:
+            interval (float): Polling interval in seconds. Defaults to
+                the cluster_poll_interval from the global configuration.
+        """
+        if interval is None:
+            interval = float(CONFIG.cluster_poll_interval)
+        self.interval = interval
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, job):
+        """Start watching a job.
+
+        Args:
+            job (:class:`~ClusterJob`): A submitted job.
+
+        Returns:
+            :class:`threading.Event`: An event that is set once the job
+            has terminated.
+        """
+        event = threading.Event()
+        with self._lock:
+            self._jobs.setdefault(job.status_file, (job, []))[1].append(event)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return event
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        """Check all watched jobs once and release the terminated ones."""
+        with self._lock:
+            jobs = dict(self._jobs)
+
+        for status_file, (job, events) in jobs.items():
+            if not os.path.isfile(status_file):
+                continue
+            status, job_id = Status.read(status_file)
+            if status in [Status.queueing, Status.running]:
+                # cheap: all jobs of a queueing system share one snapshot
+                if job._is_active(job_id):
+                    continue
+                # the status file may have changed in the meantime
+                status, _ = Status.read(status_file)
+                if status in [Status.queueing, Status.running]:
+                    Status.write(status_file, Status.error)
+            elif status not in [Status.completed, Status.error]:
+                continue
+            with self._lock:
+                self._jobs.pop(status_file, None)
+            for event in events:
+                event.set()
+
+
+JOB_WATCHER = JobWatcher()  #: The watcher that is shared by all jobs of this process.
 
 
 class ClusterJobGenerator(object):
     """A generator for cluster jobs."""
 
     @decorators.args_from_configfile
-    def __init__(self, queueing=None, batch_template=None, root_dir="."):
+    def __init__(self, queueing=None, batch_template=None, root_dir=".",
+                 n_cores=None):
         """
         Args:
             queueing (str): The queuing system.
@@ -525,15 +1262,35 @@ class ClusterJobGenerator(object):
                 batch_template can be None, too.
             root_dir (str): The path from which the relative paths
                 in this class are interpreted.
+            n_cores (int): Number of cores of each local job
+                (see :class:`~ClusterJob`).
         """
         assert queueing in SUBMIT_COMMAND
         self.queueing = queueing
+        self.n_cores = n_cores
         if batch_template is not None:
             self.batch_template = filesys.make_abspath(batch_template, root_dir)
         else:
             self.batch_template = None
         self.root_dir = os.path.abspath(root_dir)
 
+    def generate_array(self, work_dir, job_name=None, max_parallel=None):
+        """Generate a job array. Tasks are added via
+        :meth:`ClusterJobArray.add_task`.
+
+        Args:
+            work_dir(str): The working directory for the array script.
+            job_name(str): The job name.
+            max_parallel(int): Maximum number of tasks that run simultaneously.
+
+        Returns:
+            Instance of :class:`~ClusterJobArray`
+        """
+        return ClusterJobArray(self.queueing, self.batch_template,
+                               job_name=job_name,
+                               work_dir=os.path.join(self.root_dir, work_dir),
+                               max_parallel=max_parallel, n_cores=self.n_cores)
+
     def generate_job(self, work_dir, job_name=None):
         """Generate a cluster job.
 
@@ -546,7 +1303,8 @@ class ClusterJobGenerator(object):
 
         """
         return ClusterJob(self.queueing, self.batch_template, job_name=job_name,
-                          work_dir=os.path.join(self.root_dir, work_dir))
+                          work_dir=os.path.join(self.root_dir, work_dir),
+                          n_cores=self.n_cores)
 
 
 def delayed_submission(cluster_job, await_true, interval=2):
@@ -5,7 +5,7 @@
 from __future__ import absolute_import, division, print_function
 
 import click
-from coffe.core import cluster
+from coffe.core.status import Status
 
 
 @click.command()
@@ -13,9 +13,25 @@ from coffe.core import cluster
 @click.argument("file", type=click.Path(exists=True))
 def update_cluster_status(status, file):
     """Update the status of a cluster job.
-    This script is called by all instances of :class:`~cluster.ClusterJob`
+    This script is called by all instances of :class:`~coffe.core.cluster.ClusterJob`
 
      - once they start running (change status to "running")
      - once they are completed (change status to "completed")
     """
-    cluster.Status.write(file, status)
+    Status.write(file, status)
+
+
+@click.command()
+@click.argument("pool_dir", type=click.Path(exists=True))
+@click.option("--idle-timeout", type=float, default=300.0,
+              help="Exit after this number of seconds without tasks.")
+@click.option("--poll-interval", type=float, default=0.2,
+              help="Interval (in seconds) to look for new tasks.")
+def pilot_worker(pool_dir, idle_timeout, poll_interval):
+    """Run the tasks of a pilot pool.
+    This script is called by the workers of :class:`~coffe.core.pilot.PilotPool`.
+    """
+    from coffe.core.pilot import run_worker
+    n_tasks = run_worker(pool_dir, idle_timeout=idle_timeout,
+                         poll_interval=poll_interval)
+    click.echo("Worker exits after {} tasks.".format(n_tasks))
@@ -5,15 +5,156 @@
 from __future__ import absolute_import, division, print_function
 from coffe.core import compat
 from six.moves import configparser
+import ast
+import copy
 import os
 import functools
 import logging
+import threading
 
 
 class ConfigError(Exception):
     pass
 
 
+XXX = "XXX"  #: Config value of options that must be given as keyword arguments.
+
+_SCHEMAS = {}
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def register_schema(section, schema):
+    """Register converters for the options of a config file section.
+
+    Values are parsed with :func:`ast.literal_eval` and then passed through
+    the converter of their option, e.g.::
+
+        register_schema("OPT", {"max_fevals": int, "bounds": list})
+
+    Args:
+        section (str): Section name (applies to all config files).
+        schema (dict): Options and callables that convert or check the
+            parsed values. Options that are not in the schema are not
+            converted.
+    """
+    _SCHEMAS[section] = dict(schema)
+
+
+class ConfigSnapshot(object):
+    """The options of a config file, frozen at the time of reading.
+
+    Snapshots can be passed as :code:`cfg_file` to functions decorated with
+    :func:`~args_from_configfile`. They can be pickled, so that jobs on
+    compute nodes use the options that were read when the job was created
+    instead of reading the file again.
+
+    The values are kept as strings and parsed when the options of their
+    section are requested, so that a value that cannot be parsed only
+    affects its own section.
+    """
+
+    def __init__(self, path, sections):
+        """
+        Args:
+            path (str): The config file.
+            sections (dict): Section names and dictionaries of the option
+                values as written in the file.
+        """
+        self._path = path
+        self._sections = dict((name, dict(options))
+                              for name, options in sections.items())
+        self._parsed = {}
+
+    @property
+    def path(self):
+        """str: The config file."""
+        return self._path
+
+    def has_section(self, section):
+        return section in self._sections
+
+    def sections(self):
+        return list(self._sections)
+
+    def options(self, section):
+        """Options of a section.
+
+        Returns:
+            dict: A copy of the parsed values; changing it does not change
+                the snapshot.
+
+        Raises:
+            ConfigError: If a value of the section is not a python literal.
+        """
+        if section not in self._parsed:
+            self._parsed[section] = dict(
+                (opt, _parse_value(self._path, section, opt, value))
+                for opt, value in self._sections[section].items())
+        return copy.deepcopy(self._parsed[section])
+
+    def __eq__(self, other):
+        return (isinstance(other, ConfigSnapshot) and
+                self._path == other._path and
+                self._sections == other._sections)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "ConfigSnapshot({!r})".format(self._path)
+
+
+def _parse_value(cfg_file, section, option, value):
+    """Parse a config value as a python literal."""
+    if value.strip() == XXX:
+        return XXX
+    try:
+        return ast.literal_eval(value.strip())
+    except (SyntaxError, ValueError):
+        raise ConfigError("Config file options must be python literals "
+                          "(strings in quotation marks, numbers, lists, ...). "
+                          "Config file: {} Section: {} Option: {} "
+                          "Value {} could not be interpreted.".format(
+                              cfg_file, section, option, value))
+
+
+def read_config(cfg_file):
+    """Read a config file, or return the cached snapshot.
+
+    Parsed files are cached by path and modification time, so that every
+    file is read once as long as it does not change.
+
+    Args:
+        cfg_file (str or ConfigSnapshot): The config file. Snapshots are
+            returned as they are.
+
+    Returns:
+        ConfigSnapshot: The options.
+    """
+    if isinstance(cfg_file, ConfigSnapshot):
+        return cfg_file
+    assert os.path.isfile(cfg_file), "Config file {} does not exist".format(cfg_file)
+    path = os.path.abspath(cfg_file)
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    cfg = configparser.ConfigParser()
+    cfg.read(path)
+    sections = {}
+    for section in cfg.sections():
+        sections[section] = dict((opt, cfg.get(section, opt))
+                                 for opt in cfg.options(section))
+    snapshot = ConfigSnapshot(path, sections)
+    with _CACHE_LOCK:
+        _CACHE[path] = (key, snapshot)
+    return snapshot
+
+
 def _extract_args(*args, **kwargs):
     """Helper function for args_from_configfile to prevent code duplication."""
 
@@ -23,25 +164,20 @@ def _extract_args(*args, **kwargs):
         "Keyword 'cfg_file'=... cannot be used without keyword 'section'=.... " \
         "cfg_file was {}".format(cfg_file)
     section = kwargs["section"]
-    assert os.path.isfile(cfg_file), "Config file {} does not exist".format(cfg_file)
-    cfg = configparser.ConfigParser()
-    cfg.read(cfg_file)
-    assert cfg.has_section(section), "Config file {} has no section {}".format(cfg_file, section)
+    cfg = read_config(cfg_file)
+    assert cfg.has_section(section), "Config file {} has no section {}".format(cfg.path, section)
 
-    options_dict = {}
     # read config options
-    XXX = "XXX"
-    for opt in cfg.options(section):
-        try:
-            options_dict[opt] = eval(cfg.get(section, opt))
-        except SyntaxError:
-            raise ConfigError("Config file options must obey Python syntax. "
-                              "Config file: {} "
-                              "Section: {} "
-                              "Option: {} ",
-                              "Value {} could not be interpreted.".format(
-                                  cfg_file, section, opt, cfg.get(section,opt)
-                              ))
+    options_dict = cfg.options(section)
+    schema = _SCHEMAS.get(section, {})
+    for opt in options_dict:
+        if opt in schema and options_dict[opt] != XXX:
+            try:
+                options_dict[opt] = schema[opt](options_dict[opt])
+            except Exception as e:
+                raise ConfigError("Option {} in section {} of {} does not "
+                                  "match the schema: {}".format(
+                                      opt, section, cfg.path, e))
     # read keyword arguments
     for arg in kwargs:
         if (arg not in ["cfg_file", "section"]) and (kwargs[arg] is not None):
@@ -55,7 +191,6 @@ def _extract_args(*args, **kwargs):
     return options_dict
 
 
-
 def args_from_configfile(func):
     """A decorator that enables retrieving function arguments from config files.
     Instead of passing all arguments, you can also pass a keyword 'cfg_file'
@@ -72,8 +207,11 @@ def args_from_configfile(func):
     - Keyword arguments override config file arguments (exception: value None does not override).
     - Non-keyword arguments are ignored, if a cfg_file is specified.
     - All arguments specified in the config file's section are passed as function parameters.
-    - The arguments are evaluated, i.e. when defining a string use quotation marks in
-        the configuration file.
+    - The arguments are parsed as python literals (:func:`ast.literal_eval`),
+        i.e. when defining a string use quotation marks in the configuration file.
+        See :func:`~register_schema` for further conversions.
+    - Parsed config files are cached until they change (see :func:`~read_config`).
+        Instead of a file, :code:`cfg_file` can also be a :class:`~ConfigSnapshot`.
     """
     arguments = compat.get_function_args(func)
     if len(arguments) > 0 and arguments[0] == "self":
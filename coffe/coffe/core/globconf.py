@@ -54,12 +54,12 @@ import os
 
 from six.moves import configparser
 from collections import OrderedDict
-import pandas
 
-from coffe.core import pkgdata
-
-DEFAULTS_FILE = pkgdata.abspath(
-    "data/coffe.defaults")  #: location of the defaults file
+# the config is loaded by every coffe command, so the defaults file is
+# located without pkg_resources and pandas is only imported by get_sources
+DEFAULTS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "data", "coffe.defaults")  #: location of the defaults file
 LOCAL_CONFIG_NAME = ".coffe.conf"  #: name of a local configuration file
 USER_FILE = os.path.join(
     os.path.expanduser("~"),
@@ -231,6 +231,7 @@ class Config(object):
                 :code:`["Value", "Source"]`
 
         """
+        import pandas
         df_src = pandas.DataFrame.from_dict(self._sources, orient='index')
         df_src.columns = ["Source"]
         df = pandas.DataFrame.from_dict(self._options, orient='index')
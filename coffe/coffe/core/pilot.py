@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+"""Pilot jobs that run many tasks inside long-lived allocations.
+
+Each :class:`~coffe.core.cluster.ClusterJob` is a submission of its own and
+waits in the queue of the cluster before it starts. A :class:`~PilotPool`
+instead submits a few long-running workers once (as one
+:class:`~coffe.core.cluster.ClusterJobArray`). The workers pull tasks
+from a work queue on the filesystem, so that a new task starts within
+a fraction of a second, as long as a worker is idle.
+
+Tasks are set up like cluster jobs (:class:`~PilotJob` has the
+interface of :class:`~coffe.core.cluster.ClusterJob`) and report their
+status through the same status files.
+
+The pool directory contains:
+
+ - pending/<task_id>.task: pickled tasks that wait for a worker
+ - running/<worker>/<task_id>.task: tasks that are run by a worker
+ - heartbeats/<worker>: touched regularly by each running worker
+ - stop: if present, the workers exit after their current task
+
+Example:
+    .. code-block:: python
+
+        pool = PilotPool("slurm", "batch.sh", n_workers=4, work_dir="pilot")
+        for i in range(100):
+            job = pool.generate_job("eval{}".format(i))
+            job += "gmx mdrun -deffnm md"
+            job.submit()
+        ...
+        pool.shutdown()
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import random
+import socket
+import subprocess
+import threading
+import time
+
+from coffe.core import saver, decorators, cmdchain, coffedir
+from coffe.core.cluster import (ClusterJob, ClusterError, ClusterJobArray,
+                                ClusterJobAlreadyCompletedError,
+                                ClusterJobAlreadyQueueingError)
+from coffe.core.status import Status
+
+
+class PilotPool(object):
+    """A work queue and the workers that process it.
+
+    The workers are submitted on demand: when a task is submitted and
+    no worker is queueing or running, a new set of workers is submitted.
+    Idle workers exit after :attr:`~idle_timeout` seconds, so that
+    allocations are not blocked longer than needed.
+    """
+
+    @decorators.args_from_configfile
+    def __init__(self, queueing=None, batch_template=None, n_workers=1,
+                 work_dir=".", idle_timeout=300, heartbeat_timeout=60):
+        """
+        Args:
+            queueing (str): The queueing system of the workers
+                (default=None, "torque", or "slurm").
+            batch_template (str): The template batch script of the workers.
+            n_workers (int): Number of workers that are submitted at once.
+                If 0, workers have to be started by hand
+                (:code:`coffe core pilot-worker <work_dir>`).
+            work_dir (str): The pool directory.
+            idle_timeout (float): Workers exit after this number of seconds
+                without tasks.
+            heartbeat_timeout (float): Workers whose heartbeat is older than
+                this number of seconds are considered to have crashed.
+        """
+        self.queueing = queueing
+        self.batch_template = batch_template
+        self.n_workers = int(n_workers)
+        self.work_dir, self.coffe_dir, self.logger = \
+            coffedir.prepare_coffe_work_dir(work_dir)
+        self.idle_timeout = idle_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.workers = None
+        self._lock = threading.Lock()
+        for subdir in ["pending", "running", "heartbeats"]:
+            if not os.path.isdir(os.path.join(self.work_dir, subdir)):
+                os.mkdir(os.path.join(self.work_dir, subdir))
+
+    def generate_job(self, work_dir, job_name=None):
+        """Generate a job that is run by the workers of this pool.
+
+        Args:
+            work_dir(str): The working directory for the job.
+            job_name(str): The job name.
+
+        Returns:
+            Instance of :class:`~PilotJob`
+        """
+        return PilotJob(self, job_name=job_name, work_dir=work_dir)
+
+    @property
+    def live_workers(self):
+        """list of str: Names of the workers whose heartbeat is recent."""
+        heartbeats = os.path.join(self.work_dir, "heartbeats")
+        now = time.time()
+        alive = []
+        for name in os.listdir(heartbeats):
+            try:
+                age = now - os.path.getmtime(os.path.join(heartbeats, name))
+            except OSError:  # the worker has just exited
+                continue
+            if age < self.heartbeat_timeout:
+                alive.append(name)
+        return alive
+
+    def workers_active(self):
+        """bool: Whether any worker is running or waiting in the queue."""
+        if self.live_workers:
+            return True
+        return (self.workers is not None and
+                self.workers.status in [Status.queueing, Status.running])
+
+    def ensure_workers(self):
+        """Submit workers, if none are running or queueing."""
+        with self._lock:
+            if self.n_workers < 1 or self.workers_active():
+                return
+            stop = os.path.join(self.work_dir, "stop")
+            if os.path.isfile(stop):
+                os.remove(stop)
+            generation = 0
+            while os.path.isdir(os.path.join(self.work_dir,
+                                             "workers{}".format(generation))):
+                generation += 1
+            self.workers = ClusterJobArray(
+                self.queueing, self.batch_template,
+                job_name="pilot{}".format(generation),
+                work_dir=os.path.join(self.work_dir,
+                                      "workers{}".format(generation)))
+            for i in range(self.n_workers):
+                worker = self.workers.add_task("worker{}".format(i))
+                worker += "coffe core pilot-worker {} --idle-timeout {}".format(
+                    self.work_dir, self.idle_timeout)
+            self.workers.submit()
+
+    def enqueue(self, task_file, task_id):
+        """Make a saved task available to the workers.
+
+        Args:
+            task_file (str): The pickled task (see :meth:`PilotJob.write_script`).
+            task_id (int): The id of the task.
+        """
+        pending = os.path.join(self.work_dir, "pending",
+                               "{}.task".format(task_id))
+        # write to a temporary file first, so that workers never see
+        # partly written tasks
+        with open(task_file, "rb") as src, open(pending + ".tmp", "wb") as dst:
+            dst.write(src.read())
+        os.rename(pending + ".tmp", pending)
+        self.ensure_workers()
+
+    def cancel(self, task_id):
+        """Remove a task from the work queue.
+
+        Returns:
+            bool: Whether the task was still pending.
+        """
+        try:
+            os.remove(os.path.join(self.work_dir, "pending",
+                                   "{}.task".format(task_id)))
+            return True
+        except OSError:
+            return False
+
+    def is_task_active(self, task_id):
+        """bool: Whether the task is pending (with active workers)
+        or run by a live worker. Workers are submitted again, if a task
+        is pending and all workers have exited."""
+        filename = "{}.task".format(task_id)
+        # check pending first; tasks move from pending to running atomically
+        if os.path.isfile(os.path.join(self.work_dir, "pending", filename)):
+            if self.n_workers > 0 and not self.workers_active():
+                # the last worker has reached its idle timeout right after
+                # the task was enqueued
+                self.ensure_workers()
+            return self.workers_active()
+        live = self.live_workers
+        running = os.path.join(self.work_dir, "running")
+        for worker in os.listdir(running):
+            if os.path.isfile(os.path.join(running, worker, filename)):
+                return worker in live
+        return False
+
+    def shutdown(self):
+        """Let the workers exit after their current task."""
+        open(os.path.join(self.work_dir, "stop"), "w").close()
+
+
+class PilotJob(ClusterJob):
+    """A job that is run by the workers of a :class:`~PilotPool`.
+
+    Commands are added via += and the job is submitted and waited for like a
+    :class:`~coffe.core.cluster.ClusterJob`. Instances of callable classes
+    are pickled with the task and run inside the worker process instead of
+    through :code:`coffe run-class`.
+    """
+
+    def __init__(self, pool, job_name=None, work_dir=None):
+        """
+        Args:
+            pool (:class:`~PilotPool`): The pool.
+            job_name (str): The job name.
+            work_dir (str): The coffe working directory.
+        """
+        self.pool = pool
+        super(PilotJob, self).__init__(None, None, job_name=job_name,
+                                       work_dir=work_dir)
+
+    @property
+    def script(self):
+        """str: The name of the pickled task."""
+        return os.path.join(self.coffe_dir, "{}.task".format(self.job_name))
+
+    @coffedir.log_exceptions
+    def __add__(self, command):
+        """Add a command to the job.
+
+        Args:
+            command (str): Either a string (command line command)
+                or an instance of a callable class.
+
+        Raises:
+            ClusterError: If the task is already written or if added command
+                is neither a string nor an instance of a callable class.
+        """
+        if self.is_written:
+            raise ClusterError("PilotJobs are not reusable. "
+                               "Task is already written.")
+        if isinstance(command, str) or cmdchain.has_empty_call(command):
+            self.commands += [command]
+        else:
+            raise ClusterError(
+                "Cannot add {} to pilot job (is neither string "
+                "nor instance of callable class)".format(command))
+        return self
+
+    @coffedir.log_exceptions
+    def write_script(self):
+        """Pickle the task.
+
+        Returns:
+            str: Path of the pickled task.
+        """
+        if self.is_written:
+            raise ClusterError("PilotJobs are not reusable. "
+                               "Task is already written.")
+        saver.save({"work_dir": self.work_dir,
+                    "status_file": self.status_file,
+                    "commands": self.commands}, self.script)
+        self.status = Status.not_submitted
+        return self.script
+
+    @coffedir.log_exceptions
+    def submit(self):
+        """Put the job into the work queue of the pool.
+
+        Returns:
+            int: The task id.
+
+        Raises:
+            ClusterJobAlreadyQueueingError: If job is already in queue.
+            ClusterJobAlreadyCompletedError: If job is already completed.
+        """
+        self.logger.info("Submit pilot task (jobname: {})".format(self.job_name))
+        if self.status == Status.completed:
+            raise ClusterJobAlreadyCompletedError(
+                "Job is already completed. Aborting to prevent loss of data.")
+        elif self.status in [Status.queueing, Status.running]:
+            raise ClusterJobAlreadyQueueingError(
+                "Job is already queueing. Aborting to prevent race conditions.")
+        elif self.status == Status.not_written:
+            self.write_script()
+        self.status = random.randint(1, 1000000000)
+        self.pool.enqueue(self.script, self.job_id)
+        self.logger.info("Task ID: {}".format(self.job_id))
+        return self.job_id
+
+    @coffedir.log_exceptions
+    def kill(self):
+        """Remove the job from the work queue.
+        Jobs that are already run by a worker are completed,
+        but their status is set to error (and stays error)."""
+        if self.status not in [Status.running, Status.queueing]:
+            return
+        self.pool.cancel(self.job_id)
+        self.status = Status.error
+
+    def _is_active(self, job_id):
+        if job_id is None:
+            return False
+        if self.pool.is_task_active(job_id):
+            return True
+        # the job is given up (status error), so that it must not be run later
+        self.pool.cancel(job_id)
+        return False
+
+
+def run_worker(pool_dir, idle_timeout=300, poll_interval=0.2,
+               heartbeat_interval=10):
+    """Process the tasks of a pool until it is idle or stopped.
+
+    Args:
+        pool_dir (str): The pool directory.
+        idle_timeout (float): Exit after this number of seconds without tasks.
+        poll_interval (float): Interval (in seconds) to look for new tasks.
+        heartbeat_interval (float): Interval (in seconds) to touch the
+            heartbeat file. Has to be well below the heartbeat_timeout of
+            the pool.
+
+    Returns:
+        int: The number of tasks that were run.
+    """
+    pool_dir = os.path.abspath(pool_dir)
+    name = "{}-{}".format(socket.gethostname(), os.getpid())
+    pending = os.path.join(pool_dir, "pending")
+    running = os.path.join(pool_dir, "running", name)
+    heartbeat = os.path.join(pool_dir, "heartbeats", name)
+    if not os.path.isdir(running):
+        os.mkdir(running)
+
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.is_set():
+            with open(heartbeat, "a"):
+                os.utime(heartbeat, None)
+            stopped.wait(heartbeat_interval)
+
+    beat_thread = threading.Thread(target=beat)
+    beat_thread.daemon = True
+    beat_thread.start()
+
+    n_tasks = 0
+    idle_since = time.time()
+    try:
+        while not os.path.isfile(os.path.join(pool_dir, "stop")):
+            task_file = _claim(pending, running)
+            if task_file is None:
+                if time.time() - idle_since > idle_timeout:
+                    break
+                time.sleep(poll_interval)
+                continue
+            _run_task(task_file)
+            os.remove(task_file)
+            n_tasks += 1
+            idle_since = time.time()
+    finally:
+        stopped.set()
+        beat_thread.join()
+        os.remove(heartbeat)
+        os.rmdir(running)
+    return n_tasks
+
+
+def _claim(pending, running):
+    """Move the oldest pending task to the running directory of a worker.
+
+    Returns:
+        str: The claimed task. :code:`None`, if no task is pending.
+    """
+    tasks = []
+    for filename in os.listdir(pending):
+        if not filename.endswith(".task"):
+            continue
+        try:
+            tasks.append((os.path.getmtime(os.path.join(pending, filename)),
+                          filename))
+        except OSError:  # claimed by another worker
+            continue
+    for mtime, filename in sorted(tasks):
+        try:
+            os.rename(os.path.join(pending, filename),
+                      os.path.join(running, filename))
+        except OSError:  # claimed by another worker
+            continue
+        return os.path.join(running, filename)
+    return None
+
+
+def _run_task(task_file):
+    """Run a pickled task and update its status file.
+    Like the batch scripts of :class:`~coffe.core.cluster.ClusterJob`,
+    all commands are run, even if one of them fails."""
+    logger = logging.getLogger(__name__)
+    task = saver.load(task_file)
+    if _is_killed(task["status_file"]):
+        return
+    Status.write(task["status_file"], Status.running)
+    err = False
+    cwd = os.getcwd()
+    os.chdir(task["work_dir"])
+    try:
+        for command in task["commands"]:
+            if isinstance(command, str):
+                if subprocess.call(command, shell=True,
+                                   executable="/bin/bash") != 0:
+                    err = True
+            else:
+                try:
+                    command()
+                except Exception as e:
+                    logger.exception(e)
+                    err = True
+    finally:
+        os.chdir(cwd)
+    # a job that was killed while its task was run keeps the status error
+    if not _is_killed(task["status_file"]):
+        Status.write(task["status_file"],
+                     Status.error if err else Status.completed)
+
+
+def _is_killed(status_file):
+    """bool: Whether the job of a task was killed (see :meth:`PilotJob.kill`)."""
+    return Status.read(status_file)[0] == Status.error
@@ -8,7 +8,6 @@ from __future__ import absolute_import, division, print_function
 
 import inspect
 import os
-import pkg_resources
 
 
 # ========================================================================================
@@ -32,9 +31,16 @@ import pkg_resources
 # - https://stackoverflow.com/questions/1395593/managing-resources-in-a-python-project
 # ========================================================================================
 
+def _pkg_resources():
+    """The pkg_resources module (slow; only imported when needed)."""
+    import pkg_resources
+    return pkg_resources
+
+
 def abspath(relative_path): # type (object) -> object
     """Get file from a path that is relative to caller's module.
     Returns:    absolute path as string"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return os.path.normpath(pkg_resources.resource_filename(mod.__name__, relative_path))
@@ -43,6 +49,7 @@ def abspath(relative_path): # type (object) -> object
 def isdir(relative_path):
     """Check if a path (relative to the caller's module) is a directory.
     Returns:    boolean"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_isdir(mod.__name__, relative_path)
@@ -51,6 +58,7 @@ def isdir(relative_path):
 def isfile(relative_path):
     """Check if a path (relative to the caller's module) is a file.
     Returns:    boolean"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_exists(mod.__name__, relative_path) \
@@ -60,6 +68,7 @@ def isfile(relative_path):
 def exists(relative_path):
     """Check if a path (file or directory relative to the caller's module) exists.
     Returns:    boolean"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_exists(mod.__name__, relative_path)
@@ -68,6 +77,7 @@ def exists(relative_path):
 def listdir(relative_path):
     """List the contents of a directory (path relative to the caller's module).
     Returns:    a list of files"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_listdir(mod.__name__, relative_path)
@@ -76,6 +86,7 @@ def listdir(relative_path):
 def openfile(relative_path):
     """Open a file (filename relative to the caller's module) and return a stream object.
     Returns:    a filestream (rb mode)"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_stream(mod.__name__, relative_path)
@@ -84,6 +95,7 @@ def openfile(relative_path):
 def read(relative_path):
     """Read a file (filename relative to the caller's module) and return it as a string.
     Returns:    a string with the file's content (utf-8 decoding)"""
+    pkg_resources = _pkg_resources()
     caller = inspect.stack()[1]
     mod = inspect.getmodule(caller[0])
     return pkg_resources.resource_string(mod.__name__, relative_path).decode("utf-8")
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""Status files of cluster jobs.
+
+The batch scripts of :class:`~coffe.core.cluster.ClusterJob` update their
+status file on the compute node (:code:`coffe core update-cluster-status`).
+This module is kept free of heavy imports, so that these updates start fast.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+
+class ClusterError(Exception):
+    """
+    A custom error class for cluster submission
+    """
+    pass
+
+
+class Status(type):
+    """
+    Status of a cluster job.
+    """
+    not_written = "not_written"  #: Script has not been written, yet.
+    not_submitted = "not_submitted"  #: Script written, not submitted.
+    queueing = "queueing"  #: Job has been submitted and is in the queue.
+    running = "running"  #: Job is currently running on the cluster.
+    completed = "completed"  #: Job has terminated successfully.
+    error = "error"  #: Job terminated, but did not complete.
+
+    @classmethod
+    def is_written(cls, status):
+        return not status == cls.not_written
+
+    @classmethod
+    def is_submitted(cls, status):
+        return status not in [cls.not_written, cls.not_submitted]
+
+    @classmethod
+    def read(cls, file):
+        """Read from file.
+
+        Returns:
+            A pair (status, job_id)
+
+             - str: status
+             - int: job_id (None if not yet queueing)
+        """
+        assert os.path.isfile(file)
+        with open(file,"r") as f:
+            content = f.read().strip().split()
+            if len(content) == 1:
+                status = content[0]
+                assert status in [cls.not_written, cls.not_submitted]
+                return status, None
+            elif len(content) == 2:
+                status, job_id = content
+                job_id = int(job_id)
+                assert status in [cls.queueing, cls.running,
+                                  cls.completed, cls.error]
+                return status, job_id
+            else:
+                raise ClusterError("Status file had bad format")
+
+    @classmethod
+    def write(cls, file, status, job_id=None):
+        """Write to file."""
+        if status == Status.queueing:
+            assert job_id is not None
+            with open(file, "w") as f:
+                f.write("{} {}".format(status, int(job_id)))
+        elif status in [Status.running,
+                        Status.completed,
+                        Status.error]:
+            assert job_id is None
+            previous, job_id = cls.read(file)
+            with open(file, "w") as f:
+                f.write("{} {}".format(status, job_id))
+        else:
+            assert status in [Status.not_written, Status.not_submitted]
+            assert job_id is None
+            with open(file, "w") as f:
+                f.write("{}".format(status))
@@ -39,6 +39,12 @@ To check for a minimal version, use::
 
 (version checks are not available to the decorator syntax).
 
+Programs are probed lazily, i.e. on the first access to
+:attr:`~Requirement.version`, :attr:`~Requirement.exists`, or
+:attr:`~Requirement.executable`. The versions are cached in the file given
+by the global option :code:`thirdparty_cache`, keyed by the executable's
+path and modification time, so that each installation is probed only once.
+
 To invoke a unit test only if a third-party requirement is met, use::
 
 
@@ -59,16 +65,23 @@ or, to skip a whole module::
 
 from __future__ import absolute_import, division, print_function
 
-import subprocess
 import functools
+import json
+import os
+import subprocess
+import tempfile
 import warnings
 
+try:
+    from shutil import which
+except ImportError:  # python 2
+    from distutils.spawn import find_executable as which
+
 from packaging.version import Version, InvalidVersion
 
 from coffe.core import pkgdata, graffiti
 
 from coffe.core.globconf import CONFIG
-from coffe.core import pkgdata
 
 # ========== GENERIC PART ============
 
@@ -112,8 +125,8 @@ class Requirement(object):
         self._program_opts = program_opts
         self._version_parser = version_parser
         self._version_flag = version_flag
-        self._version = self._obtain_version()
-        self._executable = self._obtain_executable()
+        self._version = None
+        self._executable = None
 
     @property
     def name(self):
@@ -133,17 +146,44 @@ class Requirement(object):
     @property
     def executable(self):
         """str: Full path of the executable."""
+        if self._executable is None:
+            self._executable = self._obtain_executable()
         return self._executable
 
     @property
     def version(self):
         """str: Version string."""
+        if self._version is None:
+            self._version = self._cached_version()
         return self._version
 
     @property
     def exists(self):
         """bool: Program is installed and visible to coffe."""
-        return self.version is not ""
+        return self.version != ""
+
+    def _cached_version(self):
+        """Look up the version in the cache file, or obtain and store it.
+
+        Returns:
+            str: Version, see :meth:`~_obtain_version`.
+        """
+        if self.executable == "":
+            return ""
+        try:
+            key = "{}|{}|{}|{}|{}".format(
+                self._program_name, self._program_cmd, self._program_opts,
+                self._version_flag, os.path.realpath(self.executable))
+            mtime = os.path.getmtime(self.executable)
+        except OSError:
+            return self._obtain_version()
+        cached = _read_version_cache().get(key)
+        if cached is not None and cached["mtime"] == mtime:
+            return cached["version"]
+        version = self._obtain_version()
+        if version != "":
+            _write_version_cache(key, {"mtime": mtime, "version": version})
+        return version
 
     def _obtain_version(self):
         """Obtain the version by calling the program with the version flag.
@@ -176,20 +216,12 @@ class Requirement(object):
                 return ""
 
     def _obtain_executable(self):
-        """Obtain the executable by calling the 'which <program_cmd>'.
+        """Obtain the executable by searching the PATH.
 
         Returns:
              str: The path of the program. Empty string, if not found.
         """
-        try:
-            p = subprocess.Popen(["which", self._program_cmd],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
-            out, err = p.communicate()
-            assert p.returncode == 0
-            return out.decode("latin-1").strip()
-        except:  # executable can not be found
-            return ""
+        return which(self._program_cmd) or ""
 
     def require(self, version=None):
         """
@@ -237,6 +269,49 @@ class Requirement(object):
         return wrapper
 
 
+def _version_cache_file():
+    """str: The cache file for program versions, or empty string if off."""
+    filename = CONFIG.thirdparty_cache.strip()
+    return os.path.expanduser(os.path.expandvars(filename)) if filename else ""
+
+
+def _read_version_cache():
+    """Read the version cache.
+
+    Returns:
+        dict: Cache entries; empty if the cache is off or unreadable.
+    """
+    filename = _version_cache_file()
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_version_cache(key, entry):
+    """Add an entry to the version cache.
+
+    The file is replaced atomically, so that concurrent jobs never read a
+    partly written cache. Failures are ignored; the cache is an optimization.
+    """
+    filename = _version_cache_file()
+    if not filename:
+        return
+    try:
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        cache = _read_version_cache()
+        cache[key] = entry
+        fd, tmp = tempfile.mkstemp(dir=directory or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        pass
+
+
 # ========== SPECIFIC PART ============
 
 # GROMACS
@@ -363,15 +438,27 @@ def amb_version():
     return AMBER.version
 
 
+_CONFIGURED_GROMACS = {}
+
+
+def _configured_gromacs():
+    """The requirement for the gromacs executable in the global config.
+
+    Returns:
+        Requirement: One instance per executable, so that the version is
+            obtained once per process (and cached on disk).
+    """
+    if CONFIG.gmx not in _CONFIGURED_GROMACS:
+        _CONFIGURED_GROMACS[CONFIG.gmx] = Requirement(
+            "Gromacs", CONFIG.gmx, version_parser=parse_gmx_version)
+    return _CONFIGURED_GROMACS[CONFIG.gmx]
+
+
 def check_for_gmx():
     """
     make sure that gromacs is installed
     """
-    try:
-        p = subprocess.Popen([CONFIG.gmx, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        p.communicate()
-        assert p.returncode == 0
-    except OSError:
+    if not _configured_gromacs().exists:
         raise OSError("No Gromacs executable found.")
 
 
@@ -385,15 +472,9 @@ def gmx_version():
     get gromacs version
     """
     check_for_gmx()
-    try:
-        p = subprocess.Popen([CONFIG.gmx, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        stdout, _ = p.communicate()
-        assert p.returncode == 0
-        for line in stdout.decode("latin-1").split("\n"):
-            if line.strip().startswith("GROMACS version:"):
-                return line.strip().replace("GROMACS version:","").replace("VERSION","").strip()
-    except OSError:
-        raise OSError("Gromacs version could not be determined.")
+    version = _configured_gromacs().version
+    if version != Requirement.VERSION_NOT_PARSED:
+        return version
 
 
 def check_for_torque():
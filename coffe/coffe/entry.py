@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""Entry point of the coffe console script.
+
+Every batch script of a :class:`~coffe.core.cluster.ClusterJob` calls
+:code:`coffe core update-cluster-status <status> <file>` twice and
+:code:`coffe run-class <file>` once. These calls are handled here without
+loading the command line interface (:mod:`coffe.cli`) and its
+dependencies. All other commands are passed on to :func:`coffe.cli.main`.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import sys
+
+
+def main():
+    """Run the coffe console script."""
+    args = sys.argv[1:]
+    if (len(args) == 4 and args[:2] == ["core", "update-cluster-status"]
+            and os.path.isfile(args[3])):
+        from coffe.core.status import Status
+        Status.write(args[3], args[2])
+        return
+    if len(args) == 2 and args[0] == "run-class":
+        from coffe.core import saver
+        # the default verbosity of coffe.cli.main
+        logging.getLogger().setLevel(logging.INFO)
+        print("Running instance")
+        saver.load_and_run(args[1])
+        return
+    from coffe.cli import main as cli_main
+    cli_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""Reading Gromacs energy files (.edr) without gmx energy.
+
+Energy files are XDR-encoded (big-endian). A header with the names and units
+of the energy terms is followed by one frame per energy step. Each frame holds
+the instantaneous values of all terms (and, if the frame sums over several
+steps, their averages and sums) and optional blocks of additional data
+(distance restraints, free energy differences), which are skipped.
+
+:class:`~EdrFile` reads the frames incrementally, so that the energy file of
+a running simulation can be tailed: each call of :meth:`~EdrFile.update` only
+parses the frames that were appended since the last call. A frame that is
+still being written is picked up by the next call.
+
+Files in the old format of gromacs versions before 4.0 are not supported.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import struct
+
+import numpy as np
+
+ENX_VERSION = 5  #: The newest version of the energy file format.
+HEADER_MAGIC = -55555  #: The first int of an energy file.
+FRAME_MAGIC = -7777777  #: The int after the first real of each frame.
+
+# data types of the subblocks (xdr_datatype in gromacs)
+_SUBBLOCK_TYPES = {0: ">i4", 1: ">f4", 2: ">f8", 3: ">i8"}
+_CHAR, _STRING = 4, 5
+
+
+class EdrError(Exception):
+    """The file is not an energy file that this reader supports."""
+
+
+class _Incomplete(Exception):
+    """The data ends before the item that is read (e.g. a frame that is still being written)."""
+
+
+class _XdrBuffer(object):
+    """Reads XDR-encoded items from a bytes object."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, n):
+        if self.pos + n > len(self.data):
+            raise _Incomplete()
+        start = self.pos
+        self.pos += n
+        return start
+
+    def int(self):
+        return struct.unpack_from(">i", self.data, self._take(4))[0]
+
+    def int64(self):
+        return struct.unpack_from(">q", self.data, self._take(8))[0]
+
+    def double(self):
+        return struct.unpack_from(">d", self.data, self._take(8))[0]
+
+    def string(self):
+        n = struct.unpack_from(">I", self.data, self._take(4))[0]
+        start = self._take(n + (-n) % 4)
+        return self.data[start:start + n].decode("ascii", "replace")
+
+    def array(self, dtype, n):
+        dtype = np.dtype(dtype)
+        start = self._take(n * dtype.itemsize)
+        return np.frombuffer(self.data, dtype=dtype, count=n, offset=start)
+
+
+class EdrFile(object):
+    """An energy file that is read incrementally.
+
+    Example:
+        >>> edr = EdrFile("ener.edr")
+        >>> edr.update()
+        >>> edr.times, edr.energies(["Density"])
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename (str): The energy file. It does not need to exist, yet.
+        """
+        self.filename = filename
+        self._reset()
+
+    def _reset(self):
+        self.terms = []
+        self.units = []
+        self.version = None
+        self._real = None
+        self._offset = 0
+        self._times = []
+        self._frames = []
+        self._cache = None
+
+    @property
+    def n_frames(self):
+        """int: The number of frames read so far."""
+        return len(self._times)
+
+    @property
+    def times(self):
+        """np.array: The times of the frames read so far in ps."""
+        return np.array(self._times, dtype=np.float64)
+
+    def index(self, term):
+        """The index of an energy term. Names are matched exactly or, if that fails,
+        case-insensitively.
+
+        Raises:
+            KeyError: If the file has no such term.
+        """
+        if term in self.terms:
+            return self.terms.index(term)
+        lower = [t.lower() for t in self.terms]
+        if term.lower() in lower:
+            return lower.index(term.lower())
+        raise KeyError("No energy term {} in {}".format(term, self.filename))
+
+    def energies(self, terms=None):
+        """The values of energy terms in the frames read so far.
+
+        Args:
+            terms (list of str): The names of the terms (default: all terms).
+
+        Returns:
+            np.array: The values, shape (n_frames, n_terms).
+        """
+        columns = (list(range(len(self.terms))) if terms is None
+                   else [self.index(term) for term in terms])
+        if self._cache is None or len(self._cache) != len(self._frames):
+            self._cache = (np.array(self._frames, dtype=np.float64) if self._frames
+                           else np.zeros((0, len(self.terms))))
+        return self._cache[:, columns]
+
+    def update(self):
+        """Read the frames that were appended to the file since the last call.
+
+        If the file has shrunk (e.g. because mdrun truncated it upon a continuation from a
+        checkpoint), it is read again from the start.
+
+        Returns:
+            int: The number of new frames.
+
+        Raises:
+            EdrError: If the file is not an energy file or has an unsupported format.
+        """
+        if not os.path.isfile(self.filename):
+            return 0
+        with open(self.filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self._offset:
+                self._reset()
+            f.seek(self._offset)
+            buf = _XdrBuffer(f.read())
+        if self.version is None:
+            try:
+                self._read_header(buf)
+            except _Incomplete:
+                return 0
+            self._offset += buf.pos
+            buf = _XdrBuffer(buf.data[buf.pos:])
+        n_frames = self.n_frames
+        while buf.pos < len(buf.data):
+            start = buf.pos
+            try:
+                time, energies = self._read_frame(buf)
+            except _Incomplete:
+                buf.pos = start
+                break
+            if len(energies) == len(self.terms):
+                self._times.append(time)
+                self._frames.append(energies)
+        self._offset += buf.pos
+        return self.n_frames - n_frames
+
+    def _read_header(self, buf):
+        magic = buf.int()
+        if magic != HEADER_MAGIC:
+            raise EdrError("{} is not an energy file of gromacs 4.0 or newer.".format(self.filename))
+        version = buf.int()
+        if version > ENX_VERSION:
+            raise EdrError("{} has an unsupported version {}.".format(self.filename, version))
+        n_terms = buf.int()
+        terms, units = [], []
+        for i in range(n_terms):
+            terms.append(buf.string())
+            units.append(buf.string() if version >= 2 else "kJ/mol")
+        self.version, self.terms, self.units = version, terms, units
+
+    def _detect_precision(self, buf):
+        """The first real of each frame is -2e10, which tells single from double precision."""
+        for real in [">f4", ">f8"]:
+            if len(buf.data) - buf.pos < np.dtype(real).itemsize:
+                raise _Incomplete()
+            if np.frombuffer(buf.data, dtype=real, count=1, offset=buf.pos)[0] < -1e10:
+                return real
+        raise EdrError("Unsupported frame format in {}.".format(self.filename))
+
+    def _read_frame(self, buf):
+        """Returns the time and the instantaneous energies of the next frame."""
+        if self._real is None:
+            self._real = self._detect_precision(buf)
+        buf.array(self._real, 1)
+        if buf.int() != FRAME_MAGIC:
+            raise EdrError("Energy frame magic number mismatch in {}.".format(self.filename))
+        version = buf.int()
+        time = buf.double()
+        buf.int64()  # step
+        nsum = buf.int()
+        if version >= 3:
+            buf.int64()  # nsteps
+        if version >= 5:
+            buf.double()  # dt
+        nre = buf.int()
+        ndisre = buf.int()  # reserved since version 4
+        nblock = buf.int()
+        if version < 4 and ndisre != 0:
+            raise EdrError("Old-style distance restraints in {} are not supported.".format(
+                self.filename))
+        # (data type, number of values) of all subblocks; their values follow the energies
+        subblocks = []
+        for b in range(nblock):
+            if version < 4:
+                # one subblock of reals
+                subblocks.append((self._real, buf.int()))
+            else:
+                buf.int()  # block id
+                for i in range(buf.int()):
+                    subblocks.append((buf.int(), buf.int()))
+        buf.int()  # e_size
+        buf.int()
+        buf.int()
+        # instantaneous value, and average and sum over the last nsum steps
+        values = buf.array(self._real, nre * 3 if nsum > 0 else nre)
+        energies = values[::3] if nsum > 0 else values
+        for data_type, nr in subblocks:
+            self._skip_subblock(buf, data_type, nr)
+        return time, energies.astype(np.float64)
+
+    def _skip_subblock(self, buf, data_type, nr):
+        if data_type == self._real:
+            buf.array(self._real, nr)
+        elif data_type in _SUBBLOCK_TYPES:
+            buf.array(_SUBBLOCK_TYPES[data_type], nr)
+        elif data_type == _CHAR:
+            # each char takes a full XDR unit
+            buf.array(">u4", nr)
+        elif data_type == _STRING:
+            for i in range(nr):
+                buf.string()
+        else:
+            raise EdrError("Unknown data type {} in {}.".format(data_type, self.filename))
+
+
+def read_edr(filename, terms):
+    """Read energy terms from an energy file.
+
+    Args:
+        filename (str): The energy file.
+        terms (list of str): The names of the terms.
+
+    Returns:
+        np.array: The times and values, shape (n_frames, 1 + n_terms), like the xvg files
+        written by gmx energy (see :func:`~coffe.gmx.observables.read_xvg`).
+
+    Raises:
+        IOError: If the file does not exist.
+        KeyError: If the file has no such term.
+        EdrError: If the file has an unsupported format.
+    """
+    if not os.path.isfile(filename):
+        raise IOError("No such file: {}".format(filename))
+    edr = EdrFile(filename)
+    edr.update()
+    if edr.version is None:
+        raise EdrError("{} has no header.".format(filename))
+    return np.column_stack([edr.times, edr.energies(terms)])
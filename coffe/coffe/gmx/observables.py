@@ -6,12 +6,13 @@ from __future__ import absolute_import, division, print_function
 
 from coffe.core.globconf import CONFIG
 from coffe.core import filesys, coffedir, shell
+from coffe.gmx import edr
 import os
 import numpy as np
-import pandas as pd
 import shutil
-from matplotlib import pyplot as plt
-from scipy.optimize import curve_fit
+
+# pandas, matplotlib and scipy are imported where needed, so that
+# simulations on compute nodes do not pay for them at start-up
 
 
 def read_xvg(xvg):
@@ -21,6 +22,19 @@ def read_xvg(xvg):
 
 
 def gmx_calc_energy(work_dir=".", terms=["Potential"], out="energy.xvg"):
+    """Read energy terms from the energy file ener.edr in work_dir.
+
+    The file is read directly (see :class:`~coffe.gmx.edr.EdrFile`). Only if that
+    fails (e.g. for files of old gromacs versions or unknown terms), gmx energy is
+    called, which writes the xvg file out.
+
+    Returns:
+        np.array: The times and values, one column per term (see :func:`~read_xvg`).
+    """
+    try:
+        return edr.read_edr(os.path.join(work_dir, "ener.edr"), terms)
+    except (edr.EdrError, KeyError, IOError, OSError):
+        pass
     with coffedir.CoffeWorkDir(work_dir, "gmx_calc_energy", locals()) as cwd:
         stdin = os.linesep.join(terms) + os.linesep
         cmd = "{} energy -o {}".format(CONFIG.gmx, out)
@@ -28,6 +42,116 @@ def gmx_calc_energy(work_dir=".", terms=["Potential"], out="energy.xvg"):
         return read_xvg(os.path.join(cwd.work_dir, out))
 
 
+def block_confidence_interval(values, confidence=0.99, n_blocks=5):
+    """Confidence interval of the mean of a correlated time series.
+
+    The series is split into blocks, whose means are treated as
+    independent samples (Student's t distribution).
+
+    Args:
+        values (np.array): The time series.
+        confidence (float): The confidence level.
+        n_blocks (int): The number of blocks.
+
+    Returns:
+        A pair (lower, upper). :code:`(-inf, inf)`, if there are less
+        values than blocks.
+    """
+    from scipy.stats import t
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < n_blocks or n_blocks < 2:
+        return -np.inf, np.inf
+    blocks = np.array_split(values, n_blocks)
+    means = np.array([np.mean(b) for b in blocks])
+    sem = np.std(means, ddof=1) / np.sqrt(n_blocks)
+    half_width = t.ppf(0.5 + confidence / 2, n_blocks - 1) * sem
+    return np.mean(means) - half_width, np.mean(means) + half_width
+
+
+def statistical_inefficiency(values):
+    """Statistical inefficiency of a correlated time series.
+
+    :code:`g = 1 + 2 sum_t (1 - t/N) C(t)`, where C is the normalized
+    autocorrelation function (computed via FFT). The sum is truncated
+    where C first drops to zero. The series holds :code:`N/g`
+    effectively uncorrelated samples.
+
+    Args:
+        values (np.array): The time series.
+
+    Returns:
+        float: g (at least 1). 1.0 for constant series and series of
+        less than two values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n < 2:
+        return 1.0
+    dx = values - np.mean(values)
+    variance = np.dot(dx, dx) / n
+    if variance == 0:
+        return 1.0
+    size = 2**int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(dx, size)
+    acf = np.fft.irfft(f * np.conj(f), size)[1:n] / (variance * np.arange(n - 1, 0, -1))
+    zero = np.nonzero(acf <= 0)[0]
+    cut = zero[0] if len(zero) else n - 1
+    t = np.arange(1, cut + 1)
+    g = 1.0 + 2.0 * np.sum((1.0 - t / n) * acf[:cut])
+    return max(1.0, g)
+
+
+def detect_equilibration(values, n_candidates=100):
+    """Detect the equilibrated region of a time series.
+
+    The start t0 of the equilibrated region maximizes the number of
+    effectively uncorrelated samples :code:`(N - t0)/g(t0)` after it
+    (Chodera, J. Chem. Theory Comput. 12, 1799 (2016)).
+
+    Args:
+        values (np.array): The time series.
+        n_candidates (int): The number of (evenly spaced) candidates for t0.
+
+    Returns:
+        A triple (t0, g, n_eff): the first equilibrated index, the
+        statistical inefficiency of the equilibrated region, and its number
+        of effectively uncorrelated samples.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n < 3:
+        return 0, 1.0, float(n)
+    candidates = np.unique(np.linspace(0, n - 2, min(n_candidates, n - 1)).astype(int))
+    best = None
+    for t0 in candidates:
+        g = statistical_inefficiency(values[t0:])
+        n_eff = (n - t0) / g
+        if best is None or n_eff > best[2]:
+            best = (int(t0), g, n_eff)
+    return best
+
+
+def equilibrated_mean(values):
+    """Mean and standard error of the equilibrated region of a time series
+    (see :func:`~detect_equilibration`).
+
+    Args:
+        values (np.array): The time series.
+
+    Returns:
+        A tuple (mean, standard error, t0, g). The standard error accounts
+        for the autocorrelation (statistical inefficiency g). It is inf, if
+        there are less than two values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    t0, g, n_eff = detect_equilibration(values)
+    equilibrated = values[t0:]
+    if len(equilibrated) < 2:
+        return np.mean(equilibrated), np.inf, t0, g
+    sem = np.std(equilibrated, ddof=1) / np.sqrt(n_eff)
+    return np.mean(equilibrated), sem, t0, g
+
+
 def get_density_xvg(traj, topol, terms="0", first_frame=0, last_frame=0,
                     dens="mass", out="density.xvg", work_dir="."):
     """Creates a density profile xvg for the system
@@ -110,9 +234,12 @@ def gmx_density_fit(density_xvg, dens="mass", show_plot=True, work_dir="."):
     Edits the input structure
     Arguments:
         density_xvg:                    -- (.xvg) density plot which is being analyzed
+        show_plot:                      -- (optional) True: show the fit, False: save it
+                                           to density_fit.png, None: no figure
         work_dir:                       -- (optional) working directory
     Returns:                            returns liquid and vapor densities as well as the interface width
        """
+    from scipy.optimize import curve_fit
     with coffedir.CoffeWorkDir(work_dir, "Creating a curve fit",
                                locals()) as cwd:
         def func_l(z, rho_1, rho_2, z_0, D):
@@ -173,22 +300,24 @@ def gmx_density_fit(density_xvg, dens="mass", show_plot=True, work_dir="."):
                 np.vstack((data_l, data_r)), split_pos + 50)
             popt_l, pcov_l, popt_r, pcov_r = fitting(data_l, data_r)
 
-        plt.clf()
-        plt.xlabel('z [nm]')
-        plt.ylabel('Density {}'.format(unit))
-        plt.plot(data_l[:, 0], data_l[:, 1], 'b-', label='left side')
-        plt.plot(data_l[:, 0], func_l(data_l[:, 0], *popt_l), 'r-',
-                 label='fit_l: rho_1=%5.3f, rho_2=%5.3f, z_0=%5.3f, D=%5.3f' % tuple(
-                     popt_l))
-        plt.plot(data_r[:, 0], data_r[:, 1], 'b-', label='right side')
-        plt.plot(data_r[:, 0], func_r(data_r[:, 0], *popt_r), 'r-',
-                 label='fit_r: rho_1=%5.3f, rho_2=%5.3f, z_0=%5.3f, D=%5.3f' % tuple(
-                     popt_r))
-        plt.legend()
-        if show_plot == True:
-            plt.show()
-        else:
-            plt.savefig("{}/density_fit.png".format(work_dir))
+        if show_plot is not None:
+            from matplotlib import pyplot as plt
+            plt.clf()
+            plt.xlabel('z [nm]')
+            plt.ylabel('Density {}'.format(unit))
+            plt.plot(data_l[:, 0], data_l[:, 1], 'b-', label='left side')
+            plt.plot(data_l[:, 0], func_l(data_l[:, 0], *popt_l), 'r-',
+                     label='fit_l: rho_1=%5.3f, rho_2=%5.3f, z_0=%5.3f, D=%5.3f' % tuple(
+                         popt_l))
+            plt.plot(data_r[:, 0], data_r[:, 1], 'b-', label='right side')
+            plt.plot(data_r[:, 0], func_r(data_r[:, 0], *popt_r), 'r-',
+                     label='fit_r: rho_1=%5.3f, rho_2=%5.3f, z_0=%5.3f, D=%5.3f' % tuple(
+                         popt_r))
+            plt.legend()
+            if show_plot == True:
+                plt.show()
+            else:
+                plt.savefig("{}/density_fit.png".format(work_dir))
 
         rho_l = (popt_l[0] + popt_r[0]) / 2
         rho_v = (popt_l[1] + popt_r[1]) / 2
@@ -202,6 +331,164 @@ def gmx_density_fit(density_xvg, dens="mass", show_plot=True, work_dir="."):
             (data_l, data_r)), popt_l, popt_r, split_out
 
 
+def slab_profile(z, params):
+    """Density profile of a slab of one phase in another (two tanh interfaces).
+
+    :code:`rho(z) = rho_out + (rho_in - rho_out)/2 * (tanh((z - z_1)/D) - tanh((z - z_2)/D))`
+
+    Args:
+        z (np.array): The positions, shape (n_z,).
+        params (np.array): The parameters (rho_in, rho_out, z_1, z_2, D) of one
+            profile, shape (5,), or of several profiles, shape (n_profiles, 5).
+
+    Returns:
+        np.array: The densities, shape (n_z,) or (n_profiles, n_z).
+    """
+    params = np.asarray(params, dtype=np.float64)
+    rho_in, rho_out, z_1, z_2, width = [p[..., None] for p in np.moveaxis(params, -1, 0)]
+    return rho_out + (rho_in - rho_out) / 2 * (np.tanh((z - z_1) / width) -
+                                               np.tanh((z - z_2) / width))
+
+
+def _slab_initial_guess(z, profile):
+    """Parameters of :func:`~slab_profile` from the crossings of the mean density."""
+    threshold = (np.max(profile) + np.min(profile)) / 2
+    above = profile > threshold
+    crossings = np.nonzero(above[1:] != above[:-1])[0]
+    if len(crossings) < 2:
+        raise ValueError("The density profile does not have two interfaces.")
+    i_1, i_2 = crossings[0], crossings[-1]
+    inside = np.zeros(len(z), dtype=bool)
+    inside[i_1 + 1:i_2 + 1] = True
+    dz = z[1] - z[0]
+    return np.array([np.mean(profile[inside]), np.mean(profile[~inside]),
+                     z[i_1] + dz / 2, z[i_2] + dz / 2, max(2 * dz, 0.1)])
+
+
+def fit_density_profiles(z, profiles, initial=None):
+    """Fit the density profiles of a two-phase slab system, e.g. one per time block.
+
+    The profiles are fitted by :func:`~slab_profile` all at once with
+    :code:`scipy.optimize.least_squares`. The residuals of all profiles are
+    computed in one vectorized call, and the Jacobian is block-diagonal
+    (each profile only depends on its own parameters), which is passed as
+    jac_sparsity. All fits start from the parameters of the mean profile.
+
+    Args:
+        z (np.array): The positions, shape (n_z,).
+        profiles (np.array): The densities, shape (n_profiles, n_z).
+        initial (np.array): Initial parameters (rho_in, rho_out, z_1, z_2, D), shared by all
+            profiles (default: estimated from the mean profile).
+
+    Returns:
+        A dictionary with the fitted parameters of all profiles ("params", shape
+        (n_profiles, 5)), their liquid and vapour densities ("rho_l", "rho_v"), interface
+        widths ("D"), and the block averages ("rho_l_mean", "rho_v_mean", "D_mean") and their
+        standard errors ("rho_l_error", "rho_v_error", "D_error", nan for a single profile).
+    """
+    from scipy.optimize import least_squares
+    from scipy.sparse import block_diag
+    z = np.asarray(z, dtype=np.float64)
+    profiles = np.atleast_2d(np.asarray(profiles, dtype=np.float64))
+    n_profiles, n_z = profiles.shape
+    if initial is None:
+        initial = _slab_initial_guess(z, np.mean(profiles, axis=0))
+    length = z[-1] - z[0]
+    lower = np.tile([-np.inf, -np.inf, z[0] - length, z[0] - length, 1e-3 * length], n_profiles)
+    upper = np.tile([np.inf, np.inf, z[-1] + length, z[-1] + length, length], n_profiles)
+
+    def residuals(x):
+        return (slab_profile(z, x.reshape(n_profiles, 5)) - profiles).ravel()
+
+    sparsity = block_diag([np.ones((n_z, 5))] * n_profiles)
+    x0 = np.clip(np.tile(initial, n_profiles), lower, upper)
+    fit = least_squares(residuals, x0, bounds=(lower, upper), jac_sparsity=sparsity,
+                        x_scale="jac")
+    params = fit.x.reshape(n_profiles, 5)
+    result = {"params": params,
+              "rho_l": np.max(params[:, :2], axis=1),
+              "rho_v": np.min(params[:, :2], axis=1),
+              "D": params[:, 4]}
+    for key in ["rho_l", "rho_v", "D"]:
+        result[key + "_mean"] = np.mean(result[key])
+        result[key + "_error"] = (np.std(result[key], ddof=1) / np.sqrt(n_profiles)
+                                  if n_profiles > 1 else np.nan)
+    return result
+
+
+def get_density_profiles(traj, topol, first_frame, last_frame, n_blocks=5, dens="mass",
+                         work_dir="."):
+    """Density profiles of consecutive time blocks of a trajectory (gmx density).
+
+    Args:
+        traj, topol, dens, work_dir: see :func:`~get_density_xvg`
+        first_frame (float): The start of the first block in ps.
+        last_frame (float): The end of the last block in ps.
+        n_blocks (int): The number of blocks.
+
+    Returns:
+        A pair (z, profiles) of np.arrays with shapes (n_z,) and (n_blocks, n_z).
+    """
+    assert last_frame > first_frame, "The blocks need a time range."
+    edges = np.linspace(first_frame, last_frame, n_blocks + 1)
+    z, profiles = None, []
+    for i in range(n_blocks):
+        xvg = get_density_xvg(traj, topol, "0", edges[i], edges[i + 1], dens,
+                              out="density_block{}.xvg".format(i), work_dir=work_dir)
+        data = read_xvg(xvg)
+        if z is None:
+            z = data[:, 0]
+        # the box may fluctuate; the profiles are compared on the grid of the first block
+        profiles.append(np.interp(z, data[:, 0], data[:, 1]))
+    return z, np.array(profiles)
+
+
+def fit_two_phase_densities(traj, topol, first_frame, last_frame, n_blocks=5, dens="mass",
+                            work_dir="."):
+    """Liquid and vapour densities of a two-phase slab system with block-average error bars.
+
+    The trajectory is split into time blocks, whose density profiles are fitted together
+    (see :func:`~fit_density_profiles`). Nothing is plotted; see :func:`~plot_density_fit`.
+
+    Args:
+        see :func:`~get_density_profiles`
+
+    Returns:
+        The dictionary of :func:`~fit_density_profiles`, with the positions ("z") and the
+        profiles ("profiles").
+    """
+    z, profiles = get_density_profiles(traj, topol, first_frame, last_frame, n_blocks, dens,
+                                       work_dir)
+    result = fit_density_profiles(z, profiles)
+    result["z"] = z
+    result["profiles"] = profiles
+    return result
+
+
+def plot_density_fit(result, filename=None, unit="[kg/m3]"):
+    """Plot the profiles and fits of :func:`~fit_two_phase_densities`.
+
+    Args:
+        result (dict): The result of the fit (with the keys "z" and "profiles").
+        filename (str): The image file. None: show the plot.
+        unit (str): The unit of the densities.
+    """
+    from matplotlib import pyplot as plt
+    plt.clf()
+    plt.xlabel("z [nm]")
+    plt.ylabel("Density {}".format(unit))
+    for i, (profile, params) in enumerate(zip(result["profiles"], result["params"])):
+        line, = plt.plot(result["z"], profile, "-", alpha=0.5, label="block {}".format(i))
+        plt.plot(result["z"], slab_profile(result["z"], params), "--", color=line.get_color())
+    plt.title("rho_l = {:.3f} +- {:.3f}, rho_v = {:.3f} +- {:.3f}".format(
+        result["rho_l_mean"], result["rho_l_error"], result["rho_v_mean"], result["rho_v_error"]))
+    plt.legend()
+    if filename is None:
+        plt.show()
+    else:
+        plt.savefig(filename)
+
+
 def get_densities(traj, topol, n_substances=1, first_frame=0, last_frame=0,
                   dens="mass", show_plot=True, out="density.xvg", work_dir="."):
     """ creates a density fit for two phase systems from gromacs files
@@ -214,6 +501,7 @@ def get_densities(traj, topol, n_substances=1, first_frame=0, last_frame=0,
         work_dir:                       -- (optional) working directory
     Returns:                            returns liquid and vapor densities as well as the interface width
     """
+    import pandas as pd
     with coffedir.CoffeWorkDir(work_dir,
                                "Getting Densities from gromacs files...",
                                locals()) as cwd:
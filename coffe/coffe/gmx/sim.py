@@ -6,6 +6,11 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import shutil
+import signal
+import subprocess
+import time
+
+import numpy as np
 
 from coffe.core.globconf import CONFIG
 
@@ -13,6 +18,9 @@ import coffe.core.coffedir
 from coffe.core.decorators import args_from_configfile
 from coffe.core import shell, thirdparty
 from coffe.gmx import util as gmxutil
+from coffe.gmx import edr
+from coffe.gmx import observables
+from coffe.gmx import tune
 
 
 class GmxCalculation(coffe.core.coffedir.CoffeWorkDir):
@@ -160,10 +168,23 @@ class GmxCalculation(coffe.core.coffedir.CoffeWorkDir):
         assert os.path.isfile(os.path.join(self.work_dir, "topol.tpr")), \
             "Portable steering script 'topol.tpr' was not created by grompp."
 
+    def _mdrun_command(self):
+        """The mdrun command, pinned to the cores of the job (see
+        :func:`~coffe.gmx.util.mdrun_command`) and with the tuned thread
+        options, if the global option mdrun_autotune is switched on and the
+        calculation runs dynamics (see :func:`~coffe.gmx.tune.autotune`)."""
+        command = gmxutil.mdrun_command()
+        if tune.autotune_enabled() and tune.is_dynamics(self.mdp_file):
+            setting = tune.autotune(self.structure, self.topology, self.mdp_file,
+                                    self.abspath("topol.tpr"),
+                                    os.path.join(self.coffe_dir, "tune"), command)
+            command = tune.tuned_command(command, setting)
+        return command
+
     @coffe.core.coffedir.log_exceptions
     def _mdrun(self):
         """Run Gromacs mdrun."""
-        command = CONFIG.gmx_mdrun + " -cpi state.cpt"
+        command = self._mdrun_command() + " -cpi state.cpt"
         try:
             self.call_cmd(command)
         except shell.ShellError as e:
@@ -173,6 +194,281 @@ class GmxCalculation(coffe.core.coffedir.CoffeWorkDir):
             "Output file 'confout.gro' was not created by mdrun."
 
 
+class GmxMultiCalculation(coffe.core.coffedir.CoffeWorkDir):
+    """Gromacs calculations in several directories that are run by one
+    :code:`gmx mdrun -multidir` call (one simulation per MPI rank group).
+
+    The preprocessor runs separately in each directory. This fills the cores
+    of a node with simulations of small systems that do not scale to many
+    cores. The calculations are typically the same stage of several
+    simulation chains (see :func:`coffe.gmx.simgen.bundle`).
+    Early stopping (:class:`~GmxCalculationEarlyStopping`) is not applied
+    within a bundle.
+    """
+
+    @coffe.core.coffedir.log_exceptions
+    def __init__(self, calculations, work_dir="."):
+        """
+        Args:
+            calculations: a list of :class:`~GmxCalculation` in different working directories
+            work_dir: working directory of the mdrun call (default: current working directory)
+        """
+        super(GmxMultiCalculation, self).__init__(work_dir, "GmxMultiCalculation", locals())
+        assert len(set(calc.work_dir for calc in calculations)) == len(calculations), \
+            "The calculations of a GmxMultiCalculation need separate working directories."
+        self.calculations = calculations
+
+    @coffe.core.coffedir.log_exceptions
+    def __call__(self):
+        """Run the preprocessor in each directory and all calculations at once.
+
+        Raises:
+            GromacsError: If something goes wrong in grompp or mdrun.
+        """
+        self.logger.info("Running {} calculations".format(len(self.calculations)))
+        for calc in self.calculations:
+            if not calc.finished_grompp:
+                assert calc._ready_for_grompp()
+                calc._grompp()
+        command = "{} -multidir {} -cpi state.cpt".format(
+            gmxutil.multidir_command(len(self.calculations)),
+            " ".join(calc.work_dir for calc in self.calculations))
+        try:
+            self.call_cmd(command)
+        except shell.ShellError as e:
+            raise gmxutil.GromacsError(e, self.last_errfile)
+
+        missing = [calc.work_dir for calc in self.calculations
+                   if not os.path.isfile(os.path.join(calc.work_dir, "confout.gro"))]
+        assert not missing, \
+            "Output file 'confout.gro' was not created by mdrun in {}.".format(missing)
+        self.logger.info("Gmx calculations finished.")
+
+
 class GmxCalculationEarlyStopping(GmxCalculation):
-    # TODO(AK) implement early stopping
-    pass
+    """A Gromacs calculation that is stopped as soon as it is clear that the
+    mean of an energy term will end up outside an acceptable window.
+
+    While mdrun is running, the partial energy file is analyzed every
+    check_interval seconds. If the confidence interval of the running mean
+    (after discarding the first part of the run as equilibration) lies
+    completely outside the acceptable window, mdrun is sent SIGTERM.
+    Gromacs then writes a checkpoint and stops at the next step.
+    The energy file of a stopped run remains readable, so that the
+    evaluation can be completed from the partial run.
+    """
+
+    @coffe.core.coffedir.log_exceptions
+    @args_from_configfile
+    def __init__(self, structure, topology, mdp_file, work_dir=".", mdp_options={}, overwrite=False,
+                 checkpoint=None, term="Density", acceptable=None, confidence=0.99, check_interval=60,
+                 discard=0.2, n_blocks=5):
+        """Supports :func:`~coffe.core.decorators.args_from_configfile`.
+
+        Args:
+            structure, topology, mdp_file, work_dir, mdp_options, overwrite, checkpoint:
+                see :class:`~GmxCalculation`
+            term: the energy term that is monitored (default: "Density")
+            acceptable: a pair (lower, upper); the run is stopped, if the mean of the term is
+                certain to end up outside. None: never stop (default: None)
+            confidence: confidence level of the interval of the running mean (default: 0.99)
+            check_interval: time between two checks in seconds (default: 60)
+            discard: fraction of the values that is discarded as equilibration (default: 0.2)
+            n_blocks: number of blocks for the confidence interval (default: 5)
+        """
+        super(GmxCalculationEarlyStopping, self).__init__(
+            structure, topology, mdp_file, work_dir=work_dir, mdp_options=mdp_options,
+            overwrite=overwrite, checkpoint=checkpoint)
+        self.term = term
+        self.acceptable = acceptable
+        self.confidence = confidence
+        self.check_interval = check_interval
+        self.discard = discard
+        self.n_blocks = n_blocks
+        self.stopped_file = os.path.join(self.coffe_dir, "stopped_early.txt")
+        self._energy_file = None
+
+    @property
+    def stopped_early(self):
+        """bool: Whether the last run was stopped early."""
+        return os.path.isfile(self.stopped_file)
+
+    def should_stop(self, values):
+        """Decide from the values of the term so far, whether to stop the run.
+
+        Args:
+            values: the time series of the monitored term
+
+        Returns:
+            bool: True, if the confidence interval of the mean lies outside the acceptable window.
+        """
+        if self.acceptable is None:
+            return False
+        values = values[int(self.discard * len(values)):]
+        lower, upper = observables.block_confidence_interval(values, self.confidence, self.n_blocks)
+        return upper < self.acceptable[0] or lower > self.acceptable[1]
+
+    @coffe.core.coffedir.log_exceptions
+    def _mdrun(self):
+        """Run Gromacs mdrun and monitor the energy file."""
+        if self.stopped_early:
+            os.remove(self.stopped_file)
+        self._energy_file = edr.EdrFile(os.path.join(self.work_dir, "ener.edr"))
+        command = self._mdrun_command() + " -cpi state.cpt"
+        stdout_file, stderr_file = self._stdout_file(command), self._stderr_file(command)
+        self._last_outfile, self._last_errfile = stdout_file, stderr_file
+        with open(stdout_file, "w") as stdout, open(stderr_file, "w") as stderr:
+            process = subprocess.Popen(command.split(), stdout=stdout, stderr=stderr,
+                                       cwd=self.work_dir)
+            stopped = False
+            next_check = time.time() + self.check_interval
+            while process.poll() is None:
+                time.sleep(min(1.0, self.check_interval))
+                if stopped or time.time() < next_check:
+                    continue
+                next_check = time.time() + self.check_interval
+                if self._check_energy():
+                    self._stop(process)
+                    stopped = True
+        if stopped:
+            return
+        if process.returncode != 0:
+            raise gmxutil.GromacsError(
+                shell.ShellError("Error. Command {} terminated with exit code {}.".format(
+                    command, process.returncode)), stderr_file)
+
+        assert os.path.isfile(os.path.join(self.work_dir, "confout.gro")), \
+            "Output file 'confout.gro' was not created by mdrun."
+
+    def _stop(self, process):
+        """Send SIGTERM to mdrun and mark the run as stopped early."""
+        self.logger.info("Stopping mdrun: {} is outside of {}.".format(self.term, self.acceptable))
+        process.send_signal(signal.SIGTERM)
+        shell.touch(self.stopped_file)
+
+    def _check_energy(self):
+        """Analyze the partial energy file. Failures (e.g. an energy file that has no frames, yet)
+        do not stop the run."""
+        if self.acceptable is None:
+            return False
+        values = self._read_term()
+        return values is not None and self.should_stop(values)
+
+    def _read_term(self):
+        """The time series of the monitored term in the partial energy file, or None.
+        Only the frames that were written since the last check are parsed."""
+        if not os.path.isfile(os.path.join(self.work_dir, "ener.edr")):
+            return None
+        if self._energy_file is not None:
+            try:
+                self._energy_file.update()
+                values = self._energy_file.energies([self.term])[:, 0]
+                return values if len(values) else None
+            except (edr.EdrError, KeyError, IOError, OSError):
+                self._energy_file = None
+        try:
+            values = observables.gmx_calc_energy(self.work_dir, [self.term], out="early_stopping.xvg")
+        except (shell.ShellError, ValueError, AssertionError):
+            return None
+        values = np.atleast_2d(values)
+        if values.shape[1] < 2:
+            return None
+        return values[:, 1]
+
+
+class GmxCalculationAdaptive(GmxCalculationEarlyStopping):
+    """A Gromacs production run whose length adapts to the convergence of an energy term.
+
+    While mdrun is running, the equilibrated region and the statistical inefficiency of the
+    monitored term are detected (see :func:`~coffe.gmx.observables.equilibrated_mean`).
+    mdrun is sent SIGTERM as soon as the standard error of the mean falls below target_error.
+    Runs are extended from the checkpoint (-cpi) up to max_time (-nsteps), unless they
+    converge earlier. Early stopping outside an acceptable window (see
+    :class:`~GmxCalculationEarlyStopping`) is applied, as well.
+    """
+
+    @coffe.core.coffedir.log_exceptions
+    @args_from_configfile
+    def __init__(self, structure, topology, mdp_file, work_dir=".", mdp_options={}, overwrite=False,
+                 checkpoint=None, term="Density", acceptable=None, confidence=0.99, check_interval=60,
+                 discard=0.2, n_blocks=5, target_error=None, max_time=None, min_samples=20):
+        """Supports :func:`~coffe.core.decorators.args_from_configfile`.
+
+        Args:
+            structure, topology, mdp_file, work_dir, mdp_options, overwrite, checkpoint, term,
+                acceptable, confidence, check_interval, discard, n_blocks:
+                see :class:`~GmxCalculationEarlyStopping`
+            target_error: the run is stopped, once the standard error of the mean of the term
+                is below this value. None: never stop (default: None)
+            max_time: the maximum length of the run in ps. None: the length in the mdp file
+                (default: None)
+            min_samples: the minimum number of effectively uncorrelated samples in the
+                equilibrated region, before the standard error is trusted (default: 20)
+        """
+        super(GmxCalculationAdaptive, self).__init__(
+            structure, topology, mdp_file, work_dir=work_dir, mdp_options=mdp_options,
+            overwrite=overwrite, checkpoint=checkpoint, term=term, acceptable=acceptable,
+            confidence=confidence, check_interval=check_interval, discard=discard,
+            n_blocks=n_blocks)
+        self.target_error = target_error
+        self.max_time = max_time
+        self.min_samples = min_samples
+        self.converged_file = os.path.join(self.coffe_dir, "converged.txt")
+        self._converged = False
+
+    @property
+    def converged(self):
+        """bool: Whether the last run was stopped, because the standard error met the target."""
+        return os.path.isfile(self.converged_file)
+
+    def is_converged(self, values):
+        """Decide from the values of the term so far, whether the mean has converged.
+
+        Args:
+            values: the time series of the monitored term
+
+        Returns:
+            bool: True, if the standard error of the mean of the equilibrated region is below
+            target_error.
+        """
+        if self.target_error is None:
+            return False
+        mean, sem, t0, g = observables.equilibrated_mean(values)
+        n_eff = (len(values) - t0) / g
+        self.logger.info("{}: {} +- {} (equilibrated from frame {}, g = {:.1f}).".format(
+            self.term, mean, sem, t0, g))
+        return n_eff >= self.min_samples and sem <= self.target_error
+
+    def _mdrun_command(self):
+        """The mdrun command; with -nsteps, if max_time is set."""
+        command = super(GmxCalculationAdaptive, self)._mdrun_command()
+        if self.max_time is None:
+            return command
+        try:
+            dt = float(gmxutil.read_mdp_option(self.mdp_file, "dt"))
+        except AssertionError:
+            dt = 0.001  # the gromacs default
+        return command + " -nsteps {}".format(int(round(self.max_time / dt)))
+
+    def _mdrun(self):
+        if self.converged:
+            os.remove(self.converged_file)
+        self._converged = False
+        super(GmxCalculationAdaptive, self)._mdrun()
+
+    def _check_energy(self):
+        if self.target_error is None and self.acceptable is None:
+            return False
+        values = self._read_term()
+        if values is None:
+            return False
+        self._converged = self.is_converged(values)
+        return self._converged or self.should_stop(values)
+
+    def _stop(self, process):
+        if not self._converged:
+            return super(GmxCalculationAdaptive, self)._stop(process)
+        self.logger.info("Stopping mdrun: the standard error of {} is below {}.".format(
+            self.term, self.target_error))
+        process.send_signal(signal.SIGTERM)
+        shell.touch(self.converged_file)
@@ -16,7 +16,8 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
     """A generator for gromacs simulation plans."""
 
     @args_from_configfile
-    def __init__(self, names=[], mdp_files=[], mdp_options=None, types=None, root_dir="."):
+    def __init__(self, names=[], mdp_files=[], mdp_options=None, types=None, root_dir=".",
+                 type_kwargs=None):
         """Constructor
         Arguments:
             names       -- names of individual calulations (then subdirectories)
@@ -24,6 +25,8 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
             mdp_options -- a list of dictionaries, where each dictionary specifies a set of mdp options
             types       -- a list of gromacs calculation types (like GmxCalculation)
             root_dir    -- the root directory (for relative paths in mdp, structure, and topology files)
+            type_kwargs -- a list of dictionaries with additional arguments for the calculation types
+                           (e.g. the acceptable window of a GmxCalculationEarlyStopping)
 
         """
 
@@ -44,6 +47,11 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
         else:
             assert isinstance(types, list) and len(types) == len(names)
             self.types = deepcopy(types)
+        if type_kwargs is None:
+            self.type_kwargs = [{} for _ in names]
+        else:
+            assert len(type_kwargs) == len(names)
+            self.type_kwargs = deepcopy(type_kwargs)
 
         self.names = deepcopy(names)
         self.mdp_files = [os.path.join(self.root_dir, m) for m in mdp_files]
@@ -55,12 +63,16 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
         for o in self.mdp_options:
             assert isinstance(o, dict)
         for t in self.types:
-            assert t in [sim.GmxCalculation, sim.GmxCalculationEarlyStopping]
+            assert t in [sim.GmxCalculation, sim.GmxCalculationEarlyStopping,
+                         sim.GmxCalculationAdaptive]
 
-    def generate(self, work_dir, structure, topology, overwrite=False):
+    def generate(self, work_dir, structure, topology, overwrite=False, warm_start=None):
         """Generate a chain of gromacs simulations.
         Arguments:
-
+            warm_start -- a triple (first, structure, checkpoint) to start the chain from an
+                          equilibrated state, e.g. of a previous chain with similar parameters:
+                          the stages before index first are skipped and stage first starts from
+                          the given structure and checkpoint (None: no checkpoint)
 
         Note: structure and topology ARE RELATIVE TO ROOT_DIR, not WORK_DIR
         Returns:
@@ -73,11 +85,17 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
         cc = cmdchain.CommandChain(work_dir=work_dir)
         intermediate_struc = initial_struc
         intermediate_chkpt = None
-        for name, mdp, opt, SimType in zip(self.names, self.mdp_files, self.mdp_options, self.types):
+        first = 0
+        if warm_start is not None:
+            first, intermediate_struc, intermediate_chkpt = warm_start
+            assert os.path.isfile(intermediate_struc)
+        for name, mdp, opt, SimType, kwargs in zip(self.names[first:], self.mdp_files[first:],
+                                                   self.mdp_options[first:], self.types[first:],
+                                                   self.type_kwargs[first:]):
             simulation = SimType(structure=intermediate_struc, topology=top,
                                  mdp_file=mdp, work_dir=os.path.join(cc.work_dir, name),
-                                 mdp_options=opt, overwrite=overwrite, checkpoint=intermediate_chkpt
-                                 )
+                                 mdp_options=opt, overwrite=overwrite, checkpoint=intermediate_chkpt,
+                                 **kwargs)
             cc += [simulation]
             intermediate_struc = os.path.join(simulation.work_dir, "confout.gro")
             # start from checkpoint
@@ -90,3 +108,43 @@ class GmxChainGenerator(coffe.core.coffedir.CoffeWorkDir):
                 intermediate_chkpt = os.path.join(simulation.work_dir, "state.cpt")
         return cc
 
+    def generate_bundle(self, work_dir, member_dirs, structure, topologies, overwrite=False):
+        """Generate simulation chains for several topologies that are run in lockstep,
+        each stage by one gmx mdrun -multidir call (see :func:`~bundle`).
+        Arguments:
+            work_dir    -- working directory of the bundle
+            member_dirs -- working directories of the chains (one per topology)
+            structure   -- the initial structure of all chains
+            topologies  -- a list of topologies, e.g. with different force field parameters
+            overwrite   -- see sim.GmxCalculation
+
+        Note: structure and topologies ARE RELATIVE TO ROOT_DIR, not WORK_DIR
+        Returns:
+            A CommandChain of sim.GmxMultiCalculation. The results of each chain are in
+            its member_dir, as if the chain had been run on its own.
+        """
+        assert len(member_dirs) == len(topologies)
+        chains = [self.generate(member_dir, structure, top, overwrite=overwrite)
+                  for member_dir, top in zip(member_dirs, topologies)]
+        return bundle(chains, work_dir)
+
+
+def bundle(chains, work_dir):
+    """Bundle simulation chains into one chain. Each stage runs the calculations of all chains
+    with one gmx mdrun -multidir call (see sim.GmxMultiCalculation). Chains are aligned at their
+    last stage, so that chains that skip early stages (warm starts) join the bundle later.
+    Arguments:
+        chains   -- CommandChains of gromacs calculations (e.g. from GmxChainGenerator.generate)
+        work_dir -- working directory of the bundle
+    Returns:
+        A CommandChain with one sim.GmxMultiCalculation per stage.
+    """
+    n_stages = max(len(chain) for chain in chains)
+    cc = cmdchain.CommandChain(work_dir=work_dir)
+    for i in range(n_stages):
+        stage = [chain[len(chain) - n_stages + i] for chain in chains
+                 if len(chain) - n_stages + i >= 0]
+        cc += [sim.GmxMultiCalculation(stage,
+                                       work_dir=os.path.join(cc.work_dir, "stage{}".format(i)))]
+    return cc
+
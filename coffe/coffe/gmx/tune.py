@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+"""Tuning the performance of gmx mdrun.
+
+The best parallelization of mdrun (the split of threads into thread-MPI
+ranks and OpenMP threads, the number of PME ranks, and the neighbor list
+interval) depends on the system and on the hardware. :class:`~MdrunTuner`
+runs short benchmark segments of a run input file over a grid of settings
+and picks the fastest one. :func:`~autotune` keeps the best settings in a
+cache file (keyed by system and hardware), so that the benchmarks are
+run only once per system and node type.
+
+If the global option mdrun_autotune is switched on, each
+:class:`~coffe.gmx.sim.GmxCalculation` that runs dynamics applies the tuned
+settings automatically (see :func:`~tuned_command`); energy minimizations
+are not tuned.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import re
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # not on windows
+    fcntl = None
+
+from coffe.core.globconf import CONFIG
+from coffe.core import coffedir, shell, thirdparty
+from coffe.core.cluster import NTOMP_VARIABLE
+
+THREAD_OPTIONS = ["-nt", "-ntmpi", "-ntomp", "-npme", "-nstlist"]  #: Options set by the tuner.
+
+
+def autotune_enabled():
+    """bool: Whether the global option mdrun_autotune is switched on."""
+    return CONFIG.mdrun_autotune.strip().lower() in ["true", "yes", "1"]
+
+
+def hardware_fingerprint(n_cores=None):
+    """A key for the hardware that mdrun runs on.
+
+    Nodes with the same processor model, number of cores, and gromacs
+    version share their tuned settings.
+
+    Args:
+        n_cores (int): The number of cores that mdrun uses
+            (default: see :func:`~available_cores`).
+
+    Returns:
+        str: The fingerprint.
+    """
+    model = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model = line.split(":", 1)[1].strip()
+                    break
+    except (IOError, OSError):
+        pass
+    if n_cores is None:
+        n_cores = available_cores()
+    gpus = os.environ.get("CUDA_VISIBLE_DEVICES", "")
+    fingerprint = "|".join([model, str(multiprocessing.cpu_count()),
+                            str(n_cores), gpus, str(thirdparty.gmx_version())])
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+# mdp options that change the cost of a step
+PERFORMANCE_MDP_OPTIONS = [
+    "integrator", "dt", "cutoff-scheme", "nstlist", "rlist", "verlet-buffer-tolerance",
+    "coulombtype", "rcoulomb", "vdwtype", "vdw-modifier", "rvdw", "dispcorr",
+    "fourierspacing", "fourier-nx", "fourier-ny", "fourier-nz", "pme-order",
+    "constraints", "constraint-algorithm", "lincs-order", "tcoupl", "nsttcouple",
+    "pcoupl", "nstpcouple", "nstcalcenergy", "nstenergy", "nstxout-compressed",
+    "free-energy", "pbc"]
+
+# integrators of dynamics (as opposed to energy minimization etc.)
+DYNAMICS_INTEGRATORS = ["md", "md-vv", "md-vv-avek", "sd", "bd"]
+
+
+def system_key(structure, topology, mdp_file):
+    """A key for the performance of a simulated system.
+
+    Only properties that set the cost of an mdrun step enter the key, so
+    that all evaluations of a force field optimization (which only change
+    parameter values) and all boxes of similar size share their settings.
+
+    Args:
+        structure (str): The structure file (.gro or .pdb). The number of
+            atoms and the box, rounded to 0.5 nm, enter the key.
+        topology (str): The topology file. The composition of the system
+            (section [ molecules ]) enters the key.
+        mdp_file (str): The mdp file. The run-control options in
+            :data:`~PERFORMANCE_MDP_OPTIONS` enter the key.
+
+    Returns:
+        str: The key.
+    """
+    n_atoms, box = _read_atoms_and_box(structure)
+    mdp = _read_mdp(mdp_file)
+    key = {"n_atoms": n_atoms,
+           "box": [round(x * 2) / 2 for x in box],
+           "molecules": _read_molecules(topology),
+           "mdp": dict((option, mdp[option]) for option in PERFORMANCE_MDP_OPTIONS
+                       if option in mdp)}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def is_dynamics(mdp_file):
+    """bool: Whether the mdp file runs dynamics (default integrator md),
+    rather than e.g. an energy minimization, which is not worth tuning."""
+    return _read_mdp(mdp_file).get("integrator", "md") in DYNAMICS_INTEGRATORS
+
+
+def _read_mdp(mdp_file):
+    """dict: The options of an mdp file (lower case, "-" instead of "_")."""
+    options = {}
+    with open(mdp_file, "r") as f:
+        for line in f:
+            line = re.split("[;#]", line)[0]
+            if "=" not in line:
+                continue
+            option, value = line.split("=", 1)
+            options[option.strip().lower().replace("_", "-")] = value.strip().lower()
+    return options
+
+
+def _read_molecules(topology):
+    """list: The [ molecules ] section of a topology file as (name, count) pairs."""
+    molecules = []
+    in_section = False
+    with open(topology, "r") as f:
+        for line in f:
+            line = line.split(";")[0].strip()
+            if line.startswith("["):
+                in_section = line.strip("[] ").lower() == "molecules"
+            elif in_section and line and not line.startswith("#"):
+                molecules.append(line.split()[:2])
+    return molecules
+
+
+def _read_atoms_and_box(structure):
+    """The number of atoms and the box vectors (in nm) of a .gro or .pdb file."""
+    with open(structure, "r") as f:
+        lines = f.read().splitlines()
+    if structure.endswith(".gro"):
+        box = [float(x) for x in lines[-1].split()] if len(lines) > 2 else []
+        return int(lines[1]) if len(lines) > 1 else 0, box
+    n_atoms = len([line for line in lines if line.startswith(("ATOM", "HETATM"))])
+    box = []
+    for line in lines:
+        if line.startswith("CRYST1"):
+            # Angstrom
+            box = [float(x) / 10.0 for x in line[6:33].split()]
+    return n_atoms, box
+
+
+def available_cores(command=None):
+    """int: The number of cores for mdrun: the cores of the job, if run by
+    the :class:`~coffe.core.cluster.LocalScheduler`, otherwise the value of
+    -nt in the command, otherwise all cores of the machine."""
+    if NTOMP_VARIABLE in os.environ:
+        return int(os.environ[NTOMP_VARIABLE])
+    if command is None:
+        command = CONFIG.gmx_mdrun
+    words = command.split()
+    if "-nt" in words and words.index("-nt") + 1 < len(words):
+        return int(words[words.index("-nt") + 1])
+    return multiprocessing.cpu_count()
+
+
+def benchmark_grid(n_cores, npme=(-1,), nstlist=(None, 40, 80)):
+    """Settings to benchmark.
+
+    Args:
+        n_cores (int): The number of cores. Each setting uses all of them
+            (ntmpi * ntomp = n_cores).
+        npme (tuple): Numbers of PME ranks (-1: chosen by mdrun). Values that
+            are not smaller than ntmpi are skipped.
+        nstlist (tuple): Neighbor list intervals (None: the value in the
+            mdp file).
+
+    Returns:
+        list of dict: The settings (keys ntmpi, ntomp, npme, nstlist).
+    """
+    grid = []
+    for ntmpi in range(1, n_cores + 1):
+        if n_cores % ntmpi != 0:
+            continue
+        for n in npme:
+            if n > 0 and n >= ntmpi:
+                continue
+            for nst in nstlist:
+                grid.append({"ntmpi": ntmpi, "ntomp": n_cores // ntmpi,
+                             "npme": n, "nstlist": nst})
+    return grid
+
+
+def setting_options(setting):
+    """str: The mdrun options of a setting."""
+    options = "-ntmpi {} -ntomp {}".format(setting["ntmpi"], setting["ntomp"])
+    if setting.get("npme") is not None:
+        options += " -npme {}".format(setting["npme"])
+    if setting.get("nstlist") is not None:
+        options += " -nstlist {}".format(setting["nstlist"])
+    return options
+
+
+def tuned_command(command, setting):
+    """Replace the thread options of an mdrun command by a tuned setting.
+
+    Args:
+        command (str): The mdrun command.
+        setting (dict): The setting, see :func:`~benchmark_grid`.
+            If None, the command is returned unchanged.
+
+    Returns:
+        str: The command.
+    """
+    if setting is None:
+        return command
+    words = command.split()
+    kept = []
+    i = 0
+    while i < len(words):
+        if words[i] in THREAD_OPTIONS:
+            i += 2
+        else:
+            kept.append(words[i])
+            i += 1
+    return " ".join(kept + [setting_options(setting)])
+
+
+def parse_performance(logfile):
+    """Read the performance from an mdrun log file.
+
+    Returns:
+        float: The performance in ns/day. None, if the log has no
+        performance line (e.g. because the run failed).
+    """
+    with open(logfile, "r") as f:
+        for line in f:
+            if line.startswith("Performance:"):
+                return float(line.split()[1])
+    return None
+
+
+class MdrunTuner(coffedir.CoffeWorkDir):
+    """Benchmark mdrun settings for a run input file."""
+
+    def __init__(self, tpr, work_dir, command=None, grid=None, nsteps=None):
+        """
+        Args:
+            tpr (str): The run input file (from grompp).
+            work_dir (str): The directory of the benchmark runs.
+            command (str): The mdrun command (default: gmx_mdrun from the
+                global configuration).
+            grid (list of dict): The settings (default:
+                :func:`~benchmark_grid` for the available cores).
+            nsteps (int): Steps of each benchmark run (default:
+                mdrun_tune_steps from the global configuration).
+        """
+        super(MdrunTuner, self).__init__(work_dir, "MdrunTuner", locals())
+        self.tpr = self.abspath(tpr)
+        if command is None:
+            command = CONFIG.gmx_mdrun
+        self.command = command
+        if grid is None:
+            grid = benchmark_grid(available_cores(command))
+        self.grid = grid
+        if nsteps is None:
+            nsteps = int(CONFIG.mdrun_tune_steps)
+        self.nsteps = nsteps
+        self.results = []
+
+    def __call__(self):
+        """Run the benchmarks.
+
+        Returns:
+            dict: The fastest setting (with its performance in the key
+            ns_per_day). None, if no benchmark succeeded.
+        """
+        self.results = []
+        for i, setting in enumerate(self.grid):
+            name = "bench{}".format(i)
+            cmd = "{} -s {} -deffnm {} -nsteps {} -resethway -noconfout".format(
+                tuned_command(self.command, setting), self.tpr, name, self.nsteps)
+            try:
+                self.call_cmd(cmd)
+            except shell.ShellError:
+                # e.g. a decomposition that does not fit the box
+                self.logger.info("Setting {} failed.".format(setting_options(setting)))
+                continue
+            performance = parse_performance(self.abspath(name + ".log"))
+            if performance is None:
+                continue
+            self.logger.info("{}: {} ns/day".format(setting_options(setting), performance))
+            result = dict(setting)
+            result["ns_per_day"] = performance
+            self.results.append(result)
+        if not self.results:
+            return None
+        return max(self.results, key=lambda result: result["ns_per_day"])
+
+
+def autotune(structure, topology, mdp_file, tpr, work_dir, command=None):
+    """The tuned setting of a system on this hardware.
+
+    The setting is read from the cache file (global option mdrun_tune_cache).
+    If the cache has no entry, the benchmarks are run in work_dir and the
+    best setting is stored.
+
+    Args:
+        structure, topology, mdp_file: The input files (see :func:`~system_key`).
+            Calculations whose keys match share the setting.
+        tpr (str): The run input file.
+        work_dir (str): The directory of the benchmark runs.
+        command (str): The mdrun command.
+
+    Returns:
+        dict: The setting. None, if no benchmark succeeded.
+    """
+    key = "{}|{}".format(system_key(structure, topology, mdp_file),
+                         hardware_fingerprint(available_cores(command)))
+    # concurrent evaluations on one node wait for the benchmarks of the first one
+    with _TuneCacheLock():
+        cache = _read_tune_cache()
+        if key in cache:
+            return cache[key]
+        setting = MdrunTuner(tpr, work_dir, command=command)()
+        if setting is not None:
+            _write_tune_cache(key, setting)
+    return setting
+
+
+class _TuneCacheLock(object):
+    """An exclusive lock on the cache file (<cache>.lock). Does nothing,
+    if the cache is off or files cannot be locked."""
+
+    def __init__(self):
+        self._file = None
+
+    def __enter__(self):
+        filename = _tune_cache_file()
+        if not filename or fcntl is None:
+            return self
+        try:
+            directory = os.path.dirname(filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._file = open(filename + ".lock", "w")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        except (IOError, OSError):
+            self._file = None
+        return self
+
+    def __exit__(self, *args):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+def _tune_cache_file():
+    """str: The cache file for tuned settings, or empty string if off."""
+    filename = CONFIG.mdrun_tune_cache.strip()
+    return os.path.expanduser(os.path.expandvars(filename)) if filename else ""
+
+
+def _read_tune_cache():
+    """dict: The cached settings; empty if the cache is off or unreadable."""
+    try:
+        with open(_tune_cache_file(), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_tune_cache(key, setting):
+    """Add a setting to the cache (replaced atomically, failures are ignored)."""
+    filename = _tune_cache_file()
+    if not filename:
+        return
+    try:
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        cache = _read_tune_cache()
+        cache[key] = setting
+        fd, tmp = tempfile.mkstemp(dir=directory or ".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        pass
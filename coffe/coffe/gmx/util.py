@@ -28,6 +28,48 @@ def gmx_parse_fatal_error(filename):
     return errmsg
 
 
+def mdrun_command(command=None):
+    """The mdrun command, pinned to the cores of the job.
+
+    Local jobs that are run by the :class:`~coffe.core.cluster.LocalScheduler`
+    find their cores in the environment. The thread options of the command
+    are then replaced, so that mdrun uses exactly these cores
+    (-nt <cores> -pin on -pinoffset <first core>). Outside of such jobs,
+    the command is returned unchanged.
+
+    Args:
+        command (str): The mdrun command (default: gmx_mdrun from the
+            global configuration).
+
+    Returns:
+        str: The command.
+    """
+    from coffe.core.cluster import PINOFFSET_VARIABLE, NTOMP_VARIABLE
+    if command is None:
+        command = CONFIG.gmx_mdrun
+    if NTOMP_VARIABLE not in os.environ:
+        return command
+    words = command.split()
+    replaced = ["-nt", "-ntmpi", "-ntomp", "-pin", "-pinoffset", "-pinstride"]
+    kept = []
+    i = 0
+    while i < len(words):
+        if words[i] in replaced:
+            i += 2
+        else:
+            kept.append(words[i])
+            i += 1
+    kept += ["-nt", os.environ[NTOMP_VARIABLE], "-pin", "on",
+             "-pinoffset", os.environ.get(PINOFFSET_VARIABLE, "0")]
+    return " ".join(kept)
+
+
+def multidir_command(n_dirs):
+    """The mdrun command for n_dirs simulations (gmx_mdrun_multidir from the
+    global configuration, with {n} replaced by n_dirs)."""
+    return CONFIG.gmx_mdrun_multidir.replace("{n}", str(n_dirs))
+
+
 class GromacsError(Exception):
     def __init__(self, exception, stderr_file):
         try:
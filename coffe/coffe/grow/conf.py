@@ -1,15 +1,14 @@
 import os.path
 import os
 from subprocess import call
-from time import sleep
 from coffe.core import cluster
 from coffe.grow.grow_sander_ff_opt import mstart
-import pandas as pd
 
 class SanderWrapper:
 
     def __init__(self, outdir, bindir, extrm_template, mol2_file, 
-                 leaprc_file, w2p_file, target_names, batch_template=None, oncluster=False):
+                 leaprc_file, w2p_file, target_names, batch_template=None, oncluster=False,
+                 n_workers=1, pilot=None):
         self.outdir = outdir
         self.bindir = bindir
         self.extrm_template = extrm_template
@@ -19,10 +18,13 @@ class SanderWrapper:
         self.leaprc_file = leaprc_file
         self.w2p_file = w2p_file
         self.target_names = target_names
+        self.n_workers = n_workers
+        self.pilot = pilot
 
         self._make_dir()
 
     def get_results(self):
+        import pandas as pd
         df = pd.read_csv(self.res_file, header=None)
         results = [e[0] for e in df.values[1:]]
         return results
@@ -38,11 +40,15 @@ class SanderWrapper:
 
     def simulate(self, x):
         mm = MMCalc(x, self.outdir, self.bindir, self.extrm_template, self.mol2_file, 
-                    self.leaprc_file, self.w2p_file, self.target_names)        
+                    self.leaprc_file, self.w2p_file, self.target_names,
+                    n_workers=self.n_workers)        
         if self.oncluster:
             job_name = "amb"
-            job = cluster.ClusterJob("slurm", self.batch_template, 
-                                     job_name, self.outdir)   
+            if self.pilot is not None:
+                job = self.pilot.generate_job(self.outdir, job_name)
+            else:
+                job = cluster.ClusterJob("slurm", self.batch_template, 
+                                         job_name, self.outdir)   
             print("job created")
             job += mm
             print("job added")
@@ -50,8 +56,7 @@ class SanderWrapper:
             print("job submitted")
             
             # wait until the job is done or aborted
-            while(job.status not in ["completed", "error"]):
-                sleep(5)
+            job.wait()
 
         else:
             mm()
@@ -62,7 +67,7 @@ class SanderWrapper:
 class MMCalc:
 
     def __init__(self, x, dirname, bindir, extrm_template, mol2_file, 
-                 leaprc_file, w2p_file, target_names):
+                 leaprc_file, w2p_file, target_names, n_workers=1):
         self.x = x
         self.dirname = dirname
         self.outpath = os.path.join(dirname, "out")
@@ -72,6 +77,7 @@ class MMCalc:
         self.leaprc_file = leaprc_file
         self.w2p_file = w2p_file
         self.target_names = target_names
+        self.n_workers = n_workers
 
     def result_file_path(self):
         return os.path.join(self.outpath, "properties.txt")
@@ -81,5 +87,6 @@ class MMCalc:
 
     def __mm__(self):
         mstart(self.x, self.outpath, self.bindir, self.extrm_template, self.mol2_file, 
-                 self.leaprc_file, self.w2p_file, self.target_names)
+                 self.leaprc_file, self.w2p_file, self.target_names,
+                 n_workers=self.n_workers)
 
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent store of objective function evaluations"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+class EvaluationCache:
+    """
+    A persistent store of simulation results, backed by a SQLite file.
+
+    Entries are keyed by a hash of the rounded parameter vector and the
+    contents of the input files (see make_key), so that repeated points,
+    restarted optimizations and other experiments over the same inputs
+    can reuse results. Point several experiments to the same file to
+    share it between them.
+
+    Each key can hold one result per kind, e.g. "md" (the density) and
+    "mm" (the energies of all conformers), which are computed by
+    different simulations.
+    """
+
+    def __init__(self, path, max_entries=None, max_age=None, decimals=8):
+        """
+        Arguments:
+        path: (string) the SQLite file, created if it does not exist
+        max_entries: (int) maximum number of entries; the least recently
+            used ones are evicted (None: no limit)
+        max_age: (float) entries older than max_age days are evicted
+            (None: no limit)
+        decimals: (int) parameter vectors are rounded to this number of
+            decimals before hashing
+        """
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.decimals = decimals
+        self._file_hashes = {}
+
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS evaluations ("
+                        "key TEXT, kind TEXT, value TEXT, "
+                        "created REAL, accessed REAL, "
+                        "PRIMARY KEY (key, kind))")
+        self.evict()
+
+    def make_key(self, x, files=(), contents=()):
+        """
+        Returns the key (hex string) of an evaluation at x.
+
+        Arguments:
+        x: (list-like) the parameter vector
+        files: (list) input files whose contents affect the result,
+            directories stand for all files in them
+        contents: (list of strings) further inputs, e.g. templates that are
+            already in memory
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([round(float(xi), self.decimals) + 0.0
+                             for xi in x]).encode())
+        for f in files:
+            h.update(self.file_hash(f).encode())
+        for c in contents:
+            h.update(hashlib.sha256(c.encode()).hexdigest().encode())
+        return h.hexdigest()
+
+    def file_hash(self, path):
+        """
+        Returns the sha256 of a file's contents (or of all files in a
+        directory). Hashes are computed once per instance.
+        """
+        path = os.path.abspath(path)
+        if path not in self._file_hashes:
+            h = hashlib.sha256()
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    h.update(name.encode())
+                    h.update(self.file_hash(os.path.join(path, name)).encode())
+            else:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        h.update(chunk)
+            self._file_hashes[path] = h.hexdigest()
+        return self._file_hashes[path]
+
+    def get(self, key, kind):
+        """
+        Returns the stored value, or None if there is no entry.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT value FROM evaluations "
+                              "WHERE key=? AND kind=?", (key, kind)).fetchone()
+            if row is None:
+                return None
+            con.execute("UPDATE evaluations SET accessed=? "
+                        "WHERE key=? AND kind=?", (time.time(), key, kind))
+        return json.loads(row[0])
+
+    def put(self, key, kind, value):
+        """
+        Stores a (json serializable) value and evicts old entries.
+        """
+        now = time.time()
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO evaluations "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, kind, json.dumps(value), now, now))
+        self.evict()
+
+    def evict(self):
+        """
+        Removes entries that are older than max_age and the least recently
+        used entries beyond max_entries.
+        """
+        with self._connect() as con:
+            if self.max_age is not None:
+                oldest = time.time() - self.max_age * 86400
+                con.execute("DELETE FROM evaluations WHERE created < ?",
+                            (oldest,))
+            if self.max_entries is not None:
+                con.execute("DELETE FROM evaluations WHERE rowid NOT IN ("
+                            "SELECT rowid FROM evaluations "
+                            "ORDER BY accessed DESC LIMIT ?)",
+                            (int(self.max_entries),))
+
+    def __len__(self):
+        with self._connect() as con:
+            return con.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    def _connect(self):
+        # one connection per call, so that the cache can be used from the
+        # evaluation threads and by other processes at the same time
+        return _Connection(self.path)
+
+
+class _Connection:
+    """
+    A SQLite connection that commits and closes at the end of a with block.
+    """
+    def __init__(self, path):
+        self.con = sqlite3.connect(path, timeout=60)
+
+    def __enter__(self):
+        return self.con
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.con.commit()
+        finally:
+            self.con.close()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""Gaussian process model with incremental updates"""
+
+from concurrent.futures import ProcessPoolExecutor
+import copy
+
+import numpy as np
+from scipy.linalg import cho_solve, cholesky, solve_triangular
+from sklearn.gaussian_process import GaussianProcessRegressor
+
+
+class IncrementalGP:
+    """
+    A Gaussian process regressor for observations that arrive one batch at
+    a time.
+
+    New observations are appended to the Cholesky factor of the kernel
+    matrix (block update, O(n^2 k) for k new points) instead of
+    factorizing the whole matrix again. The kernel hyperparameters are
+    re-optimized only every refit_every updates or when the marginal
+    likelihood per observation has drifted by more than lml_drift since
+    the last optimization. The optimization starts from the previous
+    optimum, the n_restarts random restarts run in a process pool.
+
+    The interface follows sklearn's GaussianProcessRegressor
+    (fit, predict, kernel_), so that the model can replace it in
+    BayesianOptimization.
+    """
+
+    def __init__(self, kernel, n_restarts=50, refit_every=10, lml_drift=0.2,
+                 alpha=1e-10, n_jobs=None):
+        """
+        Arguments:
+        kernel: (sklearn kernel) the initial kernel, its hyperparameters are
+            optimized on the first fit
+        n_restarts: (int) number of random restarts of the hyperparameter
+            optimization
+        refit_every: (int) re-optimize the hyperparameters every refit_every
+            updates
+        lml_drift: (float) re-optimize the hyperparameters, when the log
+            marginal likelihood per observation changed by more than this
+        alpha: (float) value added to the diagonal of the kernel matrix
+        n_jobs: (int) number of processes for the restarts, None for the
+            number of cpus
+        """
+        self.kernel = kernel
+        self.n_restarts = n_restarts
+        self.refit_every = refit_every
+        self.lml_drift = lml_drift
+        self.alpha = alpha
+        self.n_jobs = n_jobs
+
+        self.kernel_ = None
+        self.X_train_ = None
+        self.y_train_ = None
+        self.L_ = None
+        self.alpha_ = None
+        self._updates = 0
+        self._lml_at_refit = None
+
+    def fit(self, X, Y):
+        """
+        Update the model to the observations (X, Y). Observations that the
+        model has seen before are kept, so that only the new ones are added
+        to the factorization. Their order in X does not matter.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        Y = np.asarray(Y, dtype=float)
+
+        new = self._new_rows(X, Y)
+        if new is None:
+            # first fit, or old observations have changed
+            self.X_train_, self.y_train_ = X, Y
+            if self.kernel_ is None:
+                self._optimize_hyperparameters()
+            else:
+                # keep the kernel; the drift is measured from the new data
+                self._factorize()
+                self._reset_refit_baseline()
+            return self
+        if not len(new):
+            return self
+
+        self._append(X[new], Y[new])
+        self._updates += 1
+        drift = abs(self.log_marginal_likelihood() / len(self.y_train_)
+                    - self._lml_at_refit)
+        if self._updates >= self.refit_every or drift > self.lml_drift:
+            self._optimize_hyperparameters()
+        return self
+
+    def predict(self, X, return_std=False):
+        """
+        Predict the mean (and standard deviation) at all rows of X.
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        K_trans = self.kernel_(X, self.X_train_)
+        mean = K_trans @ self.alpha_
+        if not return_std:
+            return mean
+        V = solve_triangular(self.L_, K_trans.T, lower=True)
+        var = self.kernel_.diag(X) - np.einsum("ij,ij->j", V, V)
+        var[var < 0] = 0.0
+        return mean, np.sqrt(var)
+
+    def log_marginal_likelihood(self):
+        """
+        Log marginal likelihood of the training data with the current
+        hyperparameters, using the stored factorization.
+        """
+        n = len(self.y_train_)
+        return (-0.5 * self.y_train_ @ self.alpha_
+                - np.log(np.diag(self.L_)).sum()
+                - 0.5 * n * np.log(2 * np.pi))
+
+    def _new_rows(self, X, Y):
+        """
+        Returns the indices of the rows of X that are not in the training
+        data, or None if the training data is not contained in (X, Y).
+        Rows are matched as a multiset, so that a point that was observed
+        k times is only absorbed k times.
+        """
+        if self.X_train_ is None:
+            return None
+        rows = {}
+        for i, (x, y) in enumerate(zip(X, Y)):
+            rows.setdefault((tuple(x), y), []).append(i)
+        seen = set()
+        for x, y in zip(self.X_train_, self.y_train_):
+            unmatched = rows.get((tuple(x), y))
+            if not unmatched:
+                return None
+            seen.add(unmatched.pop(0))
+        return [i for i in range(len(X)) if i not in seen]
+
+    def _append(self, X_new, Y_new):
+        """
+        Extend the Cholesky factor by the new observations.
+        """
+        K12 = self.kernel_(self.X_train_, X_new)
+        K22 = self.kernel_(X_new) + self.alpha * np.eye(len(X_new))
+        L21 = solve_triangular(self.L_, K12, lower=True).T
+        L22 = cholesky(K22 - L21 @ L21.T, lower=True)
+        n, k = len(self.L_), len(X_new)
+        L = np.zeros((n + k, n + k))
+        L[:n, :n] = self.L_
+        L[n:, :n] = L21
+        L[n:, n:] = L22
+        self.L_ = L
+        self.X_train_ = np.vstack([self.X_train_, X_new])
+        self.y_train_ = np.concatenate([self.y_train_, Y_new])
+        self.alpha_ = cho_solve((self.L_, True), self.y_train_)
+
+    def _factorize(self):
+        K = self.kernel_(self.X_train_)
+        K[np.diag_indices_from(K)] += self.alpha
+        self.L_ = cholesky(K, lower=True)
+        self.alpha_ = cho_solve((self.L_, True), self.y_train_)
+
+    def _optimize_hyperparameters(self):
+        """
+        Optimize the kernel hyperparameters, warm-started from the current
+        optimum, plus n_restarts random starts in a process pool.
+        """
+        start = self.kernel_ if self.kernel_ is not None else self.kernel
+        bounds = start.bounds
+        thetas = [start.theta]
+        for _ in range(self.n_restarts):
+            thetas.append(np.random.uniform(bounds[:, 0], bounds[:, 1]))
+
+        args = [(start, theta, self.X_train_, self.y_train_, self.alpha)
+                for theta in thetas]
+        if self.n_restarts > 0:
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+                results = list(pool.map(_fit_from_theta, *zip(*args)))
+        else:
+            results = [_fit_from_theta(*args[0])]
+
+        lml, kernel = max(results, key=lambda r: r[0])
+        self.kernel_ = kernel
+        self._factorize()
+        self._reset_refit_baseline()
+
+    def _reset_refit_baseline(self):
+        """
+        Count updates and the drift of the log marginal likelihood from the
+        current training data.
+        """
+        self._updates = 0
+        self._lml_at_refit = self.log_marginal_likelihood() / len(self.y_train_)
+
+
+def _fit_from_theta(kernel, theta, X, Y, alpha):
+    """
+    Optimize the hyperparameters of kernel, starting from theta.
+    Returns the log marginal likelihood and the optimized kernel.
+    """
+    gp = GaussianProcessRegressor(kernel=kernel.clone_with_theta(theta),
+                                  alpha=alpha)
+    gp.fit(X, Y)
+    return gp.log_marginal_likelihood_value_, copy.deepcopy(gp.kernel_)
@@ -5,9 +5,14 @@ import sys
 import shutil
 import glob
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
 import fileinput
+import hashlib
 import re
 
+from coffe.amb.prmtop import AmberPrmtop
+
 ''' REQUIRED ENVIRONMENTAL VARIABLE, DIRECTORIES AND FILES
 1. BINDIR/00_qm_opt/molecule-*-gam.inp.log
 2. leaprc.extrm
@@ -72,191 +77,210 @@ class TopFileTemplate():
 
 
 
-def mstart(x, OUTPATH, BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, target_names):
-
-    ###########################################################
-    def relative_energy(completeList = [], *args):
-        RELATIVE_E = []
-        energylist = []
-        for line in completeList:
-            energylist.append(line.split(' ')[1])
-        EMIN = energylist[0]
-        print('First entry in completeList:',completeList[0])
-        print('EMIN = ',EMIN)
-        for E in range(0,len(energylist)):
-            RELATIVE_E.append(completeList[E].split(' ')[0] + ' ' + str(float(energylist[E])-float(EMIN)))
-        return RELATIVE_E
-
-    ## Collects final energies of MM minimizations
-    def GET_AMBER_ENERGY(LOG,moleculeName):
-        START = 'FINAL RESULTS'
-        END = 'BOND'
-        LINES= []
-        print("file:::", LOG)
-        with open(LOG) as input_data:
-            for line in input_data:
+def create_mm_mol2_coords(INFILE, MOL2):
+    START = '@<TRIPOS>ATOM'
+    END = '@<TRIPOS>BOND'
+    COORD = []
+    ATOMLABEL = []
+    RESNAME = []
+    ATOMTYPES = []
+    CHARGES = []
+    LINE = []
+    ## Extract unique xyz coordinates
+    if MOL2.endswith('.mol2'):
+        with open(MOL2) as input_data_1:
+            for line in input_data_1:
                 if line.strip() == START:
                     break
             # Reads text until the end of the block:
-            for line in input_data:
+            for line in input_data_1:
                 if line.strip() == END:
                     break
-                LINES.append(line.split())
-        LINES = [x for x in LINES if x]  ## remove empty lists
-        AMBER_ENERGIES.append(moleculeName + " " + LINES[1][1])
-
-    def create_mm_mol2_coords(INFILE, MOL2):
-        START = '@<TRIPOS>ATOM'
-        END = '@<TRIPOS>BOND'
-        COORD = []
-        ATOMLABEL = []
-        RESNAME = []
-        ATOMTYPES = []
-        CHARGES = []
-        LINE = []
-        ## Extract unique xyz coordinates
-        if MOL2.endswith('.mol2'):
-            with open(MOL2) as input_data_1:
-                for line in input_data_1:
-                    if line.strip() == START:
-                        break
-                # Reads text until the end of the block:
-                for line in input_data_1:
-                    if line.strip() == END:
-                        break
-                    COORD.append(line[19:46])
-
-        if MOL2.endswith('.xyz'):
-            i=1
-            with open(MOL2) as input_data_1:
-                for line in input_data_1:
-                    if i > 2:
-                        COORD.append(line[16:68])
-                    i+=1
-
-        ## Extract proper labels, atom types and charges
-        with open(INFILE) as input_data:
-            for line in input_data:
-                if line.strip() == START:
-                    break
-            for line in input_data:
+                COORD.append(line[19:46])
+
+    if MOL2.endswith('.xyz'):
+        i=1
+        with open(MOL2) as input_data_1:
+            for line in input_data_1:
+                if i > 2:
+                    COORD.append(line[16:68])
+                i+=1
+
+    ## Extract proper labels, atom types and charges
+    with open(INFILE) as input_data:
+        for line in input_data:
+            if line.strip() == START:
+                break
+        for line in input_data:
+            if line.strip() == END:
+                break
+            ATOMLABEL.append(line[0:18])
+            RESNAME.append(line[50:65])
+            ATOMTYPES.append(line.split()[5])
+            CHARGES.append(line.split()[8])
+
+    ## combine them
+    for a, b, c, d, e in zip(ATOMLABEL,COORD,ATOMTYPES,RESNAME,CHARGES):
+        LINE.append(a + ' ' + b + ' ' + c + ' ' + d + ' ' + e)
+    return LINE
+
+def psi2xyz(INFILE,OUTFILE):
+    START = 'Final optimized geometry and variables:'
+    END = 'Cleaning optimization helper files.'
+    GEOM = []
+    i = 1
+    with open(INFILE) as input_data:
+        for line in input_data:
+            if line.strip() == START:
+                break
+        # Reads text until the end of the block:
+        for line in input_data:  ## This keeps reading the file
+            if (i > 5):          ## Skip 5 lines before recording
                 if line.strip() == END:
                     break
-                ATOMLABEL.append(line[0:18])
-                RESNAME.append(line[50:65])
-                ATOMTYPES.append(line.split()[5])
-                CHARGES.append(line.split()[8])
-
-        ## combine them
-        for a, b, c, d, e in zip(ATOMLABEL,COORD,ATOMTYPES,RESNAME,CHARGES):
-            LINE.append(a + ' ' + b + ' ' + c + ' ' + d + ' ' + e)
-        return LINE
-
-    def psi2xyz(INFILE,OUTFILE):
-        START = 'Final optimized geometry and variables:'
-        END = 'Cleaning optimization helper files.'
-        GEOM = []
-        i = 1
-        with open(INFILE) as input_data:
-            for line in input_data:
-                if line.strip() == START:
-                    break
-            # Reads text until the end of the block:
-            for line in input_data:  ## This keeps reading the file
-                if (i > 5):          ## Skip 5 lines before recording
-                    if line.strip() == END:
-                        break
-                    GEOM.append(line)
-                i += 1
-
-        if GEOM[len(GEOM)-1] == '\n':
-            GEOM = GEOM[0:len(GEOM)-1]
-        number_of_atoms = len(GEOM)
-
-        filename = os.path.basename(INFILE)
-
-
-        f=open(OUTFILE,'w')
-        f.write(str(number_of_atoms) + '\n')
-        f.write(filename + '\n')
-        for coord in GEOM:
-            if coord.endswith('\n'):
-                f.write(coord)
-            else:
-                f.write(coord + '\n')
-        f.close()
+                GEOM.append(line)
+            i += 1
 
-    def write_template(out_dir, x):
-        tp = TopFileTemplate(TPDUMMY, "ExTrM.Amber.hydrocarbons.dat")
-        tp.write_to(out_dir, x)
+    if GEOM[len(GEOM)-1] == '\n':
+        GEOM = GEOM[0:len(GEOM)-1]
+    number_of_atoms = len(GEOM)
 
-    ###########################################################
+    filename = os.path.basename(INFILE)
+
+
+    f=open(OUTFILE,'w')
+    f.write(str(number_of_atoms) + '\n')
+    f.write(filename + '\n')
+    for coord in GEOM:
+        if coord.endswith('\n'):
+            f.write(coord)
+        else:
+            f.write(coord + '\n')
+    f.close()
 
-    # Convert gromacs units to amber units
+
+def amber_lj_parameters(x):
+    """
+    Convert the gromacs parameters x = [sigma_C, sigma_H, epsilon_C, epsilon_H]
+    (nm, kJ/mol) to amber units [rmin/2_C, rmin/2_H, epsilon_C, epsilon_H]
+    (Angstrom, kcal/mol), in the order of the template placeholders.
+    """
     SIGMA_1 = (x[0]*10*2**(1.0/6.0))/2.0
     SIGMA_2 = (x[1]*10*2**(1.0/6.0))/2.0
     EPSILON_1 = x[2]/4.184
     EPSILON_2 = x[3]/4.184
+    return [SIGMA_1, SIGMA_2, EPSILON_1, EPSILON_2]
+
+
+def template_lj_parameters(TPDUMMY, params):
+    """
+    Map the placeholders in the NONBON section of the force-field template
+    to atom types, e.g. "CX <X_1> <X_3>" -> {"CX": (params[0], params[2])}.
+    """
+    LJ_PARAMS = {}
+    in_nonbon = False
+    with open(TPDUMMY) as f:
+        for line in f:
+            if line.strip() == 'NONBON':
+                in_nonbon = True
+                continue
+            if in_nonbon and line.strip() == 'END':
+                break
+            words = line.split()
+            if in_nonbon and len(words) >= 3:
+                radius = re.match(r'<X_(\d+)>', words[1])
+                depth = re.match(r'<X_(\d+)>', words[2])
+                if radius and depth:
+                    LJ_PARAMS[words[0]] = (params[int(radius.group(1))-1],
+                                           params[int(depth.group(1))-1])
+    return LJ_PARAMS
+
+
+def write_min_in(FILENAME):
+    with open(FILENAME, 'w') as f:
+        f.write('Constraint Minimization\n')
+        f.write('&cntrl\n')
+        f.write('imin=1, dielc=1,ntb=0,\n')
+        f.write('maxcyc=20000, cut=40.0,\n')
+        f.write('ntc=1, ntf=1,\n')
+        f.write('drms=0.01,nmropt=0\n')
+        f.write('&end\n')
 
-    print("params:", SIGMA_1, SIGMA_2, EPSILON_1, EPSILON_2)
 
-    ## Check if required directories exist
-    if not os.path.exists(BINDIR):
-        os.makedirs(BINDIR)
-    if not os.path.exists(BINDIR + '/06_mm_opt/'):
-        os.makedirs(BINDIR + '/06_mm_opt/')
+def _file_hash(FILES):
+    h = hashlib.sha256()
+    for FILE in FILES:
+        with open(FILE, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
 
-    BINDIR_QM_MM = os.path.join(os.path.dirname(OUTPATH),'BINDIR')
-    if not os.path.exists(BINDIR_QM_MM):
-        os.makedirs(BINDIR_QM_MM)
-    if not os.path.exists(os.path.join(BINDIR_QM_MM, '06_mm_opt/')):
-        os.makedirs(os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
 
-    os.environ['BINDIR_QM_MM'] = BINDIR_QM_MM
+def prepare_conformers(BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, params):
+    """
+    Build the mol2 files, leap input, topologies and coordinates of all
+    conformers in BINDIR/00_qm_opt once. The prepared set is stored in
+    BINDIR/06_mm_opt/prepared-<hash of the input files> and reused by all
+    evaluations; only the LJ parameters of the topologies differ between
+    evaluations, see AmberPrmtop.set_lj_parameters.
 
+    Returns the directory of the prepared set and the conformer names.
+    """
     DOES_DIR_EXIST(BINDIR + '/00_qm_opt/')
-    ###########################################################
-    ## Variables
     DOES_FILE_EXIST(MOL2_FILE)
     DOES_FILE_EXIST(LEAPRC_FILE)
     DOES_FILE_EXIST(W2P_FILE)
 
-    shutil.copy2(MOL2_FILE, os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-    shutil.copy2(LEAPRC_FILE, os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-    shutil.copy2(W2P_FILE, os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-
-    MOL2_TEMPLATE = os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'),os.path.basename(MOL2_FILE))
-    FF_SOURCE_1 = os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'),os.path.basename(LEAPRC_FILE))
-    FF_SOURCE_2 = os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'),os.path.basename(W2P_FILE))
-
-    shutil.copy2(os.path.join(os.path.join(BINDIR, '06_mm_opt/'),'frcmod.extrm.w2p'),os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'),'frcmod.extrm.w2p'))
-
-    HEAD = []
-    TAIL = []
-    AMBER_ENERGIES = []
-
-    ###########################################################
-    ## Initialize variables and parse command line
-
-    ## Call helper script
-    SUBDIR_PATH=OUTPATH + "/subdir"
-
-    os.environ["working_dir"] = OUTPATH
-
-    if not os.path.exists(SUBDIR_PATH):
-        os.makedirs(SUBDIR_PATH)
-
-    if not os.path.exists(os.path.join(BINDIR_QM_MM, '06_mm_opt/')):
-        os.makedirs(os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-
-    write_template(BINDIR_QM_MM + "/06_mm_opt/", [SIGMA_1,SIGMA_2,EPSILON_1,EPSILON_2])
-
     QMLOG = glob.glob(BINDIR + '/00_qm_opt/molecule-*-psi.inp.log')    ## original was looking for -psi.inp.log
-    QMLOG=sorted(QMLOG)
+    QMLOG = sorted(QMLOG)
+    FRCMOD = os.path.join(os.path.join(BINDIR, '06_mm_opt/'), 'frcmod.extrm.w2p')
+
+    PREPDIR = os.path.abspath(os.path.join(BINDIR, '06_mm_opt', 'prepared-' + _file_hash(
+        QMLOG + [TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, FRCMOD])))
+    DONE = os.path.join(PREPDIR, 'prepared.txt')
+    if not os.path.exists(PREPDIR):
+        os.makedirs(PREPDIR, exist_ok=True)
+
+    # only one evaluation (thread or process) prepares the conformers
+    with open(PREPDIR + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.isfile(DONE):
+                _prepare_conformers(PREPDIR, QMLOG, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE,
+                                    FRCMOD, params)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    with open(DONE) as f:
+        CONFORMERS = [line.strip() for line in f if line.strip()]
+    return PREPDIR, CONFORMERS
+
+
+def _prepare_conformers(PREPDIR, QMLOG, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, FRCMOD, params):
+    print("PREPARING CONFORMERS IN", PREPDIR)
+    shutil.copy2(MOL2_FILE, PREPDIR)
+    shutil.copy2(LEAPRC_FILE, PREPDIR)
+    shutil.copy2(W2P_FILE, PREPDIR)
+    shutil.copy2(FRCMOD, PREPDIR)
+    TopFileTemplate(TPDUMMY, "ExTrM.Amber.hydrocarbons.dat").write_to(PREPDIR, params)
+
+    MOL2_TEMPLATE = os.path.join(PREPDIR, os.path.basename(MOL2_FILE))
+    FF_SOURCE_1 = os.path.join(PREPDIR, os.path.basename(LEAPRC_FILE))
+    FF_SOURCE_2 = os.path.join(PREPDIR, os.path.basename(W2P_FILE))
+
+    ## Amber files needed for referencing the force force.
+    ## Replace location of w2p force-field supplementary parameters.
+    for filee in [FF_SOURCE_1, FF_SOURCE_2]:
+        with open(filee, 'r') as f:
+            dataa = f.read()
+            dataa = dataa.replace('SOURCEDIR', PREPDIR)
+        with open(filee, 'w') as f:
+            f.write(dataa)
 
     ###########################################################
     ## Gather the AMBER proper head and end of mol2 file
-    with open(BINDIR_QM_MM + '/06_mm_opt/molec.extrm.bcc.mol2') as file:
+    HEAD = []
+    TAIL = []
+    with open(MOL2_TEMPLATE) as file:
         HEAD = [next(file) for x in range(6)]
         for line in file:
             if '@<TRIPOS>BOND' in line:
@@ -266,60 +290,22 @@ def mstart(x, OUTPATH, BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, target
     HEAD = [s.rstrip() for s in HEAD]
     TAIL = [s.rstrip() for s in TAIL]
 
-    ## Amber files needed for referencing the force force.
-    ## Replace location of w2p force-field supplementary parameters.
-    shutil.copy2(W2P_FILE,os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-    shutil.copy2(LEAPRC_FILE,os.path.join(BINDIR_QM_MM, '06_mm_opt/'))
-    print("replace in grow_sander")
-    #for line in fileinput.FileInput([os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'), os.path.basename(W2P_FILE))], inplace=True):
-        #print(line.replace('SOURCEDIR', BINDIR_QM_MM + '/06_mm_opt'), end='')
-    filee = os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'), os.path.basename(W2P_FILE))
-    with open(filee, 'r') as f:
-        dataa = f.read()
-        dataa = dataa.replace('SOURCEDIR', BINDIR_QM_MM + '/06_mm_opt')
-    with open(filee, 'w') as f:
-        f.write(dataa)
-    #for line in fileinput.FileInput([os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'), os.path.basename(LEAPRC_FILE))], inplace=True):
-        #print(line.replace('SOURCEDIR', BINDIR_QM_MM + '/06_mm_opt'), end='')
-    filee = os.path.join(os.path.join(BINDIR_QM_MM, '06_mm_opt/'), os.path.basename(LEAPRC_FILE))
-    with open(filee, 'r') as f:
-        dataa = f.read()
-        dataa = dataa.replace('SOURCEDIR', BINDIR_QM_MM + '/06_mm_opt')
-    with open(filee, 'w') as f:
-        f.write(dataa)
     ###########################################################
     ## 1. Create a mol2 file from the QM log files such that AMBER's tleap can read it.
     ## 2. Create leap input and run tleap
-    ## 3. Execute Sander minimization
-    ## 4. Convert optimized geometry rst file to pdb for easy viewing
-    ## 5. Grab raw energy out of the output file.
-
-    print("STARTING MINIM")
-    with open(BINDIR_QM_MM + '/06_mm_opt/min.in', 'w') as f:
-        f.write('Constraint Minimization\n')
-        f.write('&cntrl\n')
-        f.write('imin=1, dielc=1,ntb=0,\n')
-        f.write('maxcyc=20000, cut=40.0,\n')
-        f.write('ntc=1, ntf=1,\n')
-        f.write('drms=0.01,nmropt=0\n')
-        f.write('&end\n')
-
-
+    CONFORMERS = []
+    FNULL = open(os.devnull, 'w')
     for LOG in QMLOG:
         LOGNAME = LOG.split('/')
-        BASENAME = (LOGNAME[-1]).split('.')
+        BASENAME = (LOGNAME[-1]).split('.')[0]
         ## For use with GAMESS QM log files
-        psi2xyz(LOG, os.path.join(OUTPATH, BASENAME[0] + '.xyz'))
-
-        ## Create a mol2 file from a GAMESS log file
-        FNULL = open(os.devnull, 'w')
+        psi2xyz(LOG, os.path.join(PREPDIR, BASENAME + '.xyz'))
 
         ## Collect unique coordinates for each structure
-        MOL2_COORDS = []
-        MOL2_COORDS = create_mm_mol2_coords(MOL2_TEMPLATE, os.path.join(OUTPATH, BASENAME[0] + '.xyz'))
+        MOL2_COORDS = create_mm_mol2_coords(MOL2_TEMPLATE, os.path.join(PREPDIR, BASENAME + '.xyz'))
 
         ## Put it all together into a single file
-        with open(os.path.join(OUTPATH,BASENAME[0] + '.mol2'),'w') as f:
+        with open(os.path.join(PREPDIR, BASENAME + '.mol2'), 'w') as f:
             for item in HEAD:
                 f.write("%s\n" % item)
             for item in MOL2_COORDS:
@@ -327,38 +313,130 @@ def mstart(x, OUTPATH, BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, target
             f.write("@<TRIPOS>BOND\n")
             for item in TAIL:
                 f.write("%s\n" % item)
-        shutil.copy2(os.path.join(OUTPATH,BASENAME[0] + '.mol2'),BINDIR_QM_MM + '/06_mm_opt')
 
         ## Create each leap.in
-        with open(join(OUTPATH, BASENAME[0]+'.leap.in'), 'w') as f:
-            f.write('logfile ' + join(OUTPATH, BASENAME[0]) + '.leap.log\n')
+        with open(join(PREPDIR, BASENAME+'.leap.in'), 'w') as f:
+            f.write('logfile ' + join(PREPDIR, BASENAME) + '.leap.log\n')
             f.write('source ' + FF_SOURCE_1 +'\n')
             f.write('source ' + FF_SOURCE_2 +'\n')
             f.write('verbosity 2\n')
-            f.write('a = loadmol2 ' + os.path.join(BINDIR_QM_MM, '06_mm_opt/') + BASENAME[0] + '.mol2\n')
-            f.write('saveamberparm a ' + join(OUTPATH, BASENAME[0]) + '.leap.top ' + join(OUTPATH, BASENAME[0]) + '.leap.crd\n')
-            f.write('savepdb a ' + os.path.join(BINDIR_QM_MM, '06_mm_opt/') + BASENAME[0] + '.leap.pdb\n')
+            f.write('a = loadmol2 ' + join(PREPDIR, BASENAME) + '.mol2\n')
+            f.write('saveamberparm a ' + join(PREPDIR, BASENAME) + '.leap.top ' + join(PREPDIR, BASENAME) + '.leap.crd\n')
+            f.write('savepdb a ' + join(PREPDIR, BASENAME) + '.leap.pdb\n')
             f.write('quit\n')
 
         ## Run tleap to get filename.top and filename.crd --> used as input for MM minimization or MD
-        TLEAP = ['tleap', '-s -f', join(OUTPATH, BASENAME[0]) + '.leap.in']
+        TLEAP = ['tleap', '-s', '-f', join(PREPDIR, BASENAME) + '.leap.in']
         subprocess.call(TLEAP, stdout=FNULL, stderr=subprocess.STDOUT)
-        DOES_FILE_EXIST(join(OUTPATH, BASENAME[0])+'.leap.top')
-        
+        DOES_FILE_EXIST(join(PREPDIR, BASENAME)+'.leap.top')
         print("TLEAP DONE")
-        ## Run minimizations
-        SANDER = ['sander', '-O', '-i', os.path.join(BINDIR_QM_MM, '06_mm_opt/') + 'min.in', '-o', join(OUTPATH, BASENAME[0]) + '.min.out', '-p', join(OUTPATH, BASENAME[0]) + '.leap.top', '-c', join(OUTPATH, BASENAME[0]) + '.leap.crd', '-r', join(OUTPATH, BASENAME[0]) + '.min.rst', '-ref', join(OUTPATH, BASENAME[0]) + '.leap.crd']
-        subprocess.call(SANDER, stdout=FNULL, stderr=subprocess.STDOUT)
-        print("SANDER DONE")
-        DOES_FILE_EXIST(join(OUTPATH, BASENAME[0])+'.min.out')
-
-        ## create pdb from MM minimization restart file (i.e. final optimized structure).
-        AMBPDB = ['ambpdb', '-p', join(OUTPATH, BASENAME[0])+'.leap.top', '-c', join(OUTPATH, BASENAME[0])+'.min.rst']
-        subprocess.call(AMBPDB, stdout=open(join(OUTPATH, BASENAME[0])+'.min.rst.pdb', 'w'), stderr=FNULL)
-        print("AMBPDB DONE")
-        ## Obtain raw energy
-        GET_AMBER_ENERGY(join(OUTPATH, BASENAME[0])+'.min.out', BASENAME[0])
-        print("GET ENERGY DONE")
+        CONFORMERS.append(BASENAME)
+
+    with open(os.path.join(PREPDIR, 'prepared.txt'), 'w') as f:
+        for BASENAME in CONFORMERS:
+            f.write('%s\n' % BASENAME)
+
+
+## Collects final energies of MM minimizations
+def GET_AMBER_ENERGY(LOG,moleculeName):
+    START = 'FINAL RESULTS'
+    END = 'BOND'
+    LINES= []
+    print("file:::", LOG)
+    with open(LOG) as input_data:
+        for line in input_data:
+            if line.strip() == START:
+                break
+        # Reads text until the end of the block:
+        for line in input_data:
+            if line.strip() == END:
+                break
+            LINES.append(line.split())
+    LINES = [x for x in LINES if x]  ## remove empty lists
+    return moleculeName + " " + LINES[1][1]
+
+
+def minimize_conformer(BASENAME, PREPDIR, OUTPATH, LJ_PARAMS):
+    """
+    Minimize a prepared conformer with the LJ parameters LJ_PARAMS in the
+    scratch directory OUTPATH/BASENAME. Returns the line
+    "<BASENAME> <energy>".
+    """
+    SCRATCH = join(OUTPATH, BASENAME)
+    if not os.path.exists(SCRATCH):
+        os.makedirs(SCRATCH)
+    TOP = join(SCRATCH, BASENAME) + '.leap.top'
+    CRD = join(PREPDIR, BASENAME) + '.leap.crd'
+    prmtop = AmberPrmtop(join(PREPDIR, BASENAME) + '.leap.top')
+    prmtop.set_lj_parameters(LJ_PARAMS)
+    prmtop.write(TOP)
+
+    FNULL = open(os.devnull, 'w')
+    ## Run minimizations (sander writes mdinfo into the current directory)
+    SANDER = ['sander', '-O', '-i', join(OUTPATH, 'min.in'), '-o', join(SCRATCH, BASENAME) + '.min.out', '-p', TOP, '-c', CRD, '-r', join(SCRATCH, BASENAME) + '.min.rst', '-ref', CRD]
+    subprocess.call(SANDER, stdout=FNULL, stderr=subprocess.STDOUT, cwd=SCRATCH)
+    print("SANDER DONE")
+    DOES_FILE_EXIST(join(SCRATCH, BASENAME)+'.min.out')
+
+    ## create pdb from MM minimization restart file (i.e. final optimized structure).
+    AMBPDB = ['ambpdb', '-p', TOP, '-c', join(SCRATCH, BASENAME)+'.min.rst']
+    with open(join(SCRATCH, BASENAME)+'.min.rst.pdb', 'w') as pdb:
+        subprocess.call(AMBPDB, stdout=pdb, stderr=FNULL, cwd=SCRATCH)
+    print("AMBPDB DONE")
+    FNULL.close()
+    ## Obtain raw energy
+    return GET_AMBER_ENERGY(join(SCRATCH, BASENAME)+'.min.out', BASENAME)
+
+
+def mstart(x, OUTPATH, BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, target_names, n_workers=1):
+
+    ###########################################################
+    def relative_energy(completeList = [], *args):
+        RELATIVE_E = []
+        energylist = []
+        for line in completeList:
+            energylist.append(line.split(' ')[1])
+        EMIN = energylist[0]
+        print('First entry in completeList:',completeList[0])
+        print('EMIN = ',EMIN)
+        for E in range(0,len(energylist)):
+            RELATIVE_E.append(completeList[E].split(' ')[0] + ' ' + str(float(energylist[E])-float(EMIN)))
+        return RELATIVE_E
+
+    def write_template(out_dir, x):
+        tp = TopFileTemplate(TPDUMMY, "ExTrM.Amber.hydrocarbons.dat")
+        tp.write_to(out_dir, x)
+
+    ###########################################################
+
+    PARAMS = amber_lj_parameters(x)
+    print("params:", *PARAMS)
+
+    if not os.path.exists(OUTPATH + "/subdir"):
+        os.makedirs(OUTPATH + "/subdir")
+    os.environ["working_dir"] = OUTPATH
+    write_template(OUTPATH, PARAMS)
+
+    ## The conformers (mol2 files, leap input, tleap topologies and coordinates)
+    ## are prepared once and shared by all evaluations
+    PREPDIR, CONFORMERS = prepare_conformers(BINDIR, TPDUMMY, MOL2_FILE, LEAPRC_FILE, W2P_FILE, PARAMS)
+    LJ_PARAMS = template_lj_parameters(TPDUMMY, PARAMS)
+
+    ###########################################################
+    ## 1. Write the topology of each prepared conformer with the new LJ parameters
+    ## 2. Execute Sander minimization
+    ## 3. Convert optimized geometry rst file to pdb for easy viewing
+    ## 4. Grab raw energy out of the output file.
+
+    print("STARTING MINIM")
+    write_min_in(join(OUTPATH, 'min.in'))
+
+    ## Each conformer is minimized in its own scratch directory,
+    ## n_workers minimizations run at the same time
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        AMBER_ENERGIES = list(pool.map(
+            lambda BASENAME: minimize_conformer(BASENAME, PREPDIR, OUTPATH, LJ_PARAMS),
+            CONFORMERS))
     ###########################################################
     ## write out raw energy data
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Append-only journal of objective function evaluations"""
+
+import json
+import os
+import threading
+import time
+
+
+class EvaluationJournal:
+    """
+    A crash-safe record of an optimization run.
+
+    Every submission, completion and failure of an evaluation is appended as
+    one JSON line and flushed to disk (fsync) before the call returns, so
+    that a crash can at most lose the line that was being written. The state
+    of the run (see replay) is rebuilt by replaying the events in order.
+    """
+
+    SUBMITTED = "submitted"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def __init__(self, path):
+        """
+        Arguments:
+        path: (string) the journal file, created on the first event
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._checked_end = False
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def submitted(self, feval_number, x):
+        self._append(self.SUBMITTED, feval_number, x=[float(xi) for xi in x])
+
+    def completed(self, feval_number, obs):
+        self._append(self.COMPLETED, feval_number, obs=float(obs))
+
+    def failed(self, feval_number):
+        self._append(self.FAILED, feval_number)
+
+    def replay(self):
+        """
+        Rebuilds the state of the run from the journal.
+
+        Returns:
+        A list of (feval_number, x, obs, status) sorted by feval_number,
+        where status is the last event of the evaluation and obs is -1
+        unless the evaluation has completed.
+        """
+        state = {}
+        if not self.exists():
+            return []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # the last line of a journal that was being written
+                    # during a crash
+                    continue
+                i = event["id"]
+                if event["event"] == self.SUBMITTED:
+                    state[i] = [event["x"], -1, self.SUBMITTED]
+                elif i in state:
+                    state[i][2] = event["event"]
+                    state[i][1] = event.get("obs", -1)
+        return [(i, x, obs, status)
+                for i, (x, obs, status) in sorted(state.items())]
+
+    def _append(self, event, feval_number, **fields):
+        fields.update(event=event, id=int(feval_number), time=time.time())
+        line = json.dumps(fields, sort_keys=True) + "\n"
+        with self._lock:
+            if not self._checked_end:
+                line = self._line_break_after_crash() + line
+                self._checked_end = True
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _line_break_after_crash(self):
+        """
+        Returns a line break if the journal ends with a partly written line,
+        so that new events do not continue it.
+        """
+        if not self.exists() or os.path.getsize(self.path) == 0:
+            return ""
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return "" if f.read(1) == b"\n" else "\n"
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""Closed-form Lennard-Jones energies of a fixed set of conformers"""
+
+from os.path import join
+
+import numpy as np
+
+from coffe.amb.prmtop import AmberPrmtop, lj_parameters_by_index, read_amber_coordinates
+
+
+class LJDecomposition:
+    """
+    The energies of a set of conformers at fixed geometries as a function of
+    the Lennard-Jones parameters.
+
+    At fixed geometries, the Lennard-Jones energy of each conformer is
+    sum_p A_p S12_p - B_p S6_p over all pairs p of atom types, where
+    S12_p and S6_p are the (1-4 scaled) sums of r^-12 and r^-6 over all
+    interacting atom pairs of that type pair. These sums are computed once,
+    so that the energies for any number of parameter sets are one matrix
+    product. All other energy terms do not depend on the Lennard-Jones
+    parameters; they are recovered from reference energies computed with
+    the parameters in the topology.
+    """
+
+    def __init__(self, prmtop, coordinates, energies=None, names=None,
+                 atoms=None):
+        """
+        Arguments:
+        prmtop: (AmberPrmtop) the topology shared by all conformers, with the
+            Lennard-Jones parameters of the reference energies
+        coordinates: (list of arrays) the geometry of each conformer in
+            Angstrom, shape (n_atoms, 3)
+        energies: (list) the total energy of each conformer in kcal/mol,
+            computed with the topology at the given geometry; None to include
+            only the Lennard-Jones energies
+        names: (list) names of the conformers
+        atoms: (list) restrict the energies to these atoms (0-based indices)
+        """
+        self.names = names
+        i, j, scale = prmtop.nonbonded_pairs(atoms)
+        types = np.array(prmtop.get("ATOM_TYPE_INDEX")) - 1
+        ti = np.minimum(types[i], types[j])
+        tj = np.maximum(types[i], types[j])
+        keys, pair_of_atoms = np.unique(ti * prmtop.n_types + tj,
+                                        return_inverse=True)
+        self.type_pairs = np.stack([keys // prmtop.n_types,
+                                    keys % prmtop.n_types], axis=1)
+
+        self.S12 = np.zeros((len(coordinates), len(keys)))
+        self.S6 = np.zeros((len(coordinates), len(keys)))
+        for k, xyz in enumerate(coordinates):
+            xyz = np.asarray(xyz, dtype=float)
+            inv_r6 = 1.0 / ((xyz[i] - xyz[j])**2).sum(axis=1)**3
+            self.S6[k] = np.bincount(pair_of_atoms, weights=scale * inv_r6,
+                                     minlength=len(keys))
+            self.S12[k] = np.bincount(pair_of_atoms,
+                                      weights=scale * inv_r6 * inv_r6,
+                                      minlength=len(keys))
+
+        # Lennard-Jones parameters of the topology, per type index
+        self.type_names = prmtop.lj_type_names()
+        reference = prmtop.lj_type_parameters()
+        self.reference = [reference[names[0]] if names else (0.0, 0.0)
+                          for names in self.type_names]
+
+        index = prmtop._pair_index()
+        acoef = np.array(prmtop.get("LENNARD_JONES_ACOEF"))
+        bcoef = np.array(prmtop.get("LENNARD_JONES_BCOEF"))
+        self.A_ref = acoef[index[self.type_pairs[:, 0], self.type_pairs[:, 1]]]
+        self.B_ref = bcoef[index[self.type_pairs[:, 0], self.type_pairs[:, 1]]]
+
+        lj_ref = self.S12 @ self.A_ref - self.S6 @ self.B_ref
+        if energies is None:
+            self.offsets = np.zeros(len(coordinates))
+        else:
+            self.offsets = np.asarray(energies, dtype=float) - lj_ref
+
+    @classmethod
+    def from_minimizations(cls, outpath):
+        """
+        Decomposition at the minimized geometries of a finished evaluation
+        of the mm loss, see grow_sander_ff_opt.mstart.
+
+        Arguments:
+        outpath: (string) the output directory of the evaluation (with
+            Energy.raw.extrm.txt and a subdirectory for each conformer)
+        """
+        with open(join(outpath, 'Energy.raw.extrm.txt')) as f:
+            rows = [line.split() for line in f if line.strip()]
+        names = [row[0] for row in rows]
+        energies = [float(row[1]) for row in rows]
+        prmtop = AmberPrmtop(join(outpath, names[0], names[0] + '.leap.top'))
+        coordinates = [read_amber_coordinates(join(outpath, name, name + '.min.rst'))
+                       for name in names]
+        return cls(prmtop, coordinates, energies, names)
+
+    @classmethod
+    def from_prepared(cls, prepdir, energies=None):
+        """
+        Decomposition at the QM geometries of a set of prepared conformers,
+        see grow_sander_ff_opt.prepare_conformers.
+
+        Arguments:
+        prepdir: (string) the directory of the prepared conformers
+        energies: (list) single point energies of the conformers with the
+            parameters of the prepared topologies; None to include only the
+            Lennard-Jones energies
+        """
+        with open(join(prepdir, 'prepared.txt')) as f:
+            names = [line.strip() for line in f if line.strip()]
+        prmtop = AmberPrmtop(join(prepdir, names[0] + '.leap.top'))
+        coordinates = [read_amber_coordinates(join(prepdir, name + '.leap.crd'))
+                       for name in names]
+        return cls(prmtop, coordinates, energies, names)
+
+    def coefficients(self, params):
+        """
+        The Lennard-Jones coefficients A and B of all type pairs.
+
+        Arguments:
+        params: (dict) Amber atom type names and pairs (rmin/2 in Angstrom,
+            epsilon in kcal/mol); both can be arrays of m parameter sets.
+            Types that are not in params keep the parameters of the topology.
+            Types that share a type index have to be changed together
+            (see coffe.amb.prmtop.lj_parameters_by_index).
+
+        Returns:
+        A, B: (arrays) shape (m, number of type pairs)
+        """
+        m = max([np.size(p) for pair in params.values() for p in pair] + [1])
+        changed = lj_parameters_by_index(self.type_names, params)
+        A = np.tile(self.A_ref, (m, 1))
+        B = np.tile(self.B_ref, (m, 1))
+        for k, (ti, tj) in enumerate(self.type_pairs):
+            if ti not in changed and tj not in changed:
+                # keep the coefficients of the topology
+                continue
+            ri, ei = changed.get(ti, self.reference[ti])
+            rj, ej = changed.get(tj, self.reference[tj])
+            rmin = np.asarray(ri) + np.asarray(rj)
+            eps = np.sqrt(np.asarray(ei) * np.asarray(ej))
+            A[:, k] = eps * rmin**12
+            B[:, k] = 2 * eps * rmin**6
+        return A, B
+
+    def energies(self, params):
+        """
+        Total energies of all conformers.
+
+        Arguments:
+        params: (dict) see coefficients
+
+        Returns:
+        (array) shape (m, number of conformers), in kcal/mol
+        """
+        A, B = self.coefficients(params)
+        return A @ self.S12.T - B @ self.S6.T + self.offsets
+
+    def relative_energies(self, params):
+        """
+        Energies relative to the first conformer, shape (m, number of
+        conformers).
+        """
+        E = self.energies(params)
+        return E - E[:, :1]
+
+    def __len__(self):
+        return len(self.offsets)
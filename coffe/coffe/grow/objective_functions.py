@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from coffe.core.decorators import args_from_configfile
-from coffe.grow.simulation_wrapper import GromacsSimulation
+from coffe.core.decorators import args_from_configfile, ConfigError
+from coffe.grow.evaluation_cache import EvaluationCache
+from coffe.grow.observable_store import ObservableStore
+from coffe.grow.grow_sander_ff_opt import amber_lj_parameters, template_lj_parameters
+from coffe.grow.lj_decomposition import LJDecomposition
+from coffe.grow.simulation_wrapper import GromacsSimulation, SimulationBundler
+from coffe.grow.state_library import EquilibratedStateLibrary
 from coffe.grow.conf import SanderWrapper
+from coffe.gmx import edr
 
+import json
 import numpy as np
 import os
 import pandas as pd
 import re
 import threading
+import time
 
 """Objective Function hierarchy"""
 
@@ -28,23 +36,29 @@ class ObjectiveFunction:
             pass
             
 def gmx_callback(ret_list, x, dir_name, top_template, gro_file, mdp_files, mdp_dir,
-                 batch_system, batch_template, on_cluster):
+                 batch_system, batch_template, on_cluster, acceptable=None,
+                 pilot=None, bundler=None, library=None, adaptive=None):
     """
     Wrapper function for Gromacs simulation
     """
     sim = GromacsSimulation(dir_name, mdp_files, 
                             top_template, gro_file, mdp_dir, batch_system,
-                            batch_template, oncluster=on_cluster)
+                            batch_template, oncluster=on_cluster,
+                            acceptable=acceptable, pilot=pilot,
+                            bundler=bundler, library=library,
+                            adaptive=adaptive)
     sim.simulate(x)
     ret_list.append(sim.get_results("Density"))
     
 def mm_callback(ret_list, x, outdir, bin_dir, extrm_template, 
-                batchtemplate, on_cluster, mol2_file, leaprc_file, w2p_file, target_names):
+                batchtemplate, on_cluster, mol2_file, leaprc_file, w2p_file, target_names,
+                n_workers=1, pilot=None):
     """
     Wrapper function for the energy minimizations
     """
     sw = SanderWrapper(outdir, bin_dir, extrm_template, mol2_file, leaprc_file, w2p_file, 
-                       target_names, batch_template=batchtemplate, oncluster=on_cluster)
+                       target_names, batch_template=batchtemplate, oncluster=on_cluster,
+                       n_workers=n_workers, pilot=pilot)
     sw.simulate(x)
     res = sw.get_results()
     for e in res:
@@ -57,10 +71,26 @@ class MultiscaleLossFunction(ObjectiveFunction):
     
     Directory <out_path> is created and function evaluations will create 
     subdirectories in it.
+
+    If early_stopping is set in the MD section, production runs are stopped
+    as soon as their density is certain to give a loss worse than the
+    incumbent (the best loss so far, set by the optimization algorithm).
     """
+    target_density = 700
+
     def __init__(self, out_path, opt_with_md=True, opt_with_mm=True):
         self.out_path = out_path        
         self.targets = []
+        self.early_stopping = False
+        self.incumbent = None
+        self.eval_cache = None
+        self.pilot = None
+        self.bundler = None
+        self.state_library = None
+        self.warm_start_radius = None
+        self.warm_start_stage = None
+        self.adaptive = None
+        self.observables = None
 
         self.opt_with_md = opt_with_md
         self.opt_with_mm = opt_with_mm
@@ -79,21 +109,29 @@ class MultiscaleLossFunction(ObjectiveFunction):
         Returns:
         returns nothing
         """
+        started = time.time()
         # create directory <feval_number> in <out_path>
         evaluation_dir = os.path.join(self.out_path, str(feval_number))
         self._make_objfun_dir(evaluation_dir)
 
 
         if self.opt_with_md:
+            pproperties = self._cached("md", xi)
+            md_computed = pproperties is None
+        if self.opt_with_md and md_computed:
             pproperties = []
             dirname = os.path.join(evaluation_dir, "PP")
+            window = self.density_window()
 
             kw = dict(x=xi, top_template=self.top_template, dir_name=dirname,
                       ret_list=pproperties, gro_file=self.gro_file,
                       mdp_files=self.mdp_files, mdp_dir=self.mdp_dir,
                       batch_system=self.batch_system,
                       batch_template=self.batch_template, 
-                      on_cluster=self.on_cluster)        
+                      on_cluster=self.on_cluster,
+                      acceptable=window, pilot=self.pilot,
+                      bundler=self.bundler, library=self.state_library,
+                      adaptive=self.adaptive)
 
             # Start MD first since it will take longer
             md_thread = threading.Thread(target=gmx_callback,
@@ -101,6 +139,9 @@ class MultiscaleLossFunction(ObjectiveFunction):
             md_thread.start()
         
         if self.opt_with_mm:
+            mmproperties = self._cached("mm", xi)
+            mm_computed = mmproperties is None
+        if self.opt_with_mm and mm_computed:
             mmdir = os.path.join(evaluation_dir, "QMMM")
             mmproperties = []
 
@@ -111,6 +152,8 @@ class MultiscaleLossFunction(ObjectiveFunction):
                         w2p_file=self.w2p_file,
                         target_names=self.target_names,
                         on_cluster=self.on_cluster,
+                        n_workers=self.n_workers,
+                        pilot=self.pilot,
                         ret_list=mmproperties)
 
             mm_thread = threading.Thread(target=mm_callback,
@@ -120,7 +163,10 @@ class MultiscaleLossFunction(ObjectiveFunction):
 
             # wait for the mm calculations to finish
             mm_thread.join()
+            mmproperties = [float(e) for e in mmproperties]
+            self._store("mm", xi, mmproperties)
 
+        if self.opt_with_mm:
             mmloss = self.calc_mmloss(mmproperties)
             mmloss_raw = mmloss
 
@@ -130,13 +176,20 @@ class MultiscaleLossFunction(ObjectiveFunction):
                 mmloss = np.tanh(mmloss)
         else:
             mmloss = 0.0
+            mmloss_raw = 0.0
 
-        if self.opt_with_md:
+        if self.opt_with_md and md_computed:
             # wait for md to finish
             md_thread.join()
+            pproperties = [float(np.ravel(p)[0]) for p in pproperties]
+            # runs that may have been stopped early are not stored
+            if pproperties and (window is None or
+                                window[0] <= pproperties[0] <= window[1]):
+                self._store("md", xi, pproperties)
 
-            pploss = 700-pproperties[0]
-            pploss = pploss / 700
+        if self.opt_with_md:
+            pploss = self.target_density-pproperties[0]
+            pploss = pploss / self.target_density
             pploss = pploss*pploss
         else:
             pploss = 0.0
@@ -151,9 +204,98 @@ class MultiscaleLossFunction(ObjectiveFunction):
         
         # put the results into res_queue
         print("i=", feval_number, ":",  res, pploss, mmloss_raw, xi)
+        self._record(feval_number, xi, res, evaluation_dir, started,
+                     pproperties if self.opt_with_md else None,
+                     mmproperties if self.opt_with_mm else None)
         res_queue.put((feval_number, xi, res))
         return
+
+    def _record(self, feval_number, xi, res, evaluation_dir, started,
+                pproperties, mmproperties):
+        """
+        Adds the observables of an evaluation to the observable store
+        (if it is switched on): the parameters, the loss, the wall time
+        (start, end), the density and its time series in the production
+        run, and the energies of all conformers.
+        """
+        if self.observables is None:
+            return
+        row = {"x": xi, "loss": res, "timing": [started, time.time()],
+               "density": pproperties, "mm_energies": mmproperties}
+        if pproperties is not None:
+            production = self.mdp_files[-1].split(".")[0]
+            try:
+                series = edr.read_edr(os.path.join(evaluation_dir, "PP",
+                                                   production, "ener.edr"),
+                                      ["Density"])
+                row["density_time"] = series[:, 0]
+                row["density_series"] = series[:, 1]
+            except (edr.EdrError, KeyError, IOError, OSError):
+                # e.g. cached results without simulation
+                pass
+        self.observables.append(feval_number, **row)
         
+    def _cache_key(self, kind, xi):
+        """
+        Key of the md or mm part of an evaluation in the evaluation cache
+        """
+        if kind == "md":
+            files = [os.path.join(self.mdp_dir, f) for f in self.mdp_files]
+            files.append(self.gro_file)
+            # the simulation modes change what the stored density means
+            # (mean of the full run or of the equilibrated region of a run
+            # of adaptive length), so results of different modes are not
+            # shared; early stopping only stores runs that were not stopped
+            modes = {"adaptive": self.adaptive,
+                     "early_stopping": bool(self.early_stopping),
+                     "warm_start": [self.warm_start_radius,
+                                    self.warm_start_stage]}
+            contents = [self.top_template.content,
+                        json.dumps(modes, sort_keys=True)]
+        else:
+            # only the inputs in bin_dir; the prepared conformers and lock
+            # files that the evaluations write there must not change the key
+            files = [os.path.join(self.bin_dir, "00_qm_opt")]
+            frcmod = os.path.join(self.bin_dir, "06_mm_opt", "frcmod.extrm.w2p")
+            if os.path.isfile(frcmod):
+                files.append(frcmod)
+            files += [self.extrm_template, self.mol2_file,
+                      self.leaprc_file, self.w2p_file, self.targets]
+            contents = [json.dumps(self.target_names)]
+        return self.eval_cache.make_key(xi, files, [kind] + contents)
+
+    def _cached(self, kind, xi):
+        """
+        Returns the cached results of the md or mm part, or None
+        """
+        if self.eval_cache is None:
+            return None
+        res = self.eval_cache.get(self._cache_key(kind, xi), kind)
+        if res is not None:
+            print("cache hit:", kind, xi)
+        return res
+
+    def _store(self, kind, xi, res):
+        if self.eval_cache is not None and len(res):
+            self.eval_cache.put(self._cache_key(kind, xi), kind, res)
+
+    def density_window(self):
+        """
+        Returns the densities (lower, upper) for which the evaluation can
+        still beat the incumbent, or None, if early stopping is off or
+        there is no incumbent yet.
+
+        The mm part of the loss is non-negative, so an evaluation can only
+        beat the incumbent if tanh(weight_md*pploss) < incumbent.
+        """
+        if not self.early_stopping or self.incumbent is None:
+            return None
+        if not 0 < self.incumbent < 1:
+            return None
+        max_pploss = np.arctanh(self.incumbent) / self.weight_md
+        delta = self.target_density * np.sqrt(max_pploss)
+        return (self.target_density - delta, self.target_density + delta)
+
     def calc_mmloss(self, mmproperties):
         res = np.array(mmproperties)
 
@@ -182,7 +324,26 @@ class MultiscaleLossFunction(ObjectiveFunction):
 
     @args_from_configfile
     def _init_pp(self, mdp_files, gro_file, top_file_template, 
-                 mdp_dir, targets, scale_md=1, weight_md=0.5, **kwargs):
+                 mdp_dir, targets, scale_md=1, weight_md=0.5,
+                 early_stopping=False, warm_start_radius=None,
+                 warm_start_stage=None, adaptive_target_error=None,
+                 adaptive_max_time=None, **kwargs):
+        """
+        Arguments:
+        warm_start_radius: (float) if given, MD chains start from the
+            equilibrated state of the nearest previous evaluation whose
+            parameters differ by at most this fraction (see
+            EquilibratedStateLibrary)
+        warm_start_stage: (string) the first stage (mdp file name without
+            extension) of a warm-started chain; by default the last stage
+            before production
+        adaptive_target_error: (float) if given, production runs are
+            stopped as soon as the standard error of their mean density
+            (equilibrated region, corrected for autocorrelation) is below
+            this value (see GmxCalculationAdaptive)
+        adaptive_max_time: (float) maximum length of adaptive production
+            runs in ps; by default the length in the mdp file
+        """
         self.mdp_files = mdp_files
         self.gro_file = gro_file
         self.top_template = TopFileTemplate(top_file_template, "topol.top")
@@ -190,10 +351,25 @@ class MultiscaleLossFunction(ObjectiveFunction):
         self.targets.append(targets)
         self.scale_md = scale_md
         self.weight_md = weight_md
+        self.early_stopping = early_stopping
+        self.warm_start_radius = warm_start_radius
+        self.warm_start_stage = warm_start_stage
+        if warm_start_radius is not None:
+            self.state_library = EquilibratedStateLibrary(
+                os.path.join(self.out_path, "equilibrated_states.jsonl"),
+                warm_start_radius, first_stage=warm_start_stage)
+        if adaptive_target_error is not None:
+            self.adaptive = {"target_error": adaptive_target_error,
+                             "max_time": adaptive_max_time}
     
     @args_from_configfile
     def _init_qm(self, bin_dir, extrm_template, mol2_file, leaprc_file, w2p_file,
-                 target_names, targets,scale_mm=1e-4, weight_mm=0.5):
+                 target_names, targets,scale_mm=1e-4, weight_mm=0.5, n_workers=1,
+                 **kwargs):
+        """
+        Arguments:
+        n_workers: (int) number of conformers that are minimized at the same time
+        """
         self.bin_dir = bin_dir
         self.extrm_template = extrm_template
         self.scale_mm = scale_mm
@@ -203,12 +379,66 @@ class MultiscaleLossFunction(ObjectiveFunction):
         self.leaprc_file = leaprc_file
         self.w2p_file = w2p_file
         self.target_names = target_names
+        self.n_workers = n_workers
         
     @args_from_configfile
-    def _init_batch_sys(self, batch_system, batch_template, on_cluster):
+    def _init_batch_sys(self, batch_system, batch_template, on_cluster,
+                        eval_cache=None, eval_cache_max_entries=None,
+                        eval_cache_max_age=None, pilot_workers=None,
+                        pilot_idle_timeout=300, bundle_size=None,
+                        bundle_wait=30, observable_store=None):
+        """
+        Arguments:
+        eval_cache: (string or bool) SQLite file that stores the results of
+            all evaluations (see EvaluationCache); True for
+            <out_path>/evaluations.sqlite, None or False to switch it off
+        eval_cache_max_entries: (int) maximum number of cached results
+        eval_cache_max_age: (float) maximum age of cached results in days
+        pilot_workers: (int) if given (and on_cluster), the simulations are
+            run by this number of long-running workers (see
+            coffe.core.pilot.PilotPool) instead of one cluster job each
+        pilot_idle_timeout: (float) workers exit after this number of
+            seconds without simulations
+        bundle_size: (int) if larger than 1, the MD simulations of up to
+            bundle_size concurrent evaluations run as one job with
+            gmx mdrun -multidir (see SimulationBundler); bundled runs
+            cannot be stopped early, so this excludes early_stopping and
+            adaptive_target_error in the MD section
+        bundle_wait: (float) seconds an MD simulation waits for others to
+            fill its bundle
+        observable_store: (string or bool) directory of the columnar store
+            of the observables of all evaluations (see ObservableStore);
+            True for <out_path>/observables, None or False to switch it off
+        """
         self.batch_system = batch_system
         self.batch_template = batch_template
         self.on_cluster = on_cluster
+        if on_cluster and pilot_workers:
+            from coffe.core.pilot import PilotPool
+            self.pilot = PilotPool(batch_system, batch_template,
+                                   n_workers=pilot_workers,
+                                   work_dir=os.path.join(self.out_path, "pilot"),
+                                   idle_timeout=pilot_idle_timeout)
+        if bundle_size is not None and bundle_size > 1:
+            if self.early_stopping or self.adaptive is not None:
+                raise ConfigError("bundle_size > 1 cannot be combined with early_stopping "
+                                  "or adaptive_target_error: gmx mdrun -multidir runs "
+                                  "the production stages to the end.")
+            self.bundler = SimulationBundler(
+                os.path.join(self.out_path, "bundles"), bundle_size,
+                wait=bundle_wait, batch_system=batch_system,
+                batch_template=batch_template, oncluster=on_cluster,
+                pilot=self.pilot)
+        if eval_cache is True:
+            eval_cache = os.path.join(self.out_path, "evaluations.sqlite")
+        if eval_cache:
+            self.eval_cache = EvaluationCache(eval_cache,
+                                              max_entries=eval_cache_max_entries,
+                                              max_age=eval_cache_max_age)
+        if observable_store is True:
+            observable_store = os.path.join(self.out_path, "observables")
+        if observable_store:
+            self.observables = ObservableStore(observable_store)
         
     def build_loss_function(out_path, md_config, opt_with_md=True, opt_with_mm=True,
                             qm_config=None, batch_config=None):
@@ -225,6 +455,85 @@ class MultiscaleLossFunction(ObjectiveFunction):
         
         return loss_function
         
+class FastMMLossFunction(ObjectiveFunction):
+    """
+    Low-cost approximation of the mm part of the multiscale loss.
+
+    The conformer energies are not minimized again for each parameter set;
+    they are evaluated at the minimized geometries of a reference
+    evaluation (see LJDecomposition), which takes microseconds per
+    parameter set. The loss is computed like in MultiscaleLossFunction with
+    opt_with_md=False, so that both can be used interchangeably, e.g. to
+    screen parameter sets before running the expensive objective.
+    """
+
+    def __init__(self, out_path, decomposition=None):
+        """
+        Arguments:
+        out_path: (string) the output directory
+        decomposition: (LJDecomposition) the conformer energies, by default
+            built from fast_mm_reference in _init_qm
+        """
+        self.out_path = out_path
+        self.decomposition = decomposition
+        self.incumbent = None
+
+    def get_function_value(self, xi, feval_number, res_queue=None):
+        """
+        Calculates the function value at x=<xi> and puts
+        (feval_number, xi, value) at the end of <res_queue>.
+        """
+        res = self.values([xi])[0]
+        print("i=", feval_number, ":", res, xi)
+        res_queue.put((feval_number, xi, res))
+
+    def values(self, X):
+        """
+        Returns the loss at all rows of X (one parameter set per row,
+        gromacs units as in MultiscaleLossFunction).
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        params = template_lj_parameters(self.extrm_template,
+                                        amber_lj_parameters(X.T))
+        energies = self.decomposition.relative_energies(params)[:, 1:]
+        mmloss = self.calc_mmloss(energies)
+        return np.tanh(np.tanh(mmloss*self.scale_mm*self.weight_mm))
+
+    def calc_mmloss(self, energies):
+        """
+        Normalized squared deviations from the target energies, summed over
+        the conformers, for each row of energies.
+        """
+        df = pd.read_csv(self.targets, header=None)
+        targets = np.array([e[0] for e in df.values[1:]])
+        temp = (targets - energies) / targets
+        return (temp*temp*0.0052).sum(axis=1)
+
+    @args_from_configfile
+    def _init_qm(self, extrm_template, targets, scale_mm=1e-4, weight_mm=0.5,
+                 fast_mm_reference=None, **kwargs):
+        """
+        Arguments:
+        fast_mm_reference: (string) output directory of a finished mm
+            evaluation (<out_path>/<feval_number>/QMMM/out), whose
+            minimized geometries are used
+        """
+        self.extrm_template = extrm_template
+        self.targets = targets
+        self.scale_mm = scale_mm
+        self.weight_mm = weight_mm
+        if self.decomposition is None:
+            assert fast_mm_reference is not None, \
+                "fast_mm_reference is required for the fast mm loss"
+            self.decomposition = LJDecomposition.from_minimizations(
+                fast_mm_reference)
+
+    def build_loss_function(out_path, qm_config):
+        loss_function = FastMMLossFunction(out_path)
+        loss_function._init_qm(cfg_file=qm_config, section="QM")
+        return loss_function
+
+
 class TopFileTemplate():
     def __init__(self, top_file_src, target_name):
         self._read_template(top_file_src)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar store of the observables of all evaluations of an optimization"""
+
+import os
+import re
+import threading
+
+import numpy as np
+
+
+class ObservableStore:
+    """
+    An append-only, columnar store of the observables of all evaluations.
+
+    Each column (e.g. "x", "loss", "density_series", "mm_energies") is kept
+    in two binary files in the store directory:
+    <column>.dat holds the values of all rows back to back (float64), and
+    <column>.idx holds one pair (evaluation number, end offset) per row
+    (int64). Rows can have different lengths, so that the full time series
+    and the energies of all conformers fit in one file each.
+
+    The values of a row are written before its index entry, so that a row
+    is only visible once it is complete; bytes of a row that was being
+    written during a crash are overwritten by the next row. Readers
+    memory-map the data files (see read), which makes analyses across
+    thousands of evaluations fast.
+
+    A store is written from one process (the optimization), but can be read
+    by others while it grows.
+    """
+
+    def __init__(self, path):
+        """
+        Arguments:
+        path: (string) the store directory, created if it does not exist
+        """
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def columns(self):
+        """Returns the names of all columns."""
+        return sorted(f[:-4] for f in os.listdir(self.path) if f.endswith(".idx"))
+
+    def append(self, feval_number, **columns):
+        """
+        Adds the observables of an evaluation.
+
+        Arguments:
+        feval_number: (int) the number of the evaluation
+        columns: the values (scalars or list-like) per column name, e.g.
+            x=[0.1, 0.2], loss=0.3
+        """
+        with self._lock:
+            for name, values in sorted(columns.items()):
+                if values is None:
+                    continue
+                assert re.match(r"^\w+$", name), "Invalid column name " + name
+                self._append_row(name, feval_number, values)
+
+    def read(self, column):
+        """
+        Reads a column.
+
+        Arguments:
+        column: (string) the name of the column
+
+        Returns:
+        A triple (fevals, offsets, values) of np.arrays: the evaluation
+        number of each row, the start offsets of the rows and one offset
+        past the end (length n_rows + 1), and the memory-mapped values
+        of all rows. Row i is values[offsets[i]:offsets[i+1]].
+        """
+        index = self._read_index(column)
+        offsets = np.concatenate([[0], index[:, 1]])
+        if offsets[-1] == 0:
+            return index[:, 0], offsets, np.zeros(0)
+        values = np.memmap(self._data_file(column), dtype="<f8", mode="r",
+                           shape=(int(offsets[-1]),))
+        return index[:, 0], offsets, values
+
+    def get(self, column, feval_number):
+        """
+        Returns the values of an evaluation in a column (np.array), or None.
+        If the evaluation was stored more than once, the last row counts.
+        """
+        fevals, offsets, values = self.read(column)
+        rows = np.nonzero(fevals == feval_number)[0]
+        if len(rows) == 0:
+            return None
+        return np.array(values[offsets[rows[-1]]:offsets[rows[-1] + 1]])
+
+    def matrix(self, column):
+        """
+        Returns a column whose rows all have the same length as a pair
+        (fevals, 2d np.array), e.g. the parameter vectors.
+
+        Raises:
+        ValueError, if the rows have different lengths
+        """
+        fevals, offsets, values = self.read(column)
+        lengths = np.diff(offsets)
+        if len(lengths) == 0:
+            return fevals, np.zeros((0, 0))
+        if np.any(lengths != lengths[0]):
+            raise ValueError("The rows of column {} have different lengths."
+                             .format(column))
+        return fevals, np.asarray(values).reshape(len(fevals), lengths[0])
+
+    def _data_file(self, column):
+        return os.path.join(self.path, column + ".dat")
+
+    def _index_file(self, column):
+        return os.path.join(self.path, column + ".idx")
+
+    def _read_index(self, column):
+        """The (feval, end offset) pairs of the complete rows."""
+        index_file = self._index_file(column)
+        if not os.path.isfile(index_file):
+            return np.zeros((0, 2), dtype=np.int64)
+        index = np.fromfile(index_file, dtype="<i8")
+        # an entry that was being written during a crash is incomplete
+        return index[:len(index) // 2 * 2].reshape(-1, 2)
+
+    def _append_row(self, column, feval_number, values):
+        values = np.ravel(np.asarray(values, dtype="<f8"))
+        index = self._read_index(column)
+        end = int(index[-1, 1]) if len(index) else 0
+        data_file = self._data_file(column)
+        with open(data_file, "r+b" if os.path.isfile(data_file) else "wb") as f:
+            f.truncate(end * 8)
+            f.seek(end * 8)
+            f.write(values.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        entry = np.array([feval_number, end + len(values)], dtype="<i8")
+        with open(self._index_file(column), "ab") as f:
+            # drop an incomplete entry of a crashed write
+            f.truncate(len(index) * 16)
+            f.write(entry.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
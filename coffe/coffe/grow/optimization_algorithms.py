@@ -3,14 +3,17 @@
 """Optimization Algorithm hierarchy"""
 
 
-from coffe.core.decorators import args_from_configfile
+from coffe.core.decorators import args_from_configfile, register_schema
+from coffe.grow.gp_model import IncrementalGP
+from coffe.grow.journal import EvaluationJournal
 from coffe.grow.maths_helper import scale, Constraints
-from coffe.grow.objective_functions import MultiscaleLossFunction
+from coffe.grow.objective_functions import MultiscaleLossFunction, FastMMLossFunction
 from coffe.grow.sampling import lh_sampling
 
 import copy
 import cma
 import numpy as np
+import os
 from os import path, stat, system, makedirs, mkdir
 import pandas as pd
 from queue import Queue
@@ -19,6 +22,28 @@ from sklearn.gaussian_process import GaussianProcessRegressor
 import threading
 
 
+def _one_of(*choices):
+    def check(value):
+        assert value in choices, "{} is not one of {}".format(value, choices)
+        return value
+    return check
+
+
+register_schema("OPT", {
+    "bounds": lambda bounds: [tuple(float(b) for b in bound) for bound in bounds],
+    "max_fevals": int,
+    "init_fevals": int,
+    "par_evals_init": int,
+    "par_evals_opt": int,
+    "async_evals": bool,
+    "async_liar": _one_of("min", "mean", "max", "believer"),
+    "model_update": _one_of("full", "incremental"),
+    "refit_every": int,
+    "objective_function": _one_of("multiscale", "physical", "quantum",
+                                  "fast_quantum"),
+})
+
+
 class OptimizationAlgorithm:
 
     @args_from_configfile
@@ -35,7 +60,8 @@ class OptimizationAlgorithm:
         Arguments:
         opt_method: (string) one out of [bayes_opt, cmaes]
         out_path: (string) dir path where the subdirectories for the simulations
-        objective_function (string) one out of [multiscale, physical, quantum]
+        objective_function (string) one out of [multiscale, physical, quantum,
+            fast_quantum]
 
         Raises:
         AssertionError: if the input arguments do not match
@@ -56,6 +82,8 @@ class OptimizationAlgorithm:
         elif objective_function == "quantum":
             obj_fun = MultiscaleLossFunction.build_loss_function(out_path, cfg, 
                                                                  opt_with_md=False)
+        elif objective_function == "fast_quantum":
+            obj_fun = FastMMLossFunction.build_loss_function(out_path, cfg)
         else:
             raise NotImplementedError()
 
@@ -84,8 +112,25 @@ class BayesianOptimization(OptimizationAlgorithm):
                  init_fevals=100, 
                  par_evals_init=8,
                  par_evals_opt=4,
+                 async_evals=False,
+                 async_liar="mean",
+                 model_update="full",
+                 refit_every=10,
                  **kwargs):
-        
+        """
+        Arguments:
+        async_evals: (bool) keep par_evals_opt evaluations running at all
+            times instead of waiting for the whole batch to finish
+        async_liar: (string) one out of [min, mean, max, believer], the
+            value that pending evaluations are assumed to take when the
+            model is refitted in asynchronous mode
+        model_update: (string) one out of [full, incremental], whether the
+            GP is refitted from scratch after every batch or new observations
+            are added to the existing model (see IncrementalGP)
+        refit_every: (int) in incremental mode, re-optimize the kernel
+            hyperparameters every refit_every model updates
+        """
+
         super().__init__(cfg_file=cfg, section="OPT")
         print(self.constraints)
         print(self.constraints.bounds)
@@ -96,6 +141,10 @@ class BayesianOptimization(OptimizationAlgorithm):
         self.par_evals_init = par_evals_init
         self.par_evals_opt = par_evals_opt
         self.out_path = out_path
+        assert async_liar in ["min", "mean", "max", "believer"]
+        assert model_update in ["full", "incremental"]
+        self.async_evals = async_evals
+        self.async_liar = async_liar
 
         self.df = pd.DataFrame(columns=["x1", "x2", "x3", "x4", "obs"])
         self.batch_queue = Batch(out_path, self.loss, self.df)
@@ -131,7 +180,11 @@ class BayesianOptimization(OptimizationAlgorithm):
         }
         
         # Model fallback for useful error messages
-        self._model = GaussianProcessRegressor(**gp_params)
+        if model_update == "incremental":
+            self._model = IncrementalGP(k, n_restarts=gp_params['n_restarts_optimizer'],
+                                        refit_every=refit_every)
+        else:
+            self._model = GaussianProcessRegressor(**gp_params)
         
         
     def optimize(self):
@@ -149,6 +202,10 @@ class BayesianOptimization(OptimizationAlgorithm):
 
         print(len(self.df.values), "/", self.max_fevals)
 
+        if self.async_evals:
+            self._optimize_async()
+            return
+
         for iter in range(len(self.df.values), self.max_fevals, self.par_evals_opt):
             # make new suggestions by optimizing the acquisition function
             X_sugg = self._suggest(batch_size=self.par_evals_opt)
@@ -169,6 +226,67 @@ class BayesianOptimization(OptimizationAlgorithm):
             # update model for next iteration
             self._build_model()
 
+    def _optimize_async(self):
+        """
+        Keep par_evals_opt evaluations running. Whenever an evaluation
+        finishes, the model is refitted and a replacement point is suggested.
+        Pending evaluations enter the model with a lie (see async_liar), so
+        that suggestions made in the meantime do not pile up at one spot.
+        """
+        self._fill_async_slots()
+
+        while self.batch_queue.n_running > 0:
+            self.batch_queue.wait_for_any()
+            print(len(self.df.values), "/", self.max_fevals)
+
+            self._build_model()
+            self._fill_async_slots()
+
+    def _fill_async_slots(self):
+        """
+        Submit suggestions until all slots are busy or max_fevals is reached
+        """
+        while (self.batch_queue.n_running < self.par_evals_opt and
+               len(self.df.values) < self.max_fevals):
+            model = self._pending_model(list(self.batch_queue.running))
+            x = self._suggest(batch_size=1, model=model)[0]
+
+            id = int(self.df.index.max())+1
+            point = (x, id)
+            print("EVAL at:", point)
+            xi = list(x)
+            xi.append(-1)
+            self.df.loc[id] = xi # init not yet simulated x with -1
+            self.batch_queue.submit(point)
+
+    def _pending_model(self, pending):
+        """
+        Returns a GP that treats the pending evaluations as observed.
+        The kernel hyperparameters of the current model are kept fixed.
+        """
+        if not pending:
+            return self._model
+
+        X, Y = self._training_data()
+        X_pending = []
+        for id in pending:
+            row = self.df.loc[id].values
+            if self.scale_x:
+                X_pending.append(self._scale_to_cube(row[:-1]))
+            else:
+                X_pending.append(list(row[:-1]))
+
+        if self.async_liar == "believer":
+            Y_pending = list(self._model.predict(X_pending))
+        else:
+            liar = getattr(np, self.async_liar)(Y)
+            Y_pending = [liar] * len(X_pending)
+
+        model = GaussianProcessRegressor(kernel=self._model.kernel_,
+                                         optimizer=None)
+        model.fit(X + X_pending, Y + Y_pending)
+        return model
+
     def _initial_sampling(self):
         X = lh_sampling(self.init_fevals, self.constraints.bounds, optimize=True)
 
@@ -182,12 +300,15 @@ class BayesianOptimization(OptimizationAlgorithm):
         
         self.batch_queue.process_queue(self.par_evals_init, self.df)
     
-    def _suggest(self, batch_size=1):
+    def _suggest(self, batch_size=1, model=None):
         """
         Minimize the acquisition function using CMA-ES to suggest,
         where the model should be evaluated next.
         """
-        
+        if model is None:
+            model = self._model
+
+
         kappas = [2.57]
         suggestions = []
 
@@ -200,14 +321,19 @@ class BayesianOptimization(OptimizationAlgorithm):
             mu0 = [(xl+xu)/2 for (xl, xu) in zip(self.lower_bounds, self.upper_bounds)]
             sig0 = 2 # optimum should be in mu0+3sig0
 
-            arg = [self._model, kappas[i]]
-
-            # minimize acquisition function
-            x = cma.fmin(BayesianOptimization._lcb, mu0, sig0, args=arg, 
-                         options={'BoundaryHandler': cma.BoundPenalty, 
-                                  'bounds': [self.lower_bounds,
-                                             self.upper_bounds]})
-            suggestions.append(self._rescale(x[0]))
+            # minimize acquisition function, evaluating one whole
+            # population per model prediction
+            es = cma.CMAEvolutionStrategy(mu0, sig0,
+                                          {'BoundaryHandler': cma.BoundPenalty,
+                                           'bounds': [self.lower_bounds,
+                                                      self.upper_bounds],
+                                           'verbose': -9})
+            while not es.stop():
+                population = es.ask()
+                es.tell(population,
+                        list(BayesianOptimization._lcb(population, model,
+                                                       kappas[i])))
+            suggestions.append(self._rescale(es.result.xbest))
 
         return suggestions
     
@@ -216,35 +342,47 @@ class BayesianOptimization(OptimizationAlgorithm):
         """
         Builds a GP out of the simulation loss values
         """
-        X = []
-        Y = []
-
-        for row in self.df.values:
-            # ignore failed simulations
-            if row[-1] != -1:
-                if self.scale_x:
-                    scaled_x = self._scale_to_cube(row[:-1])
-                else:
-                    scaled_x = row[:-1]                    
-                X.append(scaled_x)
-                
-                if self.scale_y:
-                    # Values become < 0, so no bias necessary
-                    scaled_y = np.log(row[-1])
-                else:
-                    # Add bias due to gpr zero mean
-                    scaled_y = row[-1]+self.gp_mean
-                Y.append(scaled_y)
-
+        X, Y = self._training_data()
         self._model.fit(X, Y)
+
+        # the best loss so far, used to stop hopeless simulations early
+        observed = self.df["obs"][self.df["obs"] != -1]
+        if len(observed):
+            self.loss.incumbent = float(observed.min())
+
+    def _training_data(self):
+        """
+        Returns the (scaled) observations that the model is fitted to
+        """
+        values = self.df.values.astype(float)
+        # ignore failed simulations
+        values = values[values[:, -1] != -1]
+        X = values[:, :-1]
+        if self.scale_x:
+            old = np.array(self.constraints.bounds, dtype=float)
+            new = np.array(self.cube_bounds, dtype=float)
+            X = ((X - old[:, 0]) / (old[:, 1] - old[:, 0])
+                 * (new[:, 1] - new[:, 0]) + new[:, 0])
+
+        if self.scale_y:
+            # Values become < 0, so no bias necessary
+            Y = np.log(values[:, -1])
+        else:
+            # Add bias due to gpr zero mean
+            Y = values[:, -1] + self.gp_mean
+
+        return X.tolist(), Y.tolist()
         
-    def _lcb(x, gp, kappa):
+    def _lcb(X, gp, kappa):
         """
-        Lower Confidence Bound acquisition function
+        Lower Confidence Bound acquisition function, evaluated for
+        all rows of X at once. The fitted GP keeps the Cholesky factor
+        of the training kernel (L_) and K^-1 y (alpha_), so a prediction
+        costs two matrix products and one triangular solve.
         """
-        mean, std = gp.predict([x], return_std=True)
+        mean, std = gp.predict(np.atleast_2d(X), return_std=True)
 
-        return np.reshape(mean - kappa*std, 1)[0]
+        return np.reshape(mean, -1) - kappa*std
     
     def _scale_to_cube(self, x):
         return scale(x, self.cube_bounds, self.constraints.bounds)
@@ -253,8 +391,25 @@ class BayesianOptimization(OptimizationAlgorithm):
         return scale(x, self.constraints.bounds, self.cube_bounds)
         
     def _read_batch_file(self):
-        df_path = path.join(self.out_path, "batch.csv")
-        df = pd.read_csv(df_path, index_col=0, encoding="utf-8-sig")
+        """
+        Recovers the observations of an aborted run by replaying the
+        evaluation journal (or from batch.csv for runs without a journal)
+        and queues all evaluations without observation.
+        """
+        journal = self.batch_queue.journal
+        if journal.exists():
+            rows = journal.replay()
+            df = pd.DataFrame([list(x) + [obs] for i, x, obs, status in rows],
+                              index=[i for i, x, obs, status in rows],
+                              columns=self.df.columns)
+        else:
+            df_path = path.join(self.out_path, "batch.csv")
+            df = pd.read_csv(df_path, index_col=0, encoding="utf-8-sig")
+            # continue the run with a journal
+            for index, row in df.iterrows():
+                journal.submitted(index, row.values[:-1])
+                if row["obs"] != -1:
+                    journal.completed(index, row["obs"])
 
         for index, row in df.loc[df["obs"]==-1].iterrows():
             x = row[:-1]
@@ -344,8 +499,11 @@ class Batch:
     A batch queue in which one may put parameter sets that will be evaluated
     in parallel on the specified objective function.
 
-    A pandas DataFrame is used to maintain the observations after program
-    abortion and to make them available to the caller.
+    A pandas DataFrame is used to make the observations available to the
+    caller. All submissions, completions and failures are appended to an
+    EvaluationJournal (journal.jsonl), from which an aborted run is
+    recovered; batch.csv is a view of the DataFrame that is replaced
+    atomically after each batch.
     """
 
     def __init__(self, out_path, loss_fun, df):
@@ -353,10 +511,18 @@ class Batch:
         self.queue = Queue()
         self.res_queue = Queue()
         self.file_path = path.join(out_path, "batch.csv")
+        self.journal = EvaluationJournal(path.join(out_path, "journal.jsonl"))
         self.df = df
+
+        # evaluations started by submit() that have not been collected, yet
+        self.running = {}
+        self._finished = []
+        self._finished_cond = threading.Condition()
+        # names of all evaluations whose results were ever collected
+        self._collected = set()
         
     def pending_evaluations(self):
-        if path.exists(self.file_path):
+        if path.exists(self.file_path) or self.journal.exists():
             return True
         return False
         
@@ -367,6 +533,7 @@ class Batch:
             return True
                
     def _put(self, elem):
+        self.journal.submitted(elem[1], elem[0])
         self.queue.put(elem)
         
     def process_queue(self, max_parallel, df):
@@ -377,12 +544,14 @@ class Batch:
 
         cnt_parallel = 0
         threads = []
+        started = []
         
         while not self.queue.empty():
             
             while cnt_parallel < max_parallel and not self.queue.empty():
                 # create a thread for each pending evaluation
                 item = self.queue.get()
+                started.append(item[1])
                 kw = dict(xi=item[0], feval_number=item[1], 
                           res_queue=self.res_queue)
                 t = threading.Thread(target=self.loss.get_function_value,
@@ -394,10 +563,15 @@ class Batch:
             for thread in threads:
                 # join the threads and collect the results
                 thread.join()
-                self._update_file()
+                self._collect_results()
                 
             cnt_parallel = 0
             threads = []
+
+        # evaluations that crashed without a result
+        for name in set(started) - self._collected:
+            self.journal.failed(name)
+        self._write_view()
                     
         # and reset the queue
         self.queue = Queue()
@@ -406,16 +580,83 @@ class Batch:
         # caller extracts observations from df
         return None
     
+    def submit(self, item):
+        """
+        Starts the evaluation of a single item (x, name) in a background
+        thread and returns immediately.
+        """
+        self.journal.submitted(item[1], item[0])
+        t = threading.Thread(target=self._evaluate, args=(item,))
+        self.running[item[1]] = t
+        t.start()
+
+    @property
+    def n_running(self):
+        return len(self.running)
+
+    def wait_for_any(self):
+        """
+        Blocks until at least one of the submitted evaluations has finished,
+        writes the new observations to df and returns the finished names.
+        """
+        with self._finished_cond:
+            while not self._finished:
+                self._finished_cond.wait()
+            finished, self._finished = self._finished, []
+
+        for name in finished:
+            self.running.pop(name).join()
+        # results may have been collected before their thread finished
+        # (e.g. by _update_file), so only those never collected failed
+        self._collect_results()
+        for name in set(finished) - self._collected:
+            self.journal.failed(name)
+        self._write_view()
+
+        return finished
+
+    def _evaluate(self, item):
+        try:
+            self.loss.get_function_value(xi=item[0], feval_number=item[1],
+                                         res_queue=self.res_queue)
+        finally:
+            # also wake up the caller if the evaluation crashed
+            with self._finished_cond:
+                self._finished.append(item[1])
+                self._finished_cond.notify()
+
     def _update_file(self):
         """
-        Updates observation values in df
+        Updates observation values in df and writes batch.csv
+        """
+        self._collect_results()
+        self._write_view()
+
+    def _collect_results(self):
+        """
+        Moves the results from res_queue to df and the journal.
+        Returns the names of the collected evaluations.
         """
         indices, xs, obss = self._to_array()
 
         for ind, x, obs in zip(indices, xs, obss):    
-            self.df.loc[ind, "obs"] = np.reshape(obs, 1)[0]
-
-        self.df.to_csv(self.file_path)
+            obs = np.reshape(obs, 1)[0]
+            self.df.loc[ind, "obs"] = obs
+            if obs == -1:
+                self.journal.failed(ind)
+            else:
+                self.journal.completed(ind, obs)
+        self._collected.update(indices)
+        return indices
+
+    def _write_view(self):
+        """
+        Replaces batch.csv by the current df (never leaves a partly
+        written file behind).
+        """
+        tmp_path = self.file_path + ".tmp"
+        self.df.to_csv(tmp_path)
+        os.replace(tmp_path, self.file_path)
         
     
     def _to_array(self):
@@ -2,7 +2,7 @@
 
 """Classes for GROW optimization of FF parameters"""
 
-from coffe.core.decorators import args_from_configfile
+from coffe.core.decorators import args_from_configfile, read_config
 from coffe.grow.optimization_algorithms import OptimizationAlgorithm
 
 from os import path
@@ -20,6 +20,9 @@ class GROWOptimization:
         if experiment_name:
             out_path = path.join(out_path, experiment_name)
 
+        # all parts of the optimization use the options as read here
+        cfg = read_config(cfg)
+
         algo = OptimizationAlgorithm. \
             factor_optimization_algorithm(out_path=out_path, 
                                           opt_method=opt_method, 
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import copy
+from concurrent.futures import ProcessPoolExecutor
 import math
 import matplotlib.pyplot as plt
 import numpy as np
@@ -10,12 +10,15 @@ from scipy.spatial.distance import cdist
 def random_sampling(dim, num_points):
     pass
 
-def lh_sampling(num_points, bounds, n_dim = None, optimize=False, tries=1):
+def lh_sampling(num_points, bounds, n_dim = None, optimize=False, tries=1,
+                existing=None):
     '''
     Generates a latin hypercube design with <num_points> points in 
     <n_dim> dimensions. <len(bounds)> needs to match <n_dim>.
     If <tries> > 1, <tries> designs are created and the best w.r.t. the 
     min distance will be returned.
+    If <optimize>, the best design is optimized by simulated annealing,
+    taking the distances to the <existing> points into account.
     bounds is a list of tuples (lb, ub)
     '''
 
@@ -47,7 +50,7 @@ def lh_sampling(num_points, bounds, n_dim = None, optimize=False, tries=1):
     imin = np.argmax(solutions_fitness)
     
     if optimize:
-        return _sa_design(solutions[imin])
+        return _sa_design(solutions[imin], existing)
     else:
         return solutions[imin]
 
@@ -72,61 +75,119 @@ def min_distance(X):
     # distance along all axis
     return np.min(dist_matrix, (0, 1))
 
-def _sa_design(X):
+def _sa_design(X, existing=None):
     '''
-    Simulated Annealing optimization of X w.r.t. min_distance
+    Simulated Annealing optimization of X w.r.t. min_distance,
+    see maximin_design
     '''
+    print(f'old f:{min_distance(X)}')
+    best_X, best_f = _anneal(X, existing, np.random.randint(2**31))
+    print(f'new f:{best_f}')
+    return best_X
 
-    def _perturbate(sol):
-        '''
-        swap a single coordinate from two points at random
-        '''
-        X = copy.deepcopy(sol)
-        ind_a = np.random.randint(0, len(X))
-        ind_b = np.random.randint(0, len(X))
-        comp = np.random.randint(0, len(X[0]))
-        X[ind_a][comp], X[ind_b][comp] = X[ind_b][comp], X[ind_a][comp]
-        return X
-    
-    def _accept(new_f, old_f, T):
+
+def maximin_design(num_points, bounds, existing=None, restarts=1, n_jobs=None):
+    '''
+    Generates a latin hypercube design with <num_points> points that is
+    optimized w.r.t. the min distance between its points by simulated
+    annealing. Each annealing step swaps one coordinate of two points
+    and only updates the distances of these two points.
+    <restarts> independent designs are optimized in a process pool
+    with <n_jobs> workers; the best one is returned.
+    If <existing> points are given, the distances to them count as well,
+    so that the extended design stays space-filling.
+    bounds is a list of tuples (lb, ub)
+    '''
+    dims = np.array(bounds)
+    starts = [_constraint_lhs(len(bounds), dims, num_points)
+              for _ in range(restarts)]
+    seeds = np.random.randint(2**31, size=restarts)
+    if restarts > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_anneal, starts,
+                                    [existing] * restarts, seeds))
+    else:
+        results = [_anneal(starts[0], existing, seeds[0])]
+    best_X, best_f = max(results, key=lambda r: r[1])
+    return best_X
+
+
+def _anneal(X, existing, seed, T=1.0, T_min=0.0000001, alpha=0.9):
+    '''
+    Simulated Annealing of X w.r.t. the min distance (to the other points
+    of X and to the existing points). Returns the design as list of lists
+    and its min distance.
+    '''
+    rng = np.random.RandomState(seed)
+    X = np.array(X, dtype=float)
+    n, n_dim = X.shape
+    if existing is None or len(existing) == 0:
+        existing = np.empty((0, n_dim))
+    else:
+        existing = np.array(existing, dtype=float)
+
+    # squared distances between all points, and the closest neighbour
+    # of each point (in X or in existing)
+    D = cdist(X, X, "sqeuclidean")
+    np.fill_diagonal(D, np.inf)
+    E = cdist(X, existing, "sqeuclidean")
+    DE = np.hstack([D, E])
+    row_min = DE.min(axis=1)
+    row_arg = DE.argmin(axis=1)
+    f = row_min.min()
+
+    def _update(a, b):
         '''
-        Accept worse solutions (new < old) at higher propability when the
-        temperature is high
+        recompute the distances of the points a and b
         '''
-        if new_f > old_f:
-            return True
-        else:
-            # ap is at most 1, so tune the exclusive interval bound
-            # to increase the propability that a solution that doesnt
-            # change the min distance is accepted
-            r = np.random.uniform(0, 2)
-            # exponent should be negated for minimization
-            ap = math.exp((new_f - old_f) / T)
-            #print(ap)
-            return r <= ap
-        
-    best_X = copy.deepcopy(X)
-    best_f = min_distance(best_X)
-    print(f'old f:{best_f}')
-    
-    T = 1.0
-    T_min = 0.0000001
-    alpha = 0.9
-    
+        for i in (a, b):
+            d = ((X - X[i])**2).sum(axis=1)
+            d[i] = np.inf
+            DE[i, :n] = d
+            DE[:n, i] = d
+            DE[i, n:] = ((existing - X[i])**2).sum(axis=1)
+        # rows whose closest neighbour was a or b need a full update,
+        # all others can only get closer to a or b
+        full = (row_arg == a) | (row_arg == b)
+        full[[a, b]] = True
+        row_min[full] = DE[full].min(axis=1)
+        row_arg[full] = DE[full].argmin(axis=1)
+        rest = ~full
+        for i in (a, b):
+            closer = rest & (DE[:, i] < row_min)
+            row_min[closer] = DE[closer, i]
+            row_arg[closer] = i
+
     while T > T_min:
-        
-        for i in range(1, 100):
-            
-            new_X = _perturbate(best_X)
-            new_f = min_distance(new_X)
-            
-            if _accept(new_f, best_f, T):
-                best_X, best_f = new_X, new_f
-                
+
+        for _ in range(1, 100):
+
+            # swap a single coordinate from two points at random
+            a, b = rng.randint(0, n, size=2)
+            comp = rng.randint(0, n_dim)
+            if a == b:
+                continue
+            saved = (DE[[a, b]].copy(), row_min.copy(), row_arg.copy())
+            X[[a, b], comp] = X[[b, a], comp]
+            _update(a, b)
+            new_f = row_min.min()
+
+            # Accept worse solutions (new < old) at higher propability
+            # when the temperature is high; r is drawn from (0, 2) to
+            # increase the propability that a solution that doesnt change
+            # the min distance is accepted
+            if (new_f > f or
+                    rng.uniform(0, 2) <= math.exp((np.sqrt(new_f) - np.sqrt(f)) / T)):
+                f = new_f
+                continue
+
+            # reject: swap back and restore the distances
+            X[[a, b], comp] = X[[b, a], comp]
+            DE[[a, b]] = saved[0]
+            DE[:n, a] = saved[0][0, :n]
+            DE[:n, b] = saved[0][1, :n]
+            row_min[:], row_arg[:] = saved[1], saved[2]
+
         T *= alpha
-    
-    print(f'new f:{best_f}')
-    return best_X
-            
-        
-    
\ No newline at end of file
+
+    return [list(x) for x in X], np.sqrt(f)
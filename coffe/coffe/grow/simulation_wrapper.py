@@ -3,14 +3,16 @@
 # executer.py in old grow
 
 from coffe.core import cluster
+from coffe.core.status import Status
 from coffe.gmx import observables
+from coffe.gmx import sim
 from coffe.gmx import simgen
 
 import numpy as np
 import os
-import pandas as pd
+import threading
+import time
 from shutil import copy
-from time import sleep
 
 
 class GromacsSimulation:
@@ -21,7 +23,27 @@ class GromacsSimulation:
     """
     def __init__(self, new_dir_name, mdp_files, top_template, gro_file,
                  mdp_dir,batch_system, batch_template, oncluster=False, 
-                 job_name = None):
+                 job_name = None, acceptable=None, pilot=None, bundler=None,
+                 library=None, adaptive=None):
+        """
+        Arguments:
+        acceptable: (tuple) acceptable window (lower, upper) for the density;
+            if given, the production run is stopped as soon as its mean
+            density is certain to end up outside (see
+            GmxCalculationEarlyStopping)
+        pilot: (coffe.core.pilot.PilotPool) if given, the simulation is run
+            by the workers of this pool instead of a cluster job of its own
+        bundler: (SimulationBundler) if given, the simulation is run
+            together with concurrent simulations (gmx mdrun -multidir)
+        library: (EquilibratedStateLibrary) if given, the chain starts from
+            the equilibrated state of the nearest finished chain (if it is
+            close enough) and is added to the library once it is done
+        adaptive: (dict) if given, the length of the production run adapts
+            to the convergence of the density (see GmxCalculationAdaptive);
+            keyword arguments target_error and max_time of
+            GmxCalculationAdaptive. The result is the mean of the
+            equilibrated region.
+        """
         self.on_cluster = oncluster
         self.dir_name = new_dir_name
         self.mdp_files = mdp_files
@@ -30,6 +52,12 @@ class GromacsSimulation:
         self.mdp_dir = mdp_dir
         self.batch_system = batch_system
         self.batch_template = batch_template
+        self.acceptable = acceptable
+        self.pilot = pilot
+        self.bundler = bundler
+        self.library = library
+        self.adaptive = adaptive
+        self.x = None
         
         if job_name == None:
             job_name = "coffe_job"
@@ -46,6 +74,7 @@ class GromacsSimulation:
         if self._results_available(self.dir_name):
             return None
         
+        self.x = x
         self.top_template.write_to(self.dir_name, x)
         self.top_file = os.path.join(self.dir_name, 
                                      self.top_template.file_name)
@@ -53,13 +82,20 @@ class GromacsSimulation:
         # Init the coffe simulation chain
         self._init_chain()
         
-        if self.on_cluster:
+        # a local chain raises on errors
+        completed = True
+        if self.bundler is not None:
+            completed = self.bundler.run(self.chain)
+        elif self.on_cluster:
             queueing =self.batch_system
             batch_template = self.batch_template
 
             job_name = self.job_name
             work_dir = self.dir_name
-            job = cluster.ClusterJob(queueing, batch_template, job_name, work_dir)   
+            if self.pilot is not None:
+                job = self.pilot.generate_job(work_dir, job_name)
+            else:
+                job = cluster.ClusterJob(queueing, batch_template, job_name, work_dir)   
             print("job created")
             job += self.chain
             print("job added")
@@ -67,10 +103,13 @@ class GromacsSimulation:
             print("job submitted")
             
             # wait until the job is done or aborted
-            while(job.status not in ["completed", "error"]):
-                sleep(5)
+            completed = job.wait() == Status.completed
         else:
             self.chain()
+
+        # crashed chains are no warm-start sources
+        if self.library is not None and completed:
+            self.library.add(x, self.dir_name)
             
 
 
@@ -96,15 +135,38 @@ class GromacsSimulation:
         for mdp_file in self.mdp_files:
             mdp_file_paths.append(os.path.join(self.dir_name, mdp_file))
             
+        types = None
+        type_kwargs = None
+        if self.acceptable is not None or self.adaptive is not None:
+            # only the production run is monitored
+            types = [sim.GmxCalculation] * (len(self.mdp_names)-1)
+            type_kwargs = [{}] * (len(self.mdp_names)-1)
+            if self.adaptive is not None:
+                types.append(sim.GmxCalculationAdaptive)
+                type_kwargs.append(dict(self.adaptive, acceptable=self.acceptable))
+            else:
+                types.append(sim.GmxCalculationEarlyStopping)
+                type_kwargs.append({"acceptable": self.acceptable})
+
         generator = simgen.GmxChainGenerator(
                 names=self.mdp_names,
-                mdp_files=mdp_file_paths
+                mdp_files=mdp_file_paths,
+                types=types,
+                type_kwargs=type_kwargs
                 )
         
-        self.chain = generator.generate(self.dir_name,self.gro_file, self.top_file)
+        warm_start = None
+        if self.library is not None and self.x is not None:
+            warm_start = self.library.warm_start(self.x, self.mdp_names)
+            if warm_start is not None:
+                print("Warm start from", warm_start[1])
+        
+        self.chain = generator.generate(self.dir_name,self.gro_file, self.top_file,
+                                        warm_start=warm_start)
 
 
     def _store_results(self, location, properties):
+        import pandas as pd
         df = pd.DataFrame(data={'properties': [properties]})
         path = os.path.join(location, "properties.csv")
         df.to_csv(path, index=False)
@@ -113,6 +175,7 @@ class GromacsSimulation:
         return os.path.isfile(os.path.join(location, "properties.csv"))
         
     def _read_results(self, location):
+        import pandas as pd
         path = os.path.join(location, "properties.csv")
         df = pd.read_csv(path)
         return df.values
@@ -141,6 +204,13 @@ class GromacsSimulation:
                                                            self.mdp_names[-1]), [prop])
         
         # results is an array containing: (t, result)
+        if self.adaptive is not None:
+            # average over the equilibrated region only
+            mean, sem, t0, g = observables.equilibrated_mean(results[:, 1])
+            self._store_results(self.dir_name, mean)
+            print(mean, sem, "equilibrated from t =", results[t0, 0])
+            return mean
+
         # calculate mean, sd using double precision according to np docs
         mean = np.mean(results, axis=0, dtype=np.float64)
         sd = np.std(results, axis=0, dtype=np.float64)
@@ -150,3 +220,94 @@ class GromacsSimulation:
         print(mean[1], sd[1])
         
         return mean[1]
+
+
+class SimulationBundler:
+    """
+    Runs the simulation chains of concurrent GromacsSimulations in bundles.
+
+    The chains of up to bundle_size simulations that are started within
+    wait seconds are bundled (see coffe.gmx.simgen.bundle): their stages
+    run in lockstep, each stage with one gmx mdrun -multidir call. Each
+    simulation keeps its own directory, so that its results are read as if
+    it had run on its own.
+    """
+    def __init__(self, bundle_dir, bundle_size, wait=30, batch_system=None,
+                 batch_template=None, oncluster=False, pilot=None):
+        """
+        Arguments:
+        bundle_dir: (string) the bundles are run in subdirectories
+        bundle_size: (int) maximum number of simulations per bundle
+        wait: (float) seconds the first simulation of a bundle waits for others
+        batch_system, batch_template, oncluster, pilot: see GromacsSimulation
+        """
+        self.bundle_dir = bundle_dir
+        self.bundle_size = bundle_size
+        self.wait = wait
+        self.batch_system = batch_system
+        self.batch_template = batch_template
+        self.on_cluster = oncluster
+        self.pilot = pilot
+        self.n_bundles = 0
+        self._waiting = []
+        self._cond = threading.Condition()
+        if not os.path.isdir(bundle_dir):
+            os.makedirs(bundle_dir)
+
+    def run(self, chain):
+        """
+        Runs a chain as part of a bundle and returns when the bundle is done.
+
+        The first waiting simulation collects the bundle and runs it; the
+        others wait until it is done.
+
+        Returns:
+        True, if the bundle completed without error
+        """
+        entry = {"chain": chain, "done": False, "completed": False,
+                 "arrived": time.time()}
+        with self._cond:
+            self._waiting.append(entry)
+            self._cond.notify_all()
+            while True:
+                if entry["done"]:
+                    return entry["completed"]
+                if self._waiting and self._waiting[0] is entry:
+                    waited = time.time() - entry["arrived"]
+                    if (len(self._waiting) >= self.bundle_size
+                            or waited >= self.wait):
+                        members = self._waiting[:self.bundle_size]
+                        del self._waiting[:self.bundle_size]
+                        name = "bundle{}".format(self.n_bundles)
+                        self.n_bundles += 1
+                        # the next simulation collects the next bundle
+                        self._cond.notify_all()
+                        break
+                    self._cond.wait(self.wait - waited)
+                else:
+                    self._cond.wait()
+        completed = False
+        try:
+            completed = self._run_bundle([m["chain"] for m in members], name)
+        finally:
+            with self._cond:
+                for m in members:
+                    m["done"] = True
+                    m["completed"] = completed
+                self._cond.notify_all()
+        return completed
+
+    def _run_bundle(self, chains, name):
+        work_dir = os.path.join(self.bundle_dir, name)
+        bundled = simgen.bundle(chains, work_dir)
+        if self.on_cluster:
+            if self.pilot is not None:
+                job = self.pilot.generate_job(work_dir, name)
+            else:
+                job = cluster.ClusterJob(self.batch_system,
+                                         self.batch_template, name, work_dir)
+            job += bundled
+            job.submit()
+            return job.wait() == Status.completed
+        bundled()
+        return True
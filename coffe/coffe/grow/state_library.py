@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""Equilibrated states of previous evaluations, for warm starts of MD chains"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class EquilibratedStateLibrary:
+    """
+    The directories of finished MD chains, indexed by parameter vector.
+
+    A new chain whose parameters are close to those of a finished chain
+    skips the early stages of equilibration: it starts at first_stage from
+    the final structure (confout.gro) and checkpoint (state.cpt) of the
+    preceding stage of the nearest finished chain (see warm_start).
+
+    Entries are appended to a JSON-lines file, so that a continued
+    optimization finds the chains of the aborted run.
+    """
+
+    def __init__(self, path, radius, first_stage=None):
+        """
+        Arguments:
+        path: (string) the index file, created on the first entry
+        radius: (float) chains are only warm-started from neighbours whose
+            parameters differ by at most this fraction (largest relative
+            difference of a parameter)
+        first_stage: (string) name of the first stage that is run in a
+            warm start (default: the last stage before production)
+        """
+        self.path = path
+        self.radius = radius
+        self.first_stage = first_stage
+        self._lock = threading.Lock()
+        self._entries = []
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._entries.append((np.array(entry["x"]), entry["dir"]))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, x, chain_dir):
+        """
+        Adds a finished chain.
+
+        Arguments:
+        x: (list-like) the parameter vector
+        chain_dir: (string) the work_dir of the chain (with a subdirectory
+            per stage)
+        """
+        x = [float(xi) for xi in x]
+        with self._lock:
+            self._entries.append((np.array(x), chain_dir))
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"x": x, "dir": chain_dir}) + "\n")
+
+    def nearest(self, x):
+        """
+        Returns (distance, chain_dir) of the nearest chain, or (inf, None).
+        The distance is the largest relative difference of a parameter.
+        """
+        neighbours = self.neighbours(x)
+        return neighbours[0] if neighbours else (np.inf, None)
+
+    def neighbours(self, x):
+        """
+        Returns the pairs (distance, chain_dir) of all chains, nearest first
+        (see nearest).
+        """
+        x = np.asarray(x, dtype=float)
+        with self._lock:
+            entries = list(self._entries)
+        neighbours = []
+        for y, chain_dir in entries:
+            distance = np.max(np.abs(x - y) / np.maximum(np.abs(y), 1e-12))
+            neighbours.append((distance, chain_dir))
+        return sorted(neighbours, key=lambda neighbour: neighbour[0])
+
+    def warm_start(self, x, stages):
+        """
+        Returns the warm start of a chain (see GmxChainGenerator.generate).
+
+        The neighbours within the radius are tried nearest first. A chain
+        that was warm-started itself has no directories for the stages
+        before its first stage; the final state of its first stage is
+        used instead.
+
+        Arguments:
+        x: (list-like) the parameter vector of the new chain
+        stages: (list) the names of the stages of the chain
+
+        Returns:
+        A triple (index of the first stage, structure, checkpoint or None),
+        or None, if there is no finished chain within the radius.
+        """
+        if self.first_stage is None:
+            first = len(stages) - 2
+        else:
+            first = stages.index(self.first_stage)
+        if first < 1:
+            return None
+        for distance, chain_dir in self.neighbours(x):
+            if distance > self.radius:
+                break
+            for stage in [stages[first - 1], stages[first]]:
+                previous = os.path.join(chain_dir, stage)
+                structure = os.path.join(previous, "confout.gro")
+                if not os.path.isfile(structure):
+                    continue
+                checkpoint = os.path.join(previous, "state.cpt")
+                if not os.path.isfile(checkpoint):
+                    checkpoint = None
+                return first, structure, checkpoint
+        return None
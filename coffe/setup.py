@@ -68,7 +68,7 @@ setup(
     packages=find_packages(),
     entry_points={
         'console_scripts': [
-            'coffe=coffe.cli:main'
+            'coffe=coffe.entry:main'
         ]
     },
     include_package_data=True,
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.amb.prmtop"""
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from coffe.amb.prmtop import AmberPrmtop, read_amber_coordinates
+from coffe.core import pkgdata
+
+PRMTOP = pkgdata.abspath("data/test_prmtop")
+RESTRT = pkgdata.abspath("data/test_restrt")
+
+
+def test_read_write_roundtrip(tmpdir):
+    prmtop = AmberPrmtop(PRMTOP)
+    prmtop.set("LENNARD_JONES_ACOEF", prmtop.get("LENNARD_JONES_ACOEF"))
+    prmtop.set("AMBER_ATOM_TYPE", prmtop.get("AMBER_ATOM_TYPE"))
+    out = str(tmpdir.join("out.prmtop"))
+    prmtop.write(out)
+    with open(PRMTOP) as f, open(out) as g:
+        assert f.read() == g.read()
+
+
+def test_lj_type_parameters():
+    params = AmberPrmtop(PRMTOP).lj_type_parameters()
+    assert sorted(params) == ["c3", "hc"]
+    assert params["c3"][0] == pytest.approx(1.908, abs=1e-6)
+    assert params["c3"][1] == pytest.approx(0.1094, abs=1e-6)
+
+
+def test_set_lj_parameters(tmpdir):
+    prmtop = AmberPrmtop(PRMTOP)
+    acoef = prmtop.get("LENNARD_JONES_ACOEF")
+    # unchanged parameters reproduce the tleap coefficients
+    prmtop.set_lj_parameters({"hc": prmtop.lj_type_parameters()["hc"]})
+    assert prmtop.get("LENNARD_JONES_ACOEF") == pytest.approx(acoef, rel=1e-7)
+
+    prmtop.set_lj_parameters({"hc": (1.5, 0.02)})
+    out = str(tmpdir.join("out.prmtop"))
+    prmtop.write(out)
+    params = AmberPrmtop(out).lj_type_parameters()
+    assert params["hc"] == pytest.approx((1.5, 0.02), rel=1e-6)
+    assert params["c3"] == pytest.approx((1.908, 0.1094), rel=1e-6)
+    # c3-c3 is untouched, the mixed pair follows Lorentz-Berthelot
+    new = AmberPrmtop(out).get("LENNARD_JONES_ACOEF")
+    assert new[0] == acoef[0]
+    assert new[1] == pytest.approx((0.1094 * 0.02)**0.5 * (1.908 + 1.5)**12,
+                                   rel=1e-6)
+
+
+def merged_prmtop():
+    """The test topology with a type ha that shares the type index of hc,
+    like types that tleap merged because of identical parameters."""
+    prmtop = AmberPrmtop(PRMTOP)
+    names = prmtop.get("AMBER_ATOM_TYPE")
+    prmtop.set("AMBER_ATOM_TYPE", names[:1] + ["ha"] + names[2:])
+    return prmtop
+
+
+def test_set_lj_parameters_of_merged_types():
+    prmtop = merged_prmtop()
+    assert prmtop.lj_type_names() == [["c3"], ["ha", "hc"]]
+    with pytest.raises(ValueError):
+        prmtop.set_lj_parameters({"hc": (1.5, 0.02)})
+    with pytest.raises(ValueError):
+        prmtop.set_lj_parameters({"hc": (1.5, 0.02), "ha": (1.4, 0.02)})
+    prmtop.set_lj_parameters({"hc": (1.5, 0.02), "ha": (1.5, 0.02)})
+    assert prmtop.lj_type_parameters()["ha"] == pytest.approx((1.5, 0.02), rel=1e-6)
+
+
+def test_nonbonded_pairs():
+    # the first molecule is a butane
+    i, j, scale = AmberPrmtop(PRMTOP).nonbonded_pairs(range(14))
+    assert (i < j).all()
+    # 91 pairs - 13 bonds - 24 angles; 27 of them are 1-4 pairs
+    assert len(i) == 54
+    assert (scale == 0.5).sum() == 27
+    assert (scale == 1.0).sum() == 27
+
+
+def test_read_amber_coordinates(tmpdir):
+    xyz = read_amber_coordinates(RESTRT)
+    assert xyz.shape == (5026, 3)
+    crd = tmpdir.join("test.crd")
+    lines = ["MOL", "{:6d}".format(3)]
+    values = ["{:12.7f}".format(v) for v in xyz[:3].flatten()]
+    lines += ["".join(values[:6]), "".join(values[6:])]
+    crd.write("\n".join(lines) + "\n")
+    assert read_amber_coordinates(str(crd)) == pytest.approx(xyz[:3], abs=1e-6)
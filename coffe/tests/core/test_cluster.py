@@ -319,3 +319,196 @@ def test_async_delayed_submission(tmpdir):
     shell.touch(initfile)
     p.join()
     assert os.path.exists(testfile)
+
+
+# === Test job watcher ===
+
+def test_wait(tmpdir):
+    c = cluster.ClusterJob(None, None, "noname", work_dir=str(tmpdir))
+    c += "sleep 0.5"
+    c.submit()
+    watcher = cluster.JobWatcher(interval=0.1)
+    event = watcher.watch(c)
+    assert event.wait(10)
+    assert c.status in [cluster.Status.completed, cluster.Status.error]
+    assert len(watcher) == 0
+
+
+def test_wait_many(tmpdir):
+    jobs = []
+    for i in range(5):
+        c = cluster.ClusterJob(None, None, "job{}".format(i),
+                               work_dir=os.path.join(str(tmpdir), str(i)))
+        c += "sleep 0.{}".format(i)
+        c.submit()
+        jobs.append(c)
+    watcher = cluster.JobWatcher(interval=0.1)
+    events = [watcher.watch(c) for c in jobs]
+    for event in events:
+        assert event.wait(10)
+    assert len(watcher) == 0
+
+
+# === Test queue snapshot ===
+
+SQUEUE_OUT = """1234 RUNNING
+1235 PENDING
+1236_3 RUNNING
+1236_[4-9%2] PENDING
+"""
+
+QSTAT_OUT = """
+server.cluster:
+                                                         Req'd  Req'd   Elap
+Job ID          Username Queue  Jobname SessID NDS TSK Memory Time  S Time
+--------------- -------- ------ ------- ------ --- --- ------ ----- - -----
+1234.server     user     batch  job1     4711   1   1    --  01:00 R 00:10
+1235.server     user     batch  job2       --   1   1    --  01:00 Q   --
+"""
+
+
+@pytest.fixture
+def fake_snapshot(monkeypatch):
+    def wrapper(queueing, out):
+        snapshot = cluster.QueueSnapshot(queueing, ttl=100)
+        parse = {"slurm": cluster.parse_squeue, "torque": cluster.parse_qstat}
+        monkeypatch.setattr(snapshot, "_query",
+                            lambda: parse[queueing](out))
+        return snapshot
+    return wrapper
+
+
+def test_parse_squeue():
+    jobs = cluster.parse_squeue(SQUEUE_OUT)
+    assert jobs["1234"] == "RUNNING"
+    assert jobs["1235"] == "PENDING"
+
+
+def test_parse_qstat():
+    jobs = cluster.parse_qstat(QSTAT_OUT)
+    assert jobs == {"1234": "RUNNING", "1235": "PENDING"}
+
+
+def test_snapshot_state(fake_snapshot):
+    snapshot = fake_snapshot("slurm", SQUEUE_OUT)
+    assert snapshot.state(1234) == "RUNNING"
+    assert snapshot.state(1235) == "PENDING"
+    assert snapshot.state(1236) == "RUNNING"
+    assert snapshot.state(1237) is None
+    assert snapshot.is_active(1235)
+    assert not snapshot.is_active(1237)
+
+
+def test_snapshot_is_cached(fake_snapshot):
+    snapshot = fake_snapshot("slurm", SQUEUE_OUT)
+    calls = []
+    query = snapshot._query
+    snapshot._query = lambda: calls.append(1) or query()
+    for _ in range(10):
+        snapshot.is_active(1234)
+    assert len(calls) == 1
+    snapshot.invalidate()
+    snapshot.is_active(1234)
+    assert len(calls) == 2
+
+
+def test_snapshot_query_failed(fake_snapshot):
+    snapshot = fake_snapshot("slurm", "")
+    snapshot._query = lambda: None
+    assert snapshot.is_active(1)
+    assert snapshot.state(1) is None
+
+
+# === Test job arrays ===
+
+
+def test_parse_squeue_array_range():
+    jobs = cluster.parse_squeue("1236_[4-6,9%2] PENDING\n")
+    assert sorted(jobs) == ["1236_4", "1236_5", "1236_6", "1236_9"]
+
+
+def test_array_script(tmpdir):
+    array = cluster.ClusterJobArray(None, None, "array", work_dir=str(tmpdir),
+                                    max_parallel=2)
+    for i in range(3):
+        task = array.add_task("task{}".format(i), "task{}".format(i))
+        task += "touch out{}".format(i)
+    assert len(array) == 3
+    assert array.status == cluster.Status.not_written
+    with pytest.raises(cluster.ClusterError):
+        array += "echo"
+    array.write_script()
+    assert array.status == cluster.Status.not_submitted
+    with open(array.script) as f:
+        script = f.read()
+    assert "# array: 0-2%2" in script
+    assert "case $1 in" in script
+    for i in range(3):
+        assert "touch out{}".format(i) in script
+        assert array[i].status_file in script
+    with pytest.raises(cluster.ClusterError):
+        array.add_task("task3")
+    with pytest.raises(cluster.ClusterError):
+        array[0].submit()
+
+
+def test_array_local(tmpdir):
+    generator = cluster.ClusterJobGenerator(None, None, root_dir=str(tmpdir))
+    array = generator.generate_array("array", "array", max_parallel=2)
+    for i in range(3):
+        task = array.add_task("task{}".format(i), "task{}".format(i))
+        task += "touch out{}".format(i)
+    array.submit()
+    assert all(task.job_id == array.job_id for task in array)
+    array.wait(timeout=20)
+    for i, task in enumerate(array):
+        assert task.status in [cluster.Status.completed, cluster.Status.error]
+        assert os.path.isfile(os.path.join(task.work_dir, "out{}".format(i)))
+
+
+# === Local scheduler ===
+
+
+def test_local_scheduler(tmpdir):
+    scheduler = cluster.LocalScheduler(n_cores=4, interval=0.05)
+    processes = []
+    for i in range(3):
+        # each job writes its cores and waits for a file
+        cmd = ("echo $COFFE_PINOFFSET $COFFE_NTOMP > {0}/cores{1}.txt; "
+               "while ! [ -e {0}/go ]; do sleep 0.05; done".format(tmpdir, i))
+        processes.append(scheduler.submit(os.system, (cmd,), 2))
+    time.sleep(1.0)
+    # only two jobs fit
+    assert [p.process is not None for p in processes] == [True, True, False]
+    assert processes[2].is_alive()
+    assert scheduler.free_cores == 0
+    shell.touch(os.path.join(str(tmpdir), "go"))
+    for p in processes:
+        p.join(10)
+    offsets = []
+    for i in range(3):
+        with open(os.path.join(str(tmpdir), "cores{}.txt".format(i))) as f:
+            offset, n = f.read().split()
+        assert n == "2"
+        offsets.append(int(offset))
+    assert sorted(offsets[:2]) == [0, 2]
+    time.sleep(0.2)
+    assert scheduler.free_cores == 4
+
+
+def test_local_jobs_with_cores(tmpdir):
+    jobs = []
+    for i in range(2):
+        work_dir = os.path.join(str(tmpdir), str(i))
+        c = cluster.ClusterJob(None, None, "job", work_dir=work_dir,
+                               n_cores=cluster.local_scheduler().n_cores)
+        c += "sleep 0.5; touch done"
+        c.submit()
+        jobs.append(c)
+    # the second job waits for the cores of the first one
+    assert jobs[1].status == cluster.Status.queueing
+    jobs[1].kill()
+    assert not jobs[1].local_process.is_alive()
+    jobs[0].local_process.join()
+    assert os.path.isfile(os.path.join(jobs[0].work_dir, "done"))
+    assert not os.path.isfile(os.path.join(jobs[1].work_dir, "done"))
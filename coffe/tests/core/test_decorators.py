@@ -58,3 +58,51 @@ def test_none_not_overrides():
 
 def test_failure():
     pass
+
+
+def test_config_cache(tmpdir):
+    cfg = tmpdir.join("cache.cfg")
+    cfg.write("[test]\narg1 = [1, 2]\narg2 = 'a'\narg3 = 1e-4\n")
+    first = decorators.read_config(str(cfg))
+    assert decorators.read_config(str(cfg)) is first
+    assert some_function(cfg_file=str(cfg), section="test") == [[1, 2], "a", 1e-4]
+    # the cached values can not be changed through the returned options
+    first.options("test")["arg1"].append(3)
+    assert some_function(cfg_file=str(cfg), section="test")[0] == [1, 2]
+
+    cfg.write("[test]\narg1 = 1\narg2 = 2\narg3 = 3\narg4 = 4\n")
+    mtime = cfg.mtime()
+    cfg.setmtime(mtime + 10)
+    assert decorators.read_config(str(cfg)) is not first
+    assert A(cfg_file=str(cfg), section="test").args == [1, 2, 3, 4, None]
+
+
+def test_no_eval(tmpdir):
+    cfg = tmpdir.join("eval.cfg")
+    cfg.write("[test]\narg1 = __import__('os').getcwd()\narg2 = 1\narg3 = 2\n"
+              "[other]\narg1 = 1\narg2 = 2\narg3 = 3\n")
+    with pytest.raises(decorators.ConfigError):
+        some_function(cfg_file=str(cfg), section="test")
+    # other sections are not affected
+    assert some_function(cfg_file=str(cfg), section="other") == [1, 2, 3]
+
+
+def test_schema(tmpdir, monkeypatch):
+    monkeypatch.setattr(decorators, "_SCHEMAS", {})
+    cfg = tmpdir.join("schema.cfg")
+    cfg.write("[schema]\narg1 = 1.0\narg2 = [1, 2]\narg3 = 'x'\n")
+    decorators.register_schema("schema", {"arg1": int, "arg2": tuple})
+    assert some_function(cfg_file=str(cfg), section="schema") == [1, (1, 2), "x"]
+    decorators.register_schema("schema", {"arg3": int})
+    with pytest.raises(decorators.ConfigError):
+        some_function(cfg_file=str(cfg), section="schema")
+
+
+def test_snapshot(tmpdir):
+    import pickle
+    cfg = tmpdir.join("snapshot.cfg")
+    cfg.write("[test]\narg1 = 1\narg2 = 2\narg3 = XXX\n")
+    snapshot = pickle.loads(pickle.dumps(decorators.read_config(str(cfg))))
+    cfg.remove()
+    # snapshots do not read the file again
+    assert some_function(cfg_file=snapshot, section="test", arg3=3) == [1, 2, 3]
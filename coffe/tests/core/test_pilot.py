@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.core.pilot"""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import os
+
+import pytest
+
+from coffe.core import pilot
+from coffe.core.status import Status
+
+
+class WriteFile(object):
+    """A callable class, as run by coffe run-class."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self):
+        with open(self.filename, "w") as f:
+            f.write("done")
+
+
+@pytest.fixture
+def pool_and_worker(tmpdir):
+    pool = pilot.PilotPool(n_workers=0, work_dir=str(tmpdir.join("pool")))
+    worker = multiprocessing.Process(target=pilot.run_worker,
+                                     args=(pool.work_dir,),
+                                     kwargs={"idle_timeout": 30,
+                                             "poll_interval": 0.05})
+    worker.start()
+    yield pool, str(tmpdir)
+    pool.shutdown()
+    worker.join(10)
+    assert not worker.is_alive()
+
+
+def test_pilot_jobs(pool_and_worker):
+    pool, tmp = pool_and_worker
+    jobs = []
+    for i in range(3):
+        job = pool.generate_job(os.path.join(tmp, "job{}".format(i)))
+        job += "echo {} > out.txt".format(i)
+        job += WriteFile(os.path.join(tmp, "job{}".format(i), "class.txt"))
+        job.submit()
+        jobs.append(job)
+    for i, job in enumerate(jobs):
+        assert job.wait(timeout=30) == Status.completed
+        with open(os.path.join(job.work_dir, "out.txt")) as f:
+            assert f.read().strip() == str(i)
+        assert os.path.isfile(os.path.join(job.work_dir, "class.txt"))
+    assert not os.listdir(os.path.join(pool.work_dir, "pending"))
+
+
+def test_pilot_job_error(pool_and_worker):
+    pool, tmp = pool_and_worker
+    job = pool.generate_job(os.path.join(tmp, "job"))
+    job += "false"
+    job += "echo still running > out.txt"
+    job.submit()
+    assert job.wait(timeout=30) == Status.error
+    # like in batch scripts, the remaining commands are run
+    assert os.path.isfile(os.path.join(job.work_dir, "out.txt"))
+
+
+def test_pilot_job_without_workers(tmpdir):
+    pool = pilot.PilotPool(n_workers=0, work_dir=str(tmpdir.join("pool")))
+    job = pool.generate_job(str(tmpdir.join("job")))
+    job += "echo 1"
+    job.submit()
+    # nobody will run the task
+    assert job.status == Status.error
+    job = pool.generate_job(str(tmpdir.join("job2")))
+    job += "echo 1"
+    job.submit()
+    job.kill()
+    assert not os.listdir(os.path.join(pool.work_dir, "pending"))
+
+
+def test_workers_resubmitted_for_pending_task(tmpdir, monkeypatch):
+    pool = pilot.PilotPool(n_workers=1, work_dir=str(tmpdir.join("pool")))
+    submitted = []
+
+    class Workers(object):
+        status = Status.queueing
+
+    def ensure_workers():
+        submitted.append(True)
+        pool.workers = Workers()
+
+    monkeypatch.setattr(pool, "ensure_workers", ensure_workers)
+    job = pool.generate_job(str(tmpdir.join("job")))
+    job += "echo 1"
+    job.submit()
+    assert len(submitted) == 1
+    # the workers have exited without taking the task
+    pool.workers = None
+    assert job.status == Status.queueing
+    assert len(submitted) == 2
+
+
+def test_killed_task_keeps_error_status(tmpdir):
+    pool = pilot.PilotPool(n_workers=0, work_dir=str(tmpdir.join("pool")))
+    job = pool.generate_job(str(tmpdir.join("job")))
+    job += WriteFile(str(tmpdir.join("job", "class.txt")))
+    job.write_script()
+    job.status = 42
+    task_file = job.script
+    job.status = Status.error
+    # killed after a worker has claimed the task
+    pilot._run_task(task_file)
+    assert not os.path.isfile(str(tmpdir.join("job", "class.txt")))
+    assert job.status == Status.error
+
+
+class Kill(object):
+    """Kills its own job while it is run."""
+
+    def __init__(self, status_file):
+        self.status_file = status_file
+
+    def __call__(self):
+        Status.write(self.status_file, Status.error)
+
+
+def test_task_killed_while_running(tmpdir):
+    pool = pilot.PilotPool(n_workers=0, work_dir=str(tmpdir.join("pool")))
+    job = pool.generate_job(str(tmpdir.join("job")))
+    job += Kill(job.status_file)
+    job += WriteFile(str(tmpdir.join("job", "class.txt")))
+    job.write_script()
+    job.status = 42
+    pilot._run_task(job.script)
+    # the task is completed, but the job keeps the status error
+    assert os.path.isfile(str(tmpdir.join("job", "class.txt")))
+    assert job.status == Status.error
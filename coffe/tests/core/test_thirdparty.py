@@ -4,6 +4,8 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+
 from coffe.core import thirdparty
 from coffe.core.thirdparty import *
 import pytest
@@ -79,3 +81,40 @@ def test_print_function():
 
 def test_pymol_program_opt():
     assert PYMOL.options == "-c"
+
+
+def test_lazy_probing(monkeypatch):
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("The program was probed.")
+    monkeypatch.setattr(thirdparty.subprocess, "Popen", no_subprocess)
+    Requirement("Fischifischifisch", "fischifischifisch")
+
+
+@pytest.fixture
+def fake_program(tmpdir, monkeypatch):
+    monkeypatch.setitem(thirdparty.CONFIG._options, "thirdparty_cache",
+                        str(tmpdir.join("cache", "thirdparty.json")))
+    program = tmpdir.join("fake_program")
+    program.write("#!/bin/sh\necho probed >> {}\necho 'Fake 1.2.3'\n".format(
+        tmpdir.join("calls.txt")))
+    program.chmod(0o755)
+    return str(program), tmpdir.join("calls.txt")
+
+
+def test_version_cache(fake_program):
+    program, calls = fake_program
+    for _ in range(3):
+        fake = Requirement("Fake", program,
+                           version_parser=lambda x: x.split()[1])
+        assert fake.version == "1.2.3"
+        assert fake.exists
+    assert len(calls.readlines()) == 1
+
+
+def test_version_cache_modified_program(fake_program):
+    program, calls = fake_program
+    assert Requirement("Fake", program).exists
+    mtime = os.path.getmtime(program)
+    os.utime(program, (mtime + 10, mtime + 10))
+    assert Requirement("Fake", program).exists
+    assert len(calls.readlines()) == 2
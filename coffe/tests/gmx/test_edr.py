@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.gmx.edr"""
+
+from __future__ import absolute_import, division, print_function
+
+import struct
+
+import numpy as np
+import pytest
+
+from coffe.gmx import edr
+
+TERMS = [("Potential", "kJ/mol"), ("Temperature", "K"), ("Density", "kg/m^3")]
+
+
+def _string(s):
+    s = s.encode("ascii")
+    return struct.pack(">I", len(s)) + s + b"\0" * ((-len(s)) % 4)
+
+
+def _header(terms=TERMS):
+    data = struct.pack(">iii", edr.HEADER_MAGIC, edr.ENX_VERSION, len(terms))
+    for name, unit in terms:
+        data += _string(name) + _string(unit)
+    return data
+
+
+def _frame(t, step, energies, real=">f4", nsum=10, block=None):
+    """An energy frame as written by gromacs (file version 5)."""
+    data = np.array([-2e10], dtype=real).tobytes()
+    data += struct.pack(">iidqi", edr.FRAME_MAGIC, edr.ENX_VERSION, t, step, nsum)
+    data += struct.pack(">qd", 10, 0.002)
+    data += struct.pack(">iii", len(energies), 0, 0 if block is None else 1)
+    if block is not None:
+        # block id, number of subblocks, and type (double) and size of each subblock
+        data += struct.pack(">iiiiii", 7, 2, 2, len(block), 0, 1)
+    data += struct.pack(">iii", 0, 0, 0)
+    if nsum > 0:
+        values = np.column_stack([energies, np.ones(len(energies)), np.zeros(len(energies))])
+    else:
+        values = np.array(energies)
+    data += np.asarray(values, dtype=real).tobytes()
+    if block is not None:
+        # only the values of the subblocks follow the energies
+        data += np.asarray(block, dtype=">f8").tobytes() + struct.pack(">i", 42)
+    return data
+
+
+@pytest.mark.parametrize("real", [">f4", ">f8"])
+def test_read_edr(tmpdir, real):
+    filename = str(tmpdir.join("ener.edr"))
+    with open(filename, "wb") as f:
+        f.write(_header())
+        f.write(_frame(0.0, 0, [-100.0, 300.0, 700.0], real=real, nsum=0))
+        f.write(_frame(0.02, 10, [-101.0, 301.0, 701.5], real=real, block=[1.0, 2.0]))
+        f.write(_frame(0.04, 20, [-102.0, 299.0, 699.5], real=real))
+    values = edr.read_edr(filename, ["Density", "temperature"])
+    assert values.shape == (3, 3)
+    assert np.allclose(values[:, 0], [0.0, 0.02, 0.04])
+    assert np.allclose(values[:, 1], [700.0, 701.5, 699.5])
+    assert np.allclose(values[:, 2], [300.0, 301.0, 299.0])
+    with pytest.raises(KeyError):
+        edr.read_edr(filename, ["Pressure"])
+
+
+def test_tail_growing_file(tmpdir):
+    filename = str(tmpdir.join("ener.edr"))
+    reader = edr.EdrFile(filename)
+    assert reader.update() == 0
+    frames = [_frame(0.02 * i, 10 * i, [-100.0, 300.0, 700.0 + i]) for i in range(4)]
+    data = _header() + b"".join(frames)
+    cut = len(_header()) + len(frames[0]) + 10
+    with open(filename, "wb") as f:
+        f.write(data[:cut])
+    # the second frame is still being written
+    assert reader.update() == 1
+    assert reader.terms == [name for name, unit in TERMS]
+    assert reader.units == [unit for name, unit in TERMS]
+    with open(filename, "ab") as f:
+        f.write(data[cut:])
+    assert reader.update() == 3
+    assert reader.update() == 0
+    assert np.allclose(reader.energies(["Density"])[:, 0], [700.0, 701.0, 702.0, 703.0])
+    # truncated upon a continuation from a checkpoint
+    with open(filename, "wb") as f:
+        f.write(data[:len(_header()) + len(frames[0])])
+    reader.update()
+    assert reader.n_frames == 1
+
+
+def test_not_an_energy_file(tmpdir):
+    filename = str(tmpdir.join("ener.edr"))
+    with open(filename, "wb") as f:
+        f.write(struct.pack(">iii", 3, 0, 0))
+    with pytest.raises(edr.EdrError):
+        edr.read_edr(filename, ["Density"])
@@ -53,3 +53,57 @@ def test_get_densities(tmpdir):
     assert isinstance(df, pd.DataFrame), "Dataframe could not be created!"
     assert len(left_fit) == 4, "Left-hand fit is not a list!"
     assert len(right_fit) == 4, "Right-hand fit is not a list!"
+
+
+def test_block_confidence_interval():
+    import numpy as np
+    np.random.seed(0)
+    values = np.random.normal(700.0, 5.0, size=1000)
+    lower, upper = observables.block_confidence_interval(values)
+    assert lower < 700.0 < upper
+    assert upper - lower < 5.0
+    assert observables.block_confidence_interval([1.0, 2.0]) == (-np.inf, np.inf)
+
+
+def test_statistical_inefficiency():
+    import numpy as np
+    np.random.seed(0)
+    phi = 0.9
+    values = np.zeros(20000)
+    for i in range(1, len(values)):
+        values[i] = phi * values[i - 1] + np.random.normal()
+    # AR(1) process: g = (1 + phi)/(1 - phi) = 19
+    assert 15.0 < observables.statistical_inefficiency(values) < 25.0
+    assert observables.statistical_inefficiency(np.random.normal(size=1000)) < 1.5
+    assert observables.statistical_inefficiency(np.ones(10)) == 1.0
+
+
+def test_equilibrated_mean():
+    import numpy as np
+    np.random.seed(0)
+    values = np.random.normal(700.0, 5.0, size=2000)
+    values[:200] += np.linspace(60.0, 0.0, 200)
+    t0, g, n_eff = observables.detect_equilibration(values)
+    assert 150 <= t0 <= 300
+    mean, sem, t0, g = observables.equilibrated_mean(values)
+    assert abs(mean - 700.0) < 3 * sem
+    assert sem < 0.5
+
+
+def test_fit_density_profiles():
+    import numpy as np
+    np.random.seed(0)
+    z = np.linspace(0.0, 10.0, 200)
+    params = np.array([[700.0 + 5 * i, 5.0, 3.0, 7.0, 0.4] for i in range(5)])
+    profiles = observables.slab_profile(z, params) + np.random.normal(0.0, 3.0, (5, 200))
+    result = observables.fit_density_profiles(z, profiles)
+    assert result["params"].shape == (5, 5)
+    assert np.allclose(result["rho_l"], params[:, 0], atol=3.0)
+    assert np.allclose(result["params"][:, 2:], params[:, 2:], atol=0.1)
+    assert abs(result["rho_l_mean"] - 710.0) < 3 * result["rho_l_error"] + 1.0
+    assert abs(result["rho_v_mean"] - 5.0) < 2.0
+    # vapour in the middle of the box
+    profile = observables.slab_profile(z, [5.0, 700.0, 3.0, 7.0, 0.4])
+    result = observables.fit_density_profiles(z, profile)
+    assert abs(result["rho_l_mean"] - 700.0) < 1.0
+    assert np.isnan(result["rho_l_error"])
@@ -177,3 +177,18 @@ def test_gmx_checkpoint_otherdir(gsim):
                )
     assert get_start_time(sim2) == 0.0
     assert not is_restarted(sim2)
+
+
+def test_gmx_early_stopping_should_stop(gsim):
+    gs, wd = gsim
+    s = pkgdata.abspath("data/test_structure.pdb")
+    t = pkgdata.abspath("data/test_topology.top")
+    mdp = pkgdata.abspath("data/test_mdp.mdp")
+    sim = gmxsim.GmxCalculationEarlyStopping(s, t, mdp, wd, acceptable=(690.0, 710.0))
+    values = [500.0 + (i % 3) for i in range(100)]
+    assert sim.should_stop(values)
+    assert not sim.should_stop([700.0 + (i % 3) for i in range(100)])
+    # too few values to be certain
+    assert not sim.should_stop([500.0, 501.0])
+    sim.acceptable = None
+    assert not sim.should_stop(values)
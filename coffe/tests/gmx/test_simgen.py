@@ -102,6 +102,33 @@ def test_no_start_from_checkpoint(generated_emin_cc):
     assert cc[1].checkpoint is None
 
 
+def test_generate_bundle(make_emin_chain):
+    mdp = pkgdata.abspath("data/test_mdp.mdp")
+    s = pkgdata.abspath("data/test_structure.pdb")
+    top = pkgdata.abspath("data/test_topology.top")
+    gen, tmp = make_emin_chain(mdp)
+    members = [os.path.join(tmp, "a"), os.path.join(tmp, "b")]
+    cc = gen.generate_bundle(os.path.join(tmp, "bundle"), members, s, [top, top])
+    assert len(cc) == 3
+    for stage, name in zip(cc, ["emin1", "emin2", "emin3"]):
+        assert isinstance(stage, sim.GmxMultiCalculation)
+        assert [calc.work_dir for calc in stage.calculations] == \
+            [os.path.join(m, name) for m in members]
+
+
+
+def test_generate_warm_start(make_emin_chain):
+    mdp = pkgdata.abspath("data/test_mdp.mdp")
+    s = pkgdata.abspath("data/test_structure.pdb")
+    top = pkgdata.abspath("data/test_topology.top")
+    gen, tmp = make_emin_chain(mdp)
+    cc = gen.generate(work_dir=os.path.join(tmp, "warm"), structure=s, topology=top,
+                      warm_start=(2, s, None))
+    assert len(cc) == 1
+    assert cc[0].structure == s
+    assert os.path.basename(cc[0].work_dir) == "emin3"
+
+
 
 # TODO(AK) test for relative paths  ---> this applies for pretty much everything else as well :-/
 # TODO(AK) Write a tmppath fixture that tests relative and absolute paths
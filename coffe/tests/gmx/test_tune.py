@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.gmx.tune"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import pytest
+
+from coffe.core import pkgdata, thirdparty
+from coffe.gmx import tune
+
+
+def test_benchmark_grid():
+    grid = tune.benchmark_grid(4, npme=(-1, 1), nstlist=(None, 40))
+    assert all(s["ntmpi"] * s["ntomp"] == 4 for s in grid)
+    assert sorted(set(s["ntmpi"] for s in grid)) == [1, 2, 4]
+    # a single rank cannot have a separate PME rank
+    assert not [s for s in grid if s["ntmpi"] == 1 and s["npme"] == 1]
+    assert len(grid) == 2 + 4 + 4
+
+
+def test_tuned_command():
+    setting = {"ntmpi": 2, "ntomp": 4, "npme": -1, "nstlist": 40}
+    assert tune.tuned_command("gmx mdrun -nt 8 -pin on -v", setting) == \
+        "gmx mdrun -pin on -v -ntmpi 2 -ntomp 4 -npme -1 -nstlist 40"
+    assert tune.tuned_command("gmx mdrun", None) == "gmx mdrun"
+
+
+def test_parse_performance(tmpdir):
+    log = tmpdir.join("md.log")
+    log.write("               (ns/day)    (hour/ns)\n"
+              "Performance:      123.456        0.194\n")
+    assert tune.parse_performance(str(log)) == pytest.approx(123.456)
+    tmpdir.join("failed.log").write("Fatal error\n")
+    assert tune.parse_performance(str(tmpdir.join("failed.log"))) is None
+
+
+def test_system_key(tmpdir):
+    top = tmpdir.join("topol.top")
+    top.write("[ atomtypes ]\nOW 15.9994 0.0 A 0.315 0.636\n"
+              "[ molecules ]\n; name count\nSOL 1\n")
+    mdp = tmpdir.join("md.mdp")
+    mdp.write("integrator = md\nnsteps = 100\nref_t = 300\n")
+    gro1 = tmpdir.join("a.gro")
+    gro1.write("title\n1\n    1SOL     OW    1   0.126   1.624   1.679\n"
+               "   3.00000   3.00000   3.00000\n")
+    gro2 = tmpdir.join("b.gro")
+    gro2.write("title\n1\n    1SOL     OW    1   0.500   0.500   0.500\n"
+               "   3.12000   3.12000   3.12000\n")
+    key = tune.system_key(str(gro1), str(top), str(mdp))
+    # similar box, other coordinates
+    assert tune.system_key(str(gro2), str(top), str(mdp)) == key
+    # other parameter values, run length, and temperature
+    top.write("[ atomtypes ]\nOW 15.9994 0.0 A 0.320 0.700\n"
+              "[ molecules ]\n; name count\nSOL 1\n")
+    mdp.write("integrator = md\nnsteps = 5000\nref_t = 320\n")
+    assert tune.system_key(str(gro1), str(top), str(mdp)) == key
+    # run-control options
+    mdp.write("integrator = md\nnsteps = 100\nref_t = 300\nrvdw = 1.2\n")
+    assert tune.system_key(str(gro1), str(top), str(mdp)) != key
+    # composition
+    mdp.write("integrator = md\nnsteps = 100\nref_t = 300\n")
+    top.write("[ molecules ]\nSOL 2\n")
+    assert tune.system_key(str(gro1), str(top), str(mdp)) != key
+
+
+def test_is_dynamics(tmpdir):
+    mdp = tmpdir.join("em.mdp")
+    mdp.write("integrator = steep ; minimization\n")
+    assert not tune.is_dynamics(str(mdp))
+    mdp.write("nsteps = 100\n")
+    assert tune.is_dynamics(str(mdp))
+
+
+def test_tune_cache(tmpdir, monkeypatch):
+    monkeypatch.setitem(tune.CONFIG._options, "mdrun_tune_cache",
+                        str(tmpdir.join("cache", "tune.json")))
+    assert tune._read_tune_cache() == {}
+    tune._write_tune_cache("a|b", {"ntmpi": 1, "ntomp": 2})
+    assert tune._read_tune_cache() == {"a|b": {"ntmpi": 1, "ntomp": 2}}
+
+
+def test_autotune_reads_cache_under_lock(tmpdir, monkeypatch):
+    monkeypatch.setitem(tune.CONFIG._options, "mdrun_tune_cache",
+                        str(tmpdir.join("tune.json")))
+    gro = tmpdir.join("conf.gro")
+    gro.write("title\n1\n    1SOL     OW    1   0.126   1.624   1.679\n"
+              "   3.00000   3.00000   3.00000\n")
+    top = tmpdir.join("topol.top")
+    top.write("[ molecules ]\nSOL 1\n")
+    mdp = tmpdir.join("md.mdp")
+    mdp.write("integrator = md\n")
+    monkeypatch.setattr(tune, "hardware_fingerprint", lambda n_cores: "node")
+    key = tune.system_key(str(gro), str(top), str(mdp)) + "|node"
+    tune._write_tune_cache(key, {"ntmpi": 1, "ntomp": 2})
+    monkeypatch.setattr(tune, "MdrunTuner", None)  # no benchmarks
+    setting = tune.autotune(str(gro), str(top), str(mdp), "topol.tpr",
+                            str(tmpdir.join("tune")), command="gmx mdrun -nt 2")
+    assert setting == {"ntmpi": 1, "ntomp": 2}
+    assert os.path.isfile(str(tmpdir.join("tune.json.lock")))
+
+
+@pytest.mark.skipif(not thirdparty.GROMACS.exists,
+                    reason="requires gmx")
+def test_autotune(tmpdir, monkeypatch):
+    from coffe.gmx.sim import GmxCalculation
+    monkeypatch.setitem(tune.CONFIG._options, "mdrun_tune_cache",
+                        str(tmpdir.join("tune.json")))
+    s = pkgdata.abspath("../gmx/data/test_structure.pdb")
+    t = pkgdata.abspath("../gmx/data/test_topology.top")
+    mdp = pkgdata.abspath("../gmx/data/test_mdp.mdp")
+    sim = GmxCalculation(s, t, mdp, str(tmpdir.join("sim")))
+    setting = tune.autotune(sim.structure, sim.topology, sim.mdp_file,
+                            sim.abspath("topol.tpr"), str(tmpdir.join("tune")),
+                            command="gmx mdrun -nt 2")
+    assert setting["ntmpi"] * setting["ntomp"] == 2
+    assert len(tune._read_tune_cache()) == 1
@@ -167,3 +167,13 @@ def test_set_and_read_mdp_option_newfile(tmpdir):
     gmxutil.set_mdp_options(pkgdata.abspath("data/test_mdp.mdp"), options, new_file=mdp)
     for key in options:
         assert gmxutil.read_mdp_option(mdp, key) == str(options[key])
+
+
+def test_mdrun_command(monkeypatch):
+    command = "gmx mdrun -nt 16 -pin off -v"
+    monkeypatch.delenv("COFFE_NTOMP", raising=False)
+    assert gmxutil.mdrun_command(command) == command
+    monkeypatch.setenv("COFFE_NTOMP", "4")
+    monkeypatch.setenv("COFFE_PINOFFSET", "8")
+    assert gmxutil.mdrun_command(command) == \
+        "gmx mdrun -v -nt 4 -pin on -pinoffset 8"
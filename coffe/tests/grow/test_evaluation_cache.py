@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.evaluation_cache"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+
+from coffe.grow.evaluation_cache import EvaluationCache
+
+
+def test_put_get(tmpdir):
+    cache = EvaluationCache(os.path.join(str(tmpdir), "cache.sqlite"))
+    key = cache.make_key([0.1, 0.2])
+    assert cache.get(key, "md") is None
+    cache.put(key, "md", [701.5])
+    cache.put(key, "mm", [1.0, 2.0])
+    assert cache.get(key, "md") == [701.5]
+    assert cache.get(key, "mm") == [1.0, 2.0]
+    # the store is persistent and can be shared
+    other = EvaluationCache(cache.path)
+    assert other.get(key, "md") == [701.5]
+
+
+def test_key(tmpdir):
+    cache = EvaluationCache(os.path.join(str(tmpdir), "cache.sqlite"),
+                            decimals=6)
+    f = os.path.join(str(tmpdir), "topol.top")
+    with open(f, "w") as fp:
+        fp.write("abc")
+    key = cache.make_key([0.1, 0.2], [f])
+    assert key == cache.make_key([0.1 + 1e-9, 0.2], [f])
+    assert key != cache.make_key([0.1, 0.2])
+    assert key != cache.make_key([0.1, 0.21], [f])
+    assert key != cache.make_key([0.1, 0.2], [f], ["content"])
+    other = EvaluationCache(cache.path, decimals=6)
+    with open(f, "w") as fp:
+        fp.write("abd")
+    assert key != other.make_key([0.1, 0.2], [f])
+
+
+def test_eviction(tmpdir):
+    path = os.path.join(str(tmpdir), "cache.sqlite")
+    cache = EvaluationCache(path, max_entries=2)
+    for i in range(3):
+        cache.put(str(i), "md", [i])
+        time.sleep(0.01)
+    assert len(cache) == 2
+    assert cache.get("0", "md") is None
+    EvaluationCache(path, max_age=0)
+    assert len(cache) == 0
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.gp_model"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+
+from coffe.grow.gp_model import IncrementalGP
+
+
+def kernel():
+    return (RBF(length_scale=[1, 1], length_scale_bounds=(1e-1, 0.9e1)) +
+            WhiteKernel(noise_level=1e-3, noise_level_bounds=(1e-4, 5e-3)))
+
+
+def data(n):
+    X = np.random.uniform(0, 10, size=(n, 2))
+    return X, np.sin(X).sum(axis=1)
+
+
+def test_incremental_matches_full_fit():
+    np.random.seed(0)
+    X, Y = data(30)
+    gp = IncrementalGP(kernel(), n_restarts=0, refit_every=100, lml_drift=np.inf)
+    gp.fit(X[:20], Y[:20])
+    # new observations in the middle, old ones in a different order
+    order = list(range(25, 30)) + list(range(20)) + list(range(20, 25))
+    gp.fit(X[order], Y[order])
+    assert gp._updates == 1
+    assert len(gp.y_train_) == 30
+
+    reference = GaussianProcessRegressor(kernel=gp.kernel_, optimizer=None)
+    reference.fit(gp.X_train_, gp.y_train_)
+    X_test, _ = data(10)
+    mean, std = gp.predict(X_test, return_std=True)
+    ref_mean, ref_std = reference.predict(X_test, return_std=True)
+    assert mean == pytest.approx(ref_mean, rel=1e-6, abs=1e-8)
+    assert std == pytest.approx(ref_std, rel=1e-6, abs=1e-8)
+    assert gp.log_marginal_likelihood() == pytest.approx(
+        reference.log_marginal_likelihood_value_)
+
+
+def test_refit_every():
+    np.random.seed(1)
+    X, Y = data(12)
+    gp = IncrementalGP(kernel(), n_restarts=0, refit_every=2, lml_drift=np.inf)
+    gp.fit(X[:8], Y[:8])
+    gp.fit(X[:10], Y[:10])
+    assert gp._updates == 1
+    gp.fit(X, Y)
+    assert gp._updates == 0
+    # refitting with the same data does nothing
+    gp.fit(X, Y)
+    assert gp._updates == 0
+
+
+def test_refit_with_duplicates():
+    np.random.seed(3)
+    X, Y = data(5)
+    X = np.vstack([X, X[2]])
+    Y = np.append(Y, Y[2])
+    gp = IncrementalGP(kernel(), n_restarts=0, refit_every=100, lml_drift=np.inf)
+    gp.fit(X, Y)
+    for i in range(3):
+        gp.fit(X, Y)
+        assert len(gp.y_train_) == 6
+    # a third observation of the same point is added once
+    gp.fit(np.vstack([X, X[2]]), np.append(Y, Y[2]))
+    assert len(gp.y_train_) == 7
+    assert gp._updates == 1
+
+
+def test_changed_observation_refactorizes():
+    np.random.seed(2)
+    X, Y = data(10)
+    gp = IncrementalGP(kernel(), n_restarts=0)
+    gp.fit(X, Y)
+    Y[3] += 1.0
+    gp.fit(X, Y)
+    assert gp.y_train_[3] == Y[3]
+
+
+def test_changed_observation_resets_refit_baseline():
+    np.random.seed(4)
+    X, Y = data(12)
+    gp = IncrementalGP(kernel(), n_restarts=0, refit_every=3, lml_drift=0.5)
+    gp.fit(X[:8], Y[:8])
+    gp.fit(X[:10], Y[:10])
+    assert gp._updates == 1
+    kernel_ = gp.kernel_
+    # fantasies replaced by real results
+    Y[:10] += 5.0
+    gp.fit(X[:10], Y[:10])
+    assert gp.kernel_ is kernel_
+    assert gp._updates == 0
+    assert gp._lml_at_refit == pytest.approx(gp.log_marginal_likelihood() / 10)
+    # the drift of the next update is measured from the changed data
+    gp.fit(X[:11], Y[:11])
+    assert gp._updates == 1
+
+
+def test_restarts_in_process_pool():
+    np.random.seed(3)
+    X, Y = data(15)
+    gp = IncrementalGP(kernel(), n_restarts=2, n_jobs=2)
+    gp.fit(X, Y)
+    mean = gp.predict(X)
+    assert mean == pytest.approx(Y, abs=0.1)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.grow_sander_ff_opt"""
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from coffe.grow import grow_sander_ff_opt
+
+
+def test_template_lj_parameters(tmpdir):
+    template = tmpdir.join("ExTrM.template.dat")
+    template.write("MASS\nCX  12.01\n\nNONBON\n"
+                   "  CX          <X_1>  <X_3>             OPLS\n"
+                   "  HC          <X_2>  <X_4>             Lipid14\n"
+                   "  OS          1.6837  0.1700\n\nEND\n")
+    params = grow_sander_ff_opt.amber_lj_parameters([0.35, 0.25, 0.276, 0.125])
+    lj = grow_sander_ff_opt.template_lj_parameters(str(template), params)
+    assert lj == {"CX": (params[0], params[2]), "HC": (params[1], params[3])}
+    assert params[0] == pytest.approx(3.5 * 2**(1.0/6.0) / 2)
+    assert params[2] == pytest.approx(0.276 / 4.184)
+
+
+def test_get_amber_energy(tmpdir):
+    out = tmpdir.join("molecule-1.min.out")
+    out.write("header\n                    FINAL RESULTS\n\n\n"
+              "   NSTEP       ENERGY          RMS            GMAX\n"
+              "    120      -1.2345E+01     9.1E-03     3.4E-02     C1\n\n"
+              " BOND    =        0.1234  ANGLE   =        1.2345\n")
+    line = grow_sander_ff_opt.GET_AMBER_ENERGY(str(out), "molecule-1")
+    assert line == "molecule-1 -1.2345E+01"
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.journal"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from coffe.grow.journal import EvaluationJournal
+
+
+def test_replay(tmpdir):
+    journal = EvaluationJournal(os.path.join(str(tmpdir), "journal.jsonl"))
+    assert not journal.exists()
+    assert journal.replay() == []
+    journal.submitted(1, [0.3, 0.4])
+    journal.submitted(0, [0.1, 0.2])
+    journal.completed(0, 0.5)
+    journal.submitted(2, [0.5, 0.6])
+    journal.failed(2)
+    assert journal.replay() == [
+        (0, [0.1, 0.2], 0.5, EvaluationJournal.COMPLETED),
+        (1, [0.3, 0.4], -1, EvaluationJournal.SUBMITTED),
+        (2, [0.5, 0.6], -1, EvaluationJournal.FAILED)]
+
+
+def test_replay_after_crash(tmpdir):
+    filename = os.path.join(str(tmpdir), "journal.jsonl")
+    journal = EvaluationJournal(filename)
+    journal.submitted(0, [0.1])
+    # a crash while the completion was being written
+    with open(filename, "a") as f:
+        f.write('{"event": "compl')
+    assert journal.replay() == [(0, [0.1], -1, EvaluationJournal.SUBMITTED)]
+
+    # a restarted run does not continue the broken line
+    journal = EvaluationJournal(filename)
+    journal.completed(0, 0.5)
+    assert journal.replay() == [(0, [0.1], 0.5, EvaluationJournal.COMPLETED)]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.lj_decomposition"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+
+from coffe.amb.prmtop import AmberPrmtop, read_amber_coordinates
+from coffe.grow.lj_decomposition import LJDecomposition
+from tests.amb.test_prmtop import PRMTOP, RESTRT, merged_prmtop
+
+BUTANE = range(14)
+
+
+def conformers(n):
+    xyz = read_amber_coordinates(RESTRT)[:14]
+    return [xyz + np.random.normal(0, 0.05, size=xyz.shape) for _ in range(n)]
+
+
+def lj_energy(prmtop, xyz):
+    """Direct sum over the atom pairs of the butane."""
+    i, j, scale = prmtop.nonbonded_pairs(BUTANE)
+    types = np.array(prmtop.get("ATOM_TYPE_INDEX")) - 1
+    index = prmtop._pair_index()[types[i], types[j]]
+    acoef = np.array(prmtop.get("LENNARD_JONES_ACOEF"))[index]
+    bcoef = np.array(prmtop.get("LENNARD_JONES_BCOEF"))[index]
+    r = np.linalg.norm(xyz[i] - xyz[j], axis=1)
+    return (scale * (acoef / r**12 - bcoef / r**6)).sum()
+
+
+def test_energies_match_direct_sum():
+    np.random.seed(0)
+    prmtop = AmberPrmtop(PRMTOP)
+    xyz = conformers(3)
+    reference = [lj_energy(prmtop, x) + 10.0 * k for k, x in enumerate(xyz)]
+    decomposition = LJDecomposition(prmtop, xyz, reference, atoms=BUTANE)
+    assert decomposition.type_pairs.tolist() == [[0, 0], [0, 1], [1, 1]]
+    # the reference parameters reproduce the reference energies
+    assert decomposition.energies({})[0] == pytest.approx(reference)
+
+    params = {"c3": (2.0, 0.12), "hc": (1.4, 0.015)}
+    prmtop.set_lj_parameters(params)
+    expected = [lj_energy(prmtop, x) + 10.0 * k for k, x in enumerate(xyz)]
+    assert decomposition.energies(params)[0] == pytest.approx(expected)
+
+
+def test_vectorized_parameters():
+    np.random.seed(1)
+    decomposition = LJDecomposition(AmberPrmtop(PRMTOP), conformers(4),
+                                    atoms=BUTANE)
+    r, eps = np.linspace(1.3, 1.6, 1000), np.linspace(0.01, 0.03, 1000)
+    E = decomposition.relative_energies({"hc": (r, eps)})
+    assert E.shape == (1000, 4)
+    assert (E[:, 0] == 0).all()
+    for k in [0, 500, 999]:
+        single = decomposition.relative_energies({"hc": (r[k], eps[k])})
+        assert E[k] == pytest.approx(single[0])
+
+
+def test_merged_types():
+    np.random.seed(2)
+    decomposition = LJDecomposition(merged_prmtop(), conformers(2), atoms=BUTANE)
+    r = np.linspace(1.3, 1.6, 10)
+    with pytest.raises(ValueError):
+        decomposition.energies({"hc": (r, 0.02)})
+    with pytest.raises(ValueError):
+        decomposition.energies({"hc": (r, 0.02), "ha": (r + 0.1, 0.02)})
+    E = decomposition.energies({"hc": (r, 0.02), "ha": (r, 0.02)})
+    assert E.shape == (10, 2)
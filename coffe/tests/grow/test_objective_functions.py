@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.objective_functions"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+
+from coffe.grow.objective_functions import MultiscaleLossFunction
+from tests.amb.test_prmtop import PRMTOP
+
+
+def test_density_window(tmpdir):
+    loss = MultiscaleLossFunction(str(tmpdir))
+    loss.weight_md = 0.5
+    loss.incumbent = 0.1
+    assert loss.density_window() is None
+    loss.early_stopping = True
+    lower, upper = loss.density_window()
+    # densities at the window boundaries give exactly the incumbent
+    for density in [lower, upper]:
+        pploss = ((loss.target_density - density) / loss.target_density)**2
+        assert np.tanh(loss.weight_md * pploss) == pytest.approx(0.1)
+    loss.incumbent = None
+    assert loss.density_window() is None
+
+
+def test_cached_md(tmpdir):
+    from queue import Queue
+    from coffe.grow.evaluation_cache import EvaluationCache
+    from coffe.grow.objective_functions import TopFileTemplate
+    gro = tmpdir.join("conf.gro")
+    gro.write("gro")
+    tmpdir.join("md.mdp").write("mdp")
+    top = tmpdir.join("topol.top.template")
+    top.write("<X_1>")
+
+    loss = MultiscaleLossFunction(str(tmpdir), opt_with_mm=False)
+    loss.weight_md = 0.5
+    loss.mdp_dir = str(tmpdir)
+    loss.mdp_files = ["md.mdp"]
+    loss.gro_file = str(gro)
+    loss.top_template = TopFileTemplate(str(top), "topol.top")
+    loss.eval_cache = EvaluationCache(str(tmpdir.join("cache.sqlite")))
+    loss._store("md", [0.3], [700.0])
+
+    # no simulation is started on a cache hit
+    res_queue = Queue()
+    loss.get_function_value([0.3], 0, res_queue)
+    assert res_queue.get() == (0, [0.3], 0.0)
+
+    # the observables of the evaluation are stored
+    from coffe.grow.observable_store import ObservableStore
+    loss.observables = ObservableStore(str(tmpdir.join("observables")))
+    loss.get_function_value([0.3], 1, res_queue)
+    assert loss.observables.get("x", 1).tolist() == [0.3]
+    assert loss.observables.get("density", 1).tolist() == [700.0]
+    assert loss.observables.get("loss", 1).tolist() == [0.0]
+    assert "mm_energies" not in loss.observables.columns()
+
+
+def test_md_cache_key_depends_on_modes(tmpdir):
+    from coffe.grow.evaluation_cache import EvaluationCache
+    from coffe.grow.objective_functions import TopFileTemplate
+    tmpdir.join("conf.gro").write("gro")
+    tmpdir.join("md.mdp").write("mdp")
+    tmpdir.join("topol.top.template").write("<X_1>")
+    loss = MultiscaleLossFunction(str(tmpdir), opt_with_mm=False)
+    loss.mdp_dir = str(tmpdir)
+    loss.mdp_files = ["md.mdp"]
+    loss.gro_file = str(tmpdir.join("conf.gro"))
+    loss.top_template = TopFileTemplate(str(tmpdir.join("topol.top.template")), "topol.top")
+    loss.eval_cache = EvaluationCache(str(tmpdir.join("cache.sqlite")))
+    keys = [loss._cache_key("md", [0.3])]
+    loss.adaptive = {"target_error": 0.5, "max_time": 1000.0}
+    keys.append(loss._cache_key("md", [0.3]))
+    loss.adaptive = None
+    loss.early_stopping = True
+    keys.append(loss._cache_key("md", [0.3]))
+    loss.warm_start_radius = 0.05
+    keys.append(loss._cache_key("md", [0.3]))
+    assert len(set(keys)) == 4
+
+
+def test_bundles_exclude_early_stopping(tmpdir):
+    from coffe.core.decorators import ConfigError
+    loss = MultiscaleLossFunction(str(tmpdir), opt_with_mm=False)
+    loss.adaptive = {"target_error": 0.5, "max_time": None}
+    with pytest.raises(ConfigError):
+        loss._init_batch_sys(batch_system=None, batch_template=None,
+                             on_cluster=False, bundle_size=2)
+    loss.adaptive = None
+    loss.early_stopping = True
+    with pytest.raises(ConfigError):
+        loss._init_batch_sys(batch_system=None, batch_template=None,
+                             on_cluster=False, bundle_size=2)
+    loss._init_batch_sys(batch_system=None, batch_template=None,
+                         on_cluster=False, bundle_size=1)
+    assert loss.bundler is None
+
+
+def test_mm_cache_key_ignores_prepared_conformers(tmpdir):
+    from coffe.grow.evaluation_cache import EvaluationCache
+    bin_dir = tmpdir.mkdir("BIN")
+    bin_dir.mkdir("00_qm_opt").join("molecule-1-psi.inp.log").write("qm")
+    bin_dir.mkdir("06_mm_opt").join("frcmod.extrm.w2p").write("frcmod")
+    loss = MultiscaleLossFunction(str(tmpdir), opt_with_md=False)
+    loss.bin_dir = str(bin_dir)
+    loss.target_names = ["molecule-1"]
+    for name in ["extrm_template", "mol2_file", "leaprc_file", "w2p_file", "targets"]:
+        tmpdir.join(name).write(name)
+        setattr(loss, name, str(tmpdir.join(name)))
+
+    def key():
+        loss.eval_cache = EvaluationCache(str(tmpdir.join("cache.sqlite")))
+        return loss._cache_key("mm", [0.3])
+
+    first = key()
+    # files written by the evaluations
+    bin_dir.join("06_mm_opt").mkdir("prepared-0123").join("leap.log").write("log")
+    bin_dir.join("06_mm_opt").join("prepared-0123.lock").write("")
+    assert key() == first
+    bin_dir.join("06_mm_opt").join("frcmod.extrm.w2p").write("changed")
+    assert key() != first
+
+
+def test_fast_mm_loss(tmpdir):
+    from queue import Queue
+    from coffe.amb.prmtop import AmberPrmtop
+    from coffe.grow.lj_decomposition import LJDecomposition
+    from coffe.grow.objective_functions import FastMMLossFunction
+    from tests.grow.test_lj_decomposition import BUTANE, conformers
+    np.random.seed(0)
+    template = tmpdir.join("extrm.dat")
+    template.write("NONBON\n  c3  <X_1>  <X_3>\n  hc  <X_2>  <X_4>\nEND\n")
+    targets = tmpdir.join("targets.txt")
+    targets.write("0.0\n1.0\n2.0\n")
+
+    decomposition = LJDecomposition(AmberPrmtop(PRMTOP), conformers(3),
+                                    atoms=BUTANE)
+    loss = FastMMLossFunction(str(tmpdir), decomposition)
+    loss.extrm_template = str(template)
+    loss.targets = str(targets)
+    loss.scale_mm, loss.weight_mm = 1e-4, 0.5
+
+    X = np.random.uniform([0.3, 0.2, 0.3, 0.05], [0.4, 0.3, 0.5, 0.15],
+                          size=(50, 4))
+    values = loss.values(X)
+    assert values.shape == (50,)
+    res_queue = Queue()
+    loss.get_function_value(X[7], 7, res_queue)
+    feval_number, xi, res = res_queue.get()
+    assert feval_number == 7
+    assert res == pytest.approx(values[7])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.observable_store"""
+
+import numpy as np
+import pytest
+
+from coffe.grow.observable_store import ObservableStore
+
+
+def test_append_and_read(tmpdir):
+    store = ObservableStore(str(tmpdir.join("observables")))
+    store.append(0, x=[0.1, 0.2], loss=0.5, series=[1.0, 2.0, 3.0])
+    store.append(1, x=[0.3, 0.4], loss=0.25, series=[4.0])
+    store.append(2, x=[0.5, 0.6], series=None)
+    assert store.columns() == ["loss", "series", "x"]
+
+    fevals, offsets, values = store.read("series")
+    assert fevals.tolist() == [0, 1]
+    assert offsets.tolist() == [0, 3, 4]
+    assert isinstance(values, np.memmap)
+    assert store.get("series", 1).tolist() == [4.0]
+    assert store.get("series", 2) is None
+
+    fevals, x = store.matrix("x")
+    assert fevals.tolist() == [0, 1, 2]
+    assert x.tolist() == [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]]
+    with pytest.raises(ValueError):
+        store.matrix("series")
+    assert store.read("missing")[0].tolist() == []
+
+
+def test_crashed_write(tmpdir):
+    store = ObservableStore(str(tmpdir))
+    store.append(0, series=[1.0, 2.0])
+    # a row whose values were written, but not its index entry
+    with open(store._data_file("series"), "ab") as f:
+        f.write(np.array([9.0, 9.0, 9.0]).tobytes())
+    with open(store._index_file("series"), "ab") as f:
+        f.write(b"\x01\x02")
+    reopened = ObservableStore(str(tmpdir))
+    assert reopened.read("series")[0].tolist() == [0]
+    reopened.append(1, series=[3.0])
+    assert reopened.get("series", 0).tolist() == [1.0, 2.0]
+    assert reopened.get("series", 1).tolist() == [3.0]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.optimization_algorithms"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from coffe.grow.optimization_algorithms import BayesianOptimization, Batch
+
+
+class QuadraticLoss(object):
+    """A cheap stand-in for MultiscaleLossFunction."""
+
+    def __init__(self, delays=None):
+        self.delays = delays if delays is not None else {}
+
+    def get_function_value(self, xi, feval_number, res_queue=None):
+        time.sleep(self.delays.get(feval_number, 0.0))
+        res = 0.1 + sum((x - 0.2)**2 for x in xi)
+        res_queue.put((feval_number, xi, res))
+
+
+@pytest.fixture
+def opt_config(tmpdir):
+    cfg = os.path.join(str(tmpdir), "opt.cfg")
+    with open(cfg, "w") as f:
+        f.write("[OPT]\n")
+        f.write("bounds = [(0.15, 0.52), (0.05, 0.25), "
+                "(0.15, 0.70), (0.01, 0.35)]\n")
+    return cfg
+
+
+def test_batch_wait_for_any(tmpdir):
+    import pandas as pd
+    df = pd.DataFrame(columns=["x1", "obs"])
+    df.loc[0] = [1.0, -1]
+    df.loc[1] = [2.0, -1]
+    batch = Batch(str(tmpdir), QuadraticLoss(delays={0: 1.0}), df)
+    batch.submit(([1.0], 0))
+    batch.submit(([2.0], 1))
+    assert batch.n_running == 2
+    # the fast evaluation is collected before the slow one has finished
+    assert batch.wait_for_any() == [1]
+    assert batch.n_running == 1
+    assert df.loc[1, "obs"] > 0
+    assert df.loc[0, "obs"] == -1
+    assert batch.wait_for_any() == [0]
+    assert batch.n_running == 0
+    assert os.path.isfile(os.path.join(str(tmpdir), "batch.csv"))
+    assert [(i, obs > 0) for i, x, obs, status in batch.journal.replay()] == \
+        [(0, True), (1, True)]
+
+
+def test_batch_result_collected_before_thread_finished(tmpdir):
+    import threading
+    import pandas as pd
+
+    class SlowReturnLoss(QuadraticLoss):
+        def __init__(self):
+            super(SlowReturnLoss, self).__init__()
+            self.done = threading.Event()
+
+        def get_function_value(self, xi, feval_number, res_queue=None):
+            super(SlowReturnLoss, self).get_function_value(xi, feval_number, res_queue)
+            self.done.wait(10)
+
+    df = pd.DataFrame(columns=["x1", "obs"])
+    df.loc[0] = [2.0, -1]
+    loss = SlowReturnLoss()
+    batch = Batch(str(tmpdir), loss, df)
+    batch.submit(([2.0], 0))
+    while batch.res_queue.empty():
+        time.sleep(0.01)
+    # the result is drained while the evaluation thread is still running
+    batch._update_file()
+    loss.done.set()
+    assert batch.wait_for_any() == [0]
+    assert df.loc[0, "obs"] > 0
+    assert [status for i, x, obs, status in batch.journal.replay()] == ["completed"]
+
+
+def test_recover_from_journal(tmpdir, opt_config):
+    out_path = str(tmpdir)
+    opt = BayesianOptimization(out_path, opt_config, QuadraticLoss())
+    journal = opt.batch_queue.journal
+    journal.submitted(0, [0.2, 0.1, 0.3, 0.1])
+    journal.completed(0, 0.5)
+    journal.submitted(1, [0.3, 0.2, 0.4, 0.2])
+    # the run was aborted while evaluation 1 was running
+
+    opt = BayesianOptimization(out_path, opt_config, QuadraticLoss())
+    assert opt.batch_queue.pending_evaluations()
+    opt._read_batch_file()
+    opt.batch_queue.process_queue(2, opt.df)
+    assert list(opt.df.index) == [0, 1]
+    assert opt.df.loc[0, "obs"] == 0.5
+    assert opt.df.loc[1, "obs"] == pytest.approx(0.15)
+    assert os.path.isfile(os.path.join(out_path, "batch.csv"))
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("model_update", ["full", "incremental"])
+def test_async_optimization(tmpdir, opt_config, monkeypatch, model_update):
+    monkeypatch.chdir(str(tmpdir))  # cma writes its logs to the cwd
+    np.random.seed(0)
+    out_path = os.path.join(str(tmpdir), "out")
+    os.mkdir(out_path)
+    opt = BayesianOptimization(out_path, opt_config, QuadraticLoss(),
+                               max_fevals=8, init_fevals=4,
+                               par_evals_init=4, par_evals_opt=2,
+                               async_evals=True, model_update=model_update)
+    opt.optimize()
+    assert len(opt.df) == 8
+    assert (opt.df["obs"] > 0).all()
+    assert opt.batch_queue.n_running == 0
+
+
+def test_lcb_vectorized():
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    X = np.random.uniform(0, 10, size=(20, 4))
+    gp = GaussianProcessRegressor().fit(X, np.sin(X).sum(axis=1))
+    population = np.random.uniform(0, 10, size=(8, 4))
+    lcb = BayesianOptimization._lcb(population, gp, 2.0)
+    assert lcb.shape == (8,)
+    for x, value in zip(population, lcb):
+        mean, std = gp.predict([x], return_std=True)
+        assert value == pytest.approx(mean[0] - 2.0*std[0])
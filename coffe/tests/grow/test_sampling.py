@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.sampling"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from coffe.grow import sampling
+
+BOUNDS = [(0.15, 0.52), (0.05, 0.25), (0.15, 0.70), (0.01, 0.35)]
+
+
+def test_anneal_keeps_latin_hypercube():
+    np.random.seed(0)
+    X = sampling._constraint_lhs(4, np.array(BOUNDS), 30)
+    Y, f = sampling._anneal(X, None, 1)
+    # swaps only permute the coordinates
+    for comp in range(4):
+        assert sorted(np.array(Y)[:, comp]) == sorted(np.array(X)[:, comp])
+    # the incrementally updated min distance is the true one
+    assert f == pytest.approx(sampling.min_distance(Y))
+    assert f >= sampling.min_distance(X)
+
+
+def test_anneal_with_existing_points():
+    np.random.seed(1)
+    existing = sampling._constraint_lhs(4, np.array(BOUNDS), 20)
+    X = sampling._constraint_lhs(4, np.array(BOUNDS), 10)
+    Y, f = sampling._anneal(X, existing, 2)
+    expected = min(sampling.min_distance(Y), cdist(Y, existing).min())
+    assert f == pytest.approx(expected)
+
+
+def test_maximin_design_restarts():
+    np.random.seed(3)
+    X = sampling.maximin_design(20, BOUNDS, restarts=2, n_jobs=2)
+    assert len(X) == 20
+    assert all(len(x) == 4 for x in X)
+    for x in X:
+        for xi, (lb, ub) in zip(x, BOUNDS):
+            assert lb <= xi <= ub
+
+
+def test_lh_sampling_optimize():
+    np.random.seed(4)
+    X = sampling.lh_sampling(10, BOUNDS, optimize=True)
+    assert len(X) == 10
+    assert isinstance(X[0], list)
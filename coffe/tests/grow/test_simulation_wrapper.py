@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.simulation_wrapper"""
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+
+from coffe.grow import simulation_wrapper
+from coffe.grow.simulation_wrapper import GromacsSimulation, SimulationBundler
+
+
+def test_bundler(tmpdir, monkeypatch):
+    bundles = []
+
+    def fake_bundle(chains, work_dir):
+        def run():
+            bundles.append(sorted(chains))
+        return run
+
+    monkeypatch.setattr(simulation_wrapper.simgen, "bundle", fake_bundle)
+    bundler = SimulationBundler(str(tmpdir.join("bundles")), 2, wait=0.5)
+    threads = [threading.Thread(target=bundler.run, args=(i,))
+               for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert not any(t.is_alive() for t in threads)
+    # two full bundles and a single simulation after the waiting time
+    assert sorted(len(b) for b in bundles) == [1, 2, 2]
+    assert sorted(i for b in bundles for i in b) == list(range(5))
+    assert bundler.n_bundles == 3
+
+
+def test_failed_chain_is_no_warm_start_source(tmpdir, monkeypatch):
+    class FakeBundler(object):
+        def __init__(self, completed):
+            self.completed = completed
+
+        def run(self, chain):
+            return self.completed
+
+    class FakeTemplate(object):
+        file_name = "topol.top"
+
+        def write_to(self, dir_name, x):
+            pass
+
+    added = []
+    monkeypatch.setattr(GromacsSimulation, "_init_chain",
+                        lambda self: setattr(self, "chain", None))
+    for completed in [False, True]:
+        sim = GromacsSimulation.__new__(GromacsSimulation)
+        sim.dir_name = str(tmpdir)
+        sim.top_template = FakeTemplate()
+        sim.bundler = FakeBundler(completed)
+        sim.library = type("Library", (), {"add": lambda self, x, d: added.append(x)})()
+        sim.simulate([0.1 * completed])
+    assert added == [[0.1]]
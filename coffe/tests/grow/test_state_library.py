@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for coffe.grow.state_library"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import pytest
+
+from coffe.grow.state_library import EquilibratedStateLibrary
+
+STAGES = ["minim", "equi", "production"]
+
+
+def finished_chain(tmpdir, name, first=0):
+    chain_dir = tmpdir.mkdir(name)
+    for stage in STAGES[first:]:
+        stage_dir = chain_dir.mkdir(stage)
+        stage_dir.join("confout.gro").write("")
+        if stage != "minim":
+            stage_dir.join("state.cpt").write("")
+    return str(chain_dir)
+
+
+def test_warm_start(tmpdir):
+    path = str(tmpdir.join("states.jsonl"))
+    library = EquilibratedStateLibrary(path, 0.05)
+    assert library.warm_start([0.3, 0.1], STAGES) is None
+    a = finished_chain(tmpdir, "a")
+    b = finished_chain(tmpdir, "b")
+    library.add([0.3, 0.1], a)
+    library.add([0.4, 0.2], b)
+    assert library.nearest([0.39, 0.2]) == (pytest.approx(0.025), b)
+    # starts at the last stage before production from the state of minim
+    assert library.warm_start([0.39, 0.2], STAGES) == \
+        (1, os.path.join(b, "minim", "confout.gro"), None)
+    # too far away
+    assert library.warm_start([0.35, 0.15], STAGES) is None
+
+    # continued run
+    library = EquilibratedStateLibrary(path, 0.05, first_stage="production")
+    assert len(library) == 2
+    assert library.warm_start([0.3, 0.1], STAGES) == \
+        (2, os.path.join(a, "equi", "confout.gro"),
+         os.path.join(a, "equi", "state.cpt"))
+
+
+def test_warm_start_from_warm_started_chain(tmpdir):
+    library = EquilibratedStateLibrary(str(tmpdir.join("states.jsonl")), 0.05)
+    a = finished_chain(tmpdir, "a")
+    # b was warm-started from a and has no minim stage
+    b = finished_chain(tmpdir, "b", first=1)
+    library.add([0.3, 0.1], a)
+    library.add([0.31, 0.1], b)
+    # the first stage of b is used
+    assert library.warm_start([0.312, 0.1], STAGES) == \
+        (1, os.path.join(b, "equi", "confout.gro"),
+         os.path.join(b, "equi", "state.cpt"))
+    # the nearest chain has no states (e.g. removed); the next one is used
+    library.add([0.3125, 0.1], str(tmpdir.join("c")))
+    assert library.warm_start([0.3125, 0.1], STAGES) == \
+        (1, os.path.join(b, "equi", "confout.gro"),
+         os.path.join(b, "equi", "state.cpt"))
+    os.remove(os.path.join(b, "equi", "confout.gro"))
+    assert library.warm_start([0.3125, 0.1], STAGES) == \
+        (1, os.path.join(a, "minim", "confout.gro"), None)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the coffe console script's entry point."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from coffe.core import saver
+from coffe.core.status import Status
+
+# The status updates run twice in every cluster job.
+START_UP_BUDGET = 0.2  # seconds
+
+# the directory that contains the coffe package (and the tests)
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def subprocess_env():
+    """The environment of the subprocesses, independent of the cwd and
+    environment that other tests leave behind."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [PACKAGE_ROOT] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    return env
+
+
+def run_entry(*args):
+    return subprocess.check_output(
+        [sys.executable, "-m", "coffe.entry"] + list(args),
+        stderr=subprocess.STDOUT, cwd=PACKAGE_ROOT,
+        env=subprocess_env()).decode("latin-1")
+
+
+def test_update_cluster_status(tmpdir):
+    status_file = str(tmpdir.join("job.status"))
+    Status.write(status_file, Status.queueing, 1234)
+    run_entry("core", "update-cluster-status", "running", status_file)
+    assert Status.read(status_file) == (Status.running, 1234)
+
+
+def test_status_update_import_time():
+    """Status updates must not import the command line interface."""
+    out = subprocess.check_output(
+        [sys.executable, "-c",
+         "import sys; from coffe import entry; from coffe.core import status; "
+         "print(sorted(m for m in ('coffe.cli', 'click', 'pandas', 'numpy', "
+         "'plumbum', 'pkg_resources') if m in sys.modules))"],
+        cwd=PACKAGE_ROOT, env=subprocess_env())
+    assert out.decode("latin-1").strip() == "[]"
+
+
+@pytest.mark.slow
+def test_status_update_start_up_time(tmpdir):
+    status_file = str(tmpdir.join("job.status"))
+    Status.write(status_file, Status.queueing, 1234)
+    run_entry("--help")  # warm up the file system cache
+    timings = []
+    for _ in range(3):
+        start = time.time()
+        run_entry("core", "update-cluster-status", "running", status_file)
+        timings.append(time.time() - start)
+    assert min(timings) < START_UP_BUDGET
+
+
+class Touch(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self):
+        open(self.filename, "w").close()
+
+
+def test_run_class(tmpdir):
+    touched = str(tmpdir.join("touched"))
+    pickled = saver.save(Touch(touched), str(tmpdir.join("touch.pickle")))
+    assert "Running instance" in run_entry("run-class", pickled)
+    assert tmpdir.join("touched").check()
+
+
+def test_other_commands():
+    assert "Console script for coffe" in run_entry("--help")